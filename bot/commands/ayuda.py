@@ -2,19 +2,25 @@
 
 USAGE = "!ayuda"
 DESCRIPTION = "Muestra esta lista de comandos disponibles."
+ALIASES = ("help", "comandos")
+ARGS = (0, 0)
+CACHE_TTL = 300
+RATE_LIMIT_ROOM = (5, 60)
 
 from core.command_registry import COMMANDS
+from core.outbox import outbox
 
 async def run(client, room_id, event, args):
     lines = []
     for name, info in sorted(COMMANDS.items()):
         usage = info["usage"]
         desc = info["description"]
-        lines.append(f"• **{usage}** — {desc}")
+        aliases = ", ".join(f"`!{alias}`" for alias in info["aliases"])
+        lines.append(f"• **{usage}** — {desc}" + (f" (también {aliases})" if aliases else ""))
 
     help_text = "\n".join(lines)
 
-    await client.send_text(
+    outbox.send_text(
         room_id,
         f"📘 **Comandos disponibles:**\n\n{help_text}\n\nUsa `!<comando>` para ejecutarlos."
     )
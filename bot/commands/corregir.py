@@ -0,0 +1,39 @@
+USAGE = "!corregir <id de pregunta>"
+DESCRIPTION = "Vuelve a corregir todas las respuestas de una pregunta de texto (solo profesores)."
+ARGS = (1, 1)
+RATE_LIMIT_USER = (2, 60)
+HEAVY = True
+
+from core.db.constants import *
+from core.db.constants import DB_MODULES
+from config import DB_TYPE
+from core.grading import GRADED_TYPES, regrade_question
+from core.outbox import outbox
+
+
+async def run(client, room_id, event, args):
+    db = DB_MODULES[DB_TYPE]["queries"]
+
+    if not args[0].isdigit():
+        outbox.send_text(room_id, f"⚠️ Uso correcto: {USAGE}")
+        return
+    question_id = int(args[0])
+
+    user = await db.get_user_by_matrix_id(event.sender)
+    if not user or not user[COL_USER_IS_TEACHER]:
+        outbox.send_text(room_id, "❌ Solo los profesores pueden recorregir preguntas.")
+        return
+
+    question = await db.get_question_answer_key(question_id)
+    if not question or question[COL_QUESTION_TEACHER_ID] != user[COL_USER_ID]:
+        outbox.send_text(room_id, f"❌ No tienes ninguna pregunta #{question_id}.")
+        return
+    if question[COL_QUESTION_QTYPE] not in GRADED_TYPES:
+        outbox.send_text(room_id, f"❌ La pregunta #{question_id} no es de respuesta corta ni numérica.")
+        return
+
+    updated = await regrade_question(question_id)
+    if updated is None:
+        outbox.send_text(room_id, f"⚠️ No se pudo recorregir la pregunta #{question_id}, inténtalo de nuevo.")
+    else:
+        outbox.send_text(room_id, f"✅ Pregunta #{question_id}: {updated} respuestas recorregidas.")
@@ -2,12 +2,11 @@
 
 USAGE = "!hola <nombre>"
 DESCRIPTION = "Comprueba si el bot está activo."
+ARGS = (1, 1)
+
+from core.outbox import outbox
 
 async def run(client, room_id, event, args):
-    if len(args) != 1:
-        await client.send_text(room_id, "⚠️ Uso correcto: !hola <nombre>")
-        return
-    
     sender = event.sender
     name = args[0]
-    await client.send_text(room_id, f"👋 ¡Hola {sender}! Soy tu bot de ayuda docente {args[0]}🤖")
+    outbox.send_text(room_id, f"👋 ¡Hola {sender}! Soy tu bot de ayuda docente {args[0]}🤖")
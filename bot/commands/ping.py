@@ -2,6 +2,9 @@
 
 USAGE = "!ping"
 DESCRIPTION = "Comprueba si el bot está activo."
+ARGS = (0, 0)
+
+from core.outbox import outbox
 
 async def run(client, room_id, event, args):
-    await client.send_text(room_id, "🏓 Pong!")
+    outbox.send_text(room_id, "🏓 Pong!")
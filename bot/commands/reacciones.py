@@ -1,62 +1,112 @@
-USAGE = "!reacciones"
+USAGE = "!reacciones [sala] [--top N] [--pagina P]"
 DESCRIPTION = "Muestra las reacciones dadas (profesores) o recibidas (alumnos)."
+ALIASES = ("r",)
+ARGS = (0, 5)
+CACHE_TTL = 30
+RATE_LIMIT_USER = (3, 60)
+RATE_LIMIT_ROOM = (20, 60)
+HEAVY = True
 
+import config
 from core.db.constants import *
 from core.db.constants import DB_MODULES
 from config import DB_TYPE
+from core.outbox import outbox
 
-async def run(client, room_id, event):
+# Filas (sala + alumno/profesor) por página
+REACCIONES_PAGE_SIZE = getattr(config, "REACCIONES_PAGE_SIZE", 50)
+
+
+def parse_args(args):
+    """Devuelve (shortcode, top, página) o lanza ValueError si los argumentos no son válidos."""
+    shortcode, top, page = None, None, 1
+    it = iter(args)
+    for arg in it:
+        if arg in ("--top", "--pagina"):
+            value = next(it, None)
+            if value is None or not value.isdigit() or int(value) < 1:
+                raise ValueError(f"`{arg}` necesita un número mayor que 0")
+            if arg == "--top":
+                top = int(value)
+            else:
+                page = int(value)
+        elif arg.startswith("--") or shortcode is not None:
+            raise ValueError(f"Argumento no reconocido: `{arg}`")
+        else:
+            shortcode = arg
+    return shortcode, top, page
+
+
+async def run(client, room_id, event, args):
     db = DB_MODULES[DB_TYPE]["queries"]
 
+    try:
+        shortcode, top, page = parse_args(args)
+    except ValueError as e:
+        outbox.send_text(room_id, f"⚠️ {e}. Uso correcto: {USAGE}")
+        return
+
     mxid = event.sender
     user = await db.get_user_by_matrix_id(mxid)
 
     if not user:
-        await client.send_text(room_id, "❌ No estás registrado en el sistema.")
+        outbox.send_text(room_id, "❌ No estás registrado en el sistema.")
         return
 
-    texto = ""
     if user[COL_USER_IS_TEACHER]:
-        reactions = await db.get_reacciones_por_profesor(mxid)
-        if not reactions:
-            texto = "❌ No has puesto ninguna reacción aún."
-        else:
-            texto = "❤️ **Reacciones puestas:**\n\n"
-            last_course = None
-            last_student = None
-            for r in reactions:
-                if last_course != r[COL_REACTION_ROOM_ID]:
-                    if last_course is not None:
-                        texto += "\n"
-                    last_course = r[COL_REACTION_ROOM_ID]
-                    texto += f"📚 Sala: {r[COL_REACTION_ROOM_ID]}\n"
-                    last_student = None
-                if last_student != r[JOINED_REACTION_STUDENT_MATRIX_ID]:
-                    if last_student is not None:
-                        texto += "\n"
-                    last_student = r[JOINED_REACTION_STUDENT_MATRIX_ID]
-                    texto += f"    👤 Alumno: {r[JOINED_REACTION_STUDENT_MATRIX_ID]} (Moodle ID: {r[JOINED_REACTION_STUDENT_MOODLE_ID]})\n"
-                texto += f"        • {r[COL_REACTION_EMOJI]} - {r[COL_REACTION_COUNT]}\n"
+        fetch = db.get_reacciones_por_profesor
+        title = "❤️ **Reacciones puestas:**"
+        empty = "❌ No has puesto ninguna reacción aún."
+        label, other_matrix_id, other_moodle_id = (
+            "Alumno", JOINED_REACTION_STUDENT_MATRIX_ID, JOINED_REACTION_STUDENT_MOODLE_ID
+        )
     else:
-        reactions = await db.get_reacciones_por_estudiante(mxid)
-        if not reactions:
-            texto = "❌ No has recibido reacciones aún."
+        fetch = db.get_reacciones_por_estudiante
+        title = "❤️ **Reacciones recibidas:**"
+        empty = "❌ No has recibido reacciones aún."
+        label, other_matrix_id, other_moodle_id = (
+            "Profesor", JOINED_REACTION_TEACHER_MATRIX_ID, JOINED_REACTION_TEACHER_MOODLE_ID
+        )
+
+    rows = await fetch(
+        mxid, shortcode, top,
+        limit=REACCIONES_PAGE_SIZE, offset=(page - 1) * REACCIONES_PAGE_SIZE,
+    )
+    if not rows:
+        if page > 1:
+            outbox.send_text(room_id, f"❌ No hay página {page}.")
+        elif shortcode is not None:
+            outbox.send_text(room_id, f"❌ No hay reacciones en la sala {shortcode}.")
         else:
-            texto = "❤️ **Reacciones recibidas:**\n\n"
-            last_course = None
-            last_teacher = None
-            for r in reactions:
-                if last_course != r[COL_REACTION_ROOM_ID]:
-                    if last_course is not None:
-                        texto += "\n"
-                    last_course = r[COL_REACTION_ROOM_ID]
-                    texto += f"📚 Sala: {r[COL_REACTION_ROOM_ID]}\n"
-                    last_teacher = None
-                if last_teacher != r[JOINED_REACTION_TEACHER_MATRIX_ID]:
-                    if last_teacher is not None:
-                        texto += "\n"
-                    last_teacher = r[JOINED_REACTION_TEACHER_MATRIX_ID]
-                    texto += f"    👤 Profesor: {r[JOINED_REACTION_TEACHER_MATRIX_ID]} (Moodle ID: {r[JOINED_REACTION_TEACHER_MOODLE_ID]})\n"
-                texto += f"        • {r[COL_REACTION_EMOJI]} - {r[COL_REACTION_COUNT]}\n"
-
-    await client.send_text(room_id, texto)
+            outbox.send_text(room_id, empty)
+        return
+
+    total_rows = rows[0][JOINED_REACTION_TOTAL_ROWS]
+    pages = -(-total_rows // REACCIONES_PAGE_SIZE)
+
+    message = outbox.chunked(room_id)
+    message.add(title)
+    message.add()
+    last_room = None
+    for r in rows:
+        if last_room != r[JOINED_REACTION_ROOM_SHORTCODE]:
+            if last_room is not None:
+                message.add()
+            last_room = r[JOINED_REACTION_ROOM_SHORTCODE]
+            message.add(f"📚 Sala: {last_room}")
+        emojis = ", ".join(
+            f"{emoji} {count}"
+            for emoji, count in zip(r[JOINED_REACTION_EMOJIS], r[JOINED_REACTION_COUNTS])
+        )
+        message.add(
+            f"    👤 {label}: {r[other_matrix_id]} (Moodle ID: {r[other_moodle_id]})"
+            f" — {r[JOINED_REACTION_TOTAL]} · {emojis}"
+        )
+
+    if pages > 1:
+        message.add()
+        footer = f"📄 Página {page}/{pages}"
+        if page < pages:
+            footer += f" — usa `--pagina {page + 1}` para ver más"
+        message.add(footer)
+    message.flush()
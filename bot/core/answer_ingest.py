@@ -0,0 +1,139 @@
+# core/answer_ingest.py
+"""
+Ingesta por lotes de las respuestas a preguntas.
+
+Cuando se abre una pregunta en una sala de 300 alumnos llegan cientos de
+respuestas en pocos segundos. En lugar de una transacción por respuesta, el
+handler encola la respuesta con `submit(...)` y recibe un futuro: las
+respuestas se acumulan durante `ANSWER_FLUSH_INTERVAL_MS` ms (o hasta
+`ANSWER_FLUSH_MAX_ENTRIES`) y se guardan con una única sentencia que inserta
+las filas de question_responses y de response_options, calcula
+response_version y marca `late` frente a end_at.
+
+Cada `submit` devuelve (response_id, response_version, late, closed), None si
+el alumno ya había respondido y la pregunta no admite reenvíos, o False si el
+lote no se pudo guardar. Con `closes=True` la respuesta cierra la pregunta
+(close_on_first_correct) en la misma sentencia que la guarda; `closed` indica
+si fue esta respuesta la que la cerró.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+import config
+from config import DB_TYPE
+from core.db.constants import DB_MODULES
+
+logger = logging.getLogger("answers")
+
+ANSWER_FLUSH_INTERVAL_MS = getattr(config, "ANSWER_FLUSH_INTERVAL_MS", 50)
+ANSWER_FLUSH_MAX_ENTRIES = getattr(config, "ANSWER_FLUSH_MAX_ENTRIES", 500)
+
+
+class AnswerIngest:
+    """Acumula respuestas unos milisegundos y las guarda por lotes."""
+
+    def __init__(self, flush_interval_ms=ANSWER_FLUSH_INTERVAL_MS, max_entries=ANSWER_FLUSH_MAX_ENTRIES):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_entries = max_entries
+
+        # (fila para insert_question_responses, futuro del que espera el resultado)
+        self._pending = []
+        self._handle = None
+        self._tasks = set()
+        self._flush_lock = asyncio.Lock()
+
+        self.batches = 0
+        self.saved = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def submit(self, question, student_id, option_ids=(), text=None, timestamp_ms=None, closes=False, score=None):
+        """
+        Encola una respuesta y devuelve un futuro con su resultado.
+        `score` es la puntuación automática (core/grading.py), o None si no se corrige sola.
+
+        `timestamp_ms` es la hora del evento de Matrix (origin_server_ts), con
+        la que se decide si la respuesta llega tarde; si no se indica, se usa
+        la hora actual.
+        """
+        if timestamp_ms is not None:
+            submitted_at = datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc)
+        else:
+            submitted_at = datetime.now(timezone.utc)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((
+            (question.id, student_id, tuple(option_ids), text,
+             question.allow_multiple_submissions, question.allow_multiple_answers, submitted_at, closes, score),
+            future,
+        ))
+
+        if len(self._pending) >= self.max_entries:
+            self._flush_soon()
+        elif self._handle is None:
+            # El temporizador solo corre mientras hay respuestas esperando
+            self._handle = asyncio.get_running_loop().call_later(self.flush_interval, self._flush_soon)
+        return future
+
+    def _flush_soon(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        task = asyncio.create_task(self.flush(), name="answer-ingest")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        """Guarda las respuestas pendientes y resuelve el futuro de cada una."""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+
+            db = DB_MODULES[DB_TYPE]["queries"]
+            results = await db.insert_question_responses([row for row, _ in batch])
+            self.batches += 1
+
+            if results is None:
+                self.failed += len(batch)
+                logger.warning(f"No se pudo guardar un lote de {len(batch)} respuestas")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(False)
+                return
+
+            for position, (_, future) in enumerate(batch):
+                result = results.get(position)
+                if result is None:
+                    self.rejected += 1
+                else:
+                    self.saved += 1
+                if not future.done():
+                    future.set_result(result)
+
+    async def close(self):
+        """Guarda lo pendiente y espera a los volcados en curso."""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+
+    def stats(self):
+        """Devuelve contadores de la ingesta."""
+        return {
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "saved": self.saved,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }
+
+    def __len__(self):
+        return len(self._pending)
+
+
+answer_ingest = AnswerIngest()
@@ -0,0 +1,120 @@
+# core/answers.py
+"""
+Respuestas de los alumnos a las preguntas abiertas.
+
+Un mensaje que empieza por `ANSWER_PREFIX` (p. ej. `=B`, `=A,C`, `=42` o
+`=#12 B` para una pregunta concreta) se clasifica con el índice de preguntas
+abiertas, sin tocar la BD, y solo si es una respuesta válida se pasa a la
+ingesta por lotes (core/answer_ingest.py). Las confirmaciones se agrupan por
+pregunta para no inundar la sala cuando responde toda la clase a la vez.
+
+Los reenvíos a preguntas que no los admiten se rechazan con el índice, que
+sabe qué alumnos ya respondieron, sin llegar a la BD.
+
+close_on_first_correct: la respuesta se corrige en memoria y, si es la primera
+correcta, la pregunta se cierra en el índice antes de encolarla (las
+siguientes ya no la encuentran abierta) y en la BD con la misma sentencia que
+guarda la respuesta. Si la respuesta no cierra la pregunta en la BD (no se
+guardó o ya estaba cerrada), se deshace el cierre en memoria.
+
+Cada respuesta se reclama en `seen_events` antes de encolarla, así que una
+segunda entrega del mismo evento no guarda otra versión. Las respuestas que
+llegan en la puesta al día (enviadas con el bot parado) se guardan igual pero
+con `quiet=True`: no se contesta en la sala, salvo el aviso de que la pregunta
+queda cerrada.
+"""
+
+from config import DB_TYPE
+from core.db.constants import *
+from core.db.constants import DB_MODULES
+from core.answer_ingest import answer_ingest
+from core.dedup import seen_events
+from core.grading import auto_score, is_correct
+from core.outbox import outbox
+from core.question_index import ANSWER_PREFIX, InvalidAnswer, question_index
+
+
+def _render_received(receipts):
+    return f"✅ Respuestas registradas ({len(receipts)}): {', '.join(receipts)}"
+
+
+def _receipt(sender, version, late):
+    notes = []
+    if version > 1:
+        notes.append(f"v{version}")
+    if late:
+        notes.append("tarde")
+    return f"{sender} ({', '.join(notes)})" if notes else sender
+
+
+def _reply(room_id, text, quiet):
+    if not quiet:
+        outbox.send_text(room_id, text)
+
+
+async def handle_answer(client, room_id, event, body, quiet=False):
+    try:
+        answer = question_index.classify(room_id, body[len(ANSWER_PREFIX):])
+    except InvalidAnswer as e:
+        _reply(room_id, f"⚠️ {event.sender}: {e}", quiet)
+        return
+    if answer is None:
+        # Sin preguntas abiertas, "=)" o "==" son charla, no respuestas
+        return
+
+    db = DB_MODULES[DB_TYPE]["queries"]
+    user = await db.get_user_by_matrix_id(event.sender)
+    if not user:
+        _reply(room_id, f"❌ {event.sender}: no estás registrado en el sistema.", quiet)
+        return
+    question = answer.question
+    student_id = user[COL_USER_ID]
+    if student_id == question.teacher_id:
+        return
+    if not question.is_open():
+        # Se cerró mientras se buscaba al usuario
+        _reply(room_id, f"❌ {event.sender}: la pregunta ya está cerrada.", quiet)
+        return
+    # Una segunda entrega del mismo evento (reintento de sync, puesta al día) no cuenta
+    if not await seen_events.claim(event.event_id, getattr(event, "timestamp", None)):
+        return
+    if question_index.has_answered(question, student_id):
+        # La BD la rechazaría: ni se encola ni puede cerrar la pregunta
+        _acknowledge(room_id, event.sender, question, student_id, False, None, quiet)
+        return
+
+    closes = question.close_on_first_correct and is_correct(question, answer.option_ids, answer.text) is True
+    if closes:
+        question_index.mark_closed(question)
+    question_index.record_answer(question, student_id)
+
+    # No se espera al lote: el despachador procesa los eventos de la sala de uno
+    # en uno, y esperar aquí impediría juntar en un lote las respuestas de la sala
+    future = answer_ingest.submit(
+        question, student_id, answer.option_ids, answer.text,
+        timestamp_ms=getattr(event, "timestamp", None), closes=closes,
+        score=auto_score(question, answer.text),
+    )
+    future.add_done_callback(
+        lambda f: _acknowledge(room_id, event.sender, question, student_id, closes, f.result(), quiet)
+    )
+
+
+def _acknowledge(room_id, sender, question, student_id, closes, result, quiet=False):
+    if result is False:
+        question_index.forget_answer(question, student_id)
+    if closes and not (result and result[3]):
+        # La respuesta no cerró la pregunta en la BD (no se guardó o ya estaba cerrada)
+        question_index.unmark_closed(question.id)
+
+    if result is False:
+        _reply(room_id, f"⚠️ {sender}: no se pudo guardar tu respuesta, inténtalo de nuevo.", quiet)
+    elif result is None:
+        _reply(room_id, f"ℹ️ {sender}: ya habías respondido a esta pregunta.", quiet)
+    else:
+        _, version, late, closed = result
+        if not quiet:
+            outbox.send_coalesced(room_id, ("answers", question.id), _receipt(sender, version, late), _render_received)
+        if closed:
+            title = f" «{question.title}»" if question.title else ""
+            outbox.send_text(room_id, f"🏁 {sender} ha acertado primero: la pregunta{title} queda cerrada.")
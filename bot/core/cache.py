@@ -0,0 +1,77 @@
+# core/cache.py
+"""
+Caché en memoria acotada (LRU) con caducidad por tiempo (TTL).
+
+Pensada para datos que cambian poco y se consultan en cada evento
+(usuarios, salas...). Lleva contadores de aciertos y fallos para poder medir
+su efectividad.
+"""
+
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Diccionario LRU acotado a `maxsize` entradas que caducan tras `ttl` segundos."""
+
+    def __init__(self, maxsize=1024, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Devuelve el valor si está y no ha caducado; si no, `default`."""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Guarda `value`, expulsando la entrada menos usada si se supera `maxsize`."""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        """Elimina una entrada concreta."""
+        self._data.pop(key, None)
+
+    def clear(self):
+        """Vacía la caché (los contadores se conservan)."""
+        self._data.clear()
+
+    def stats(self):
+        """Devuelve tamaño y contadores de la caché."""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[0] >= time.monotonic()
+
+    def __len__(self):
+        return len(self._data)
@@ -1,10 +1,51 @@
 # core/client_manager.py
 
 from mautrix.client import Client
+from mautrix.types import EventType, Filter, EventFilter, RoomFilter, RoomEventFilter, StateFilter
+import config
 from config import HOMESERVER, USERNAME, PASSWORD
+from core.sync_store import DBSyncStore
+
+SYNC_TIMELINE_LIMIT = getattr(config, "SYNC_TIMELINE_LIMIT", 50)
+
+# Estado de sala que el bot necesita aunque ningún handler lo escuche
+_BASE_STATE_TYPES = [EventType.ROOM_NAME]
 
 async def create_client() -> Client:
-    client = Client(HOMESERVER)
+    # El token de sync se guarda en la BD para retomar la sincronización al reiniciar
+    client = Client(HOMESERVER, sync_store=DBSyncStore(USERNAME))
     await client.login(USERNAME, PASSWORD)
     print(f"[+] Conectado como {USERNAME}")
-    return client
\ No newline at end of file
+    return client
+
+def build_sync_filter(event_types) -> Filter:
+    """
+    Construye un filtro de sync que solo deja pasar los tipos de evento con handler.
+
+    Descarta presencia, typing, recibos de lectura y account data, carga los
+    miembros de forma perezosa y limita el tamaño del timeline por sala.
+    """
+    state_types = list(_BASE_STATE_TYPES)
+    if EventType.ROOM_MEMBER in event_types:
+        state_types.append(EventType.ROOM_MEMBER)
+    nothing = []
+    return Filter(
+        presence=EventFilter(types=nothing),
+        account_data=EventFilter(types=nothing),
+        room=RoomFilter(
+            ephemeral=RoomEventFilter(types=nothing),
+            account_data=RoomEventFilter(types=nothing),
+            state=StateFilter(types=state_types, lazy_load_members=True),
+            timeline=RoomEventFilter(
+                types=list(event_types),
+                limit=SYNC_TIMELINE_LIMIT,
+                lazy_load_members=True,
+            ),
+        ),
+    )
+
+async def upload_sync_filter(client: Client, event_types):
+    """Sube al homeserver el filtro para `event_types` y devuelve su ID."""
+    filter_id = await client.create_filter(build_sync_filter(event_types))
+    print(f"[+] Filtro de sync registrado ({len(event_types)} tipos de evento): {filter_id}")
+    return filter_id
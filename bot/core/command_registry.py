@@ -1,52 +1,226 @@
 # core/command_registry.py
+"""
+Registro y ejecución de comandos.
 
+Al arrancar solo se leen los metadatos de cada módulo de `commands/`
+(analizando su código, sin importarlo); el módulo se importa la primera vez
+que alguien usa el comando. Cada módulo define `run(client, room_id, event, args)`
+y puede declarar, además de USAGE y DESCRIPTION:
+
+    ALIASES = ("r",)            # Otros nombres con los que se invoca el comando
+    ARGS = (0, 1)               # Mínimo y máximo de argumentos (None = sin máximo)
+    CACHE_TTL = 30              # Reutiliza la respuesta durante 30 s para el mismo (comando, usuario, args)
+    RATE_LIMIT_USER = (3, 60)   # Como mucho 3 llamadas cada 60 s por usuario
+    RATE_LIMIT_ROOM = (20, 60)  # Como mucho 20 llamadas cada 60 s por sala
+    HEAVY = True                # Cuenta para el límite global de COMMAND_MAX_HEAVY ejecuciones a la vez
+
+Los metadatos tienen que ser literales (se leen con `ast.literal_eval`).
+
+Las llamadas que superan un límite reciben un aviso breve ("espera unos
+segundos"), una sola vez por usuario mientras dure el límite. Las respuestas
+servidas desde la caché de CACHE_TTL no cuentan para los límites.
+"""
+
+import ast
+import asyncio
 import importlib
 import pkgutil
+from pathlib import Path
 import commands
+import config
 from config import COMMAND_PREFIX
+from core.cache import TTLCache
+from core.outbox import outbox
+from core.ratelimit import RateLimiter
+
+COMMAND_CACHE_SIZE = getattr(config, "COMMAND_CACHE_SIZE", 1000)
+COMMAND_MAX_HEAVY = getattr(config, "COMMAND_MAX_HEAVY", 4)
 
+# Nombre del comando -> metadatos (y el módulo, una vez importado)
 COMMANDS = {}
+# Nombre o alias -> nombre del comando
+TRIGGERS = {}
+
+# Metadatos que se leen del código de cada módulo, con su valor por defecto
+_METADATA = {
+    "USAGE": None,
+    "DESCRIPTION": "Sin descripción disponible.",
+    "ALIASES": (),
+    "ARGS": (0, None),
+    "CACHE_TTL": 0,
+    "RATE_LIMIT_USER": None,
+    "RATE_LIMIT_ROOM": None,
+    "HEAVY": False,
+}
+
+# Respuestas cacheadas: (comando, remitente, args) -> textos enviados a la sala
+_results = TTLCache(maxsize=COMMAND_CACHE_SIZE)
+# Usuarios ya avisados de que están limitados, hasta que acabe su espera
+_warned = TTLCache(maxsize=COMMAND_CACHE_SIZE)
+_heavy = asyncio.Semaphore(COMMAND_MAX_HEAVY)
+
+def _read_metadata(path):
+    """
+    Lee los metadatos de un módulo de comando sin importarlo.
+    Devuelve None si el módulo no define `run`.
+    """
+    tree = ast.parse(path.read_text(encoding="utf-8"), filename=str(path))
+    metadata = dict(_METADATA)
+    has_run = False
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == "run":
+            has_run = True
+        elif (isinstance(node, ast.Assign) and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name) and node.targets[0].id in _METADATA):
+            metadata[node.targets[0].id] = ast.literal_eval(node.value)
+    return metadata if has_run else None
+
+def _limiter(limit):
+    return RateLimiter(*limit) if limit else None
+
+def _register(name, metadata):
+    COMMANDS[name] = {
+        "module": None,
+        "usage": metadata["USAGE"] or f"{COMMAND_PREFIX}{name}",
+        "description": metadata["DESCRIPTION"],
+        "aliases": tuple(metadata["ALIASES"]),
+        "args": tuple(metadata["ARGS"]),
+        "cache_ttl": metadata["CACHE_TTL"],
+        "user_limiter": _limiter(metadata["RATE_LIMIT_USER"]),
+        "room_limiter": _limiter(metadata["RATE_LIMIT_ROOM"]),
+        "heavy": metadata["HEAVY"],
+    }
+    for trigger in (name, *metadata["ALIASES"]):
+        if trigger in TRIGGERS:
+            print(f"[!] El nombre `{trigger}` de {name} ya lo usa {TRIGGERS[trigger]}, se ignora.")
+            continue
+        TRIGGERS[trigger] = name
 
 def load_commands():
-    """Carga dinámicamente los comandos desde el paquete `commands`."""
-    for _, module_name, _ in pkgutil.iter_modules(commands.__path__):
+    """Registra los comandos del paquete `commands` a partir de sus metadatos (sin importarlos)."""
+    for module_info in pkgutil.iter_modules(commands.__path__):
+        module_name = module_info.name
+        path = module_info.module_finder.find_spec(module_name).origin
         try:
-            module = importlib.import_module(f"commands.{module_name}")
-
-            # Verificar que tenga un método 'run'
-            if hasattr(module, "run") and callable(module.run):
-                usage = getattr(module, "USAGE", f"!{module_name}")
-                description = getattr(module, "DESCRIPTION", "Sin descripción disponible.")
-
-                COMMANDS[module_name] = {
-                    "module": module,
-                    "usage": usage,
-                    "description": description,
-                }
-            else:
-                print(f"[!] El módulo {module_name} no tiene un 'run' válido, se ignora.")
-
+            metadata = _read_metadata(Path(path))
         except Exception as e:
-            print(f"[!] Error cargando módulo {module_name}: {e}")
+            print(f"[!] Error leyendo el comando {module_name}: {e}")
+            continue
 
-    print(f"[+] {len(COMMANDS)} comandos cargados: {list(COMMANDS.keys())}")
+        if metadata is None:
+            print(f"[!] El módulo {module_name} no tiene un 'run' válido, se ignora.")
+            continue
+        _register(module_name, metadata)
 
-async def execute_command(client, room_id, event, body):
-    if not body.startswith(COMMAND_PREFIX):
+    print(f"[+] {len(COMMANDS)} comandos registrados: {list(COMMANDS.keys())}")
+
+def _module(name):
+    """Importa el módulo del comando la primera vez que se usa."""
+    command = COMMANDS[name]
+    if command["module"] is None:
+        module = importlib.import_module(f"commands.{name}")
+        if not callable(getattr(module, "run", None)):
+            raise RuntimeError(f"El módulo {name} no tiene un 'run' válido")
+        command["module"] = module
+    return command["module"]
+
+def _retry_after(command, room_id, sender):
+    """Segundos que debe esperar `sender` para usar `command` en la sala (0 si puede ya)."""
+    wait = 0.0
+    if command["user_limiter"] is not None:
+        wait = command["user_limiter"].acquire(sender)
+    if not wait and command["room_limiter"] is not None:
+        wait = command["room_limiter"].acquire(room_id)
+    return wait
+
+def _reply_busy(room_id, sender, cmd, wait):
+    """Avisa al usuario de que espere, sin repetir el aviso mientras siga limitado."""
+    key = (cmd, sender)
+    if key in _warned:
         return
+    _warned.set(key, True, ttl=max(wait, 1.0))
+    outbox.send_text(room_id, f"⏳ {sender}, espera unos segundos antes de volver a usar `{cmd}`.")
 
-    parts = body[len(COMMAND_PREFIX):].strip().split()
+def _parse(body):
+    """
+    Devuelve (nombre del comando, texto de los argumentos) o None si no es un comando.
+    Solo se trocea el mensaje si empieza por el prefijo.
+    """
+    if not body.startswith(COMMAND_PREFIX):
+        return None
+    parts = body[len(COMMAND_PREFIX):].split(None, 1)
     if not parts:
-        await client.send_text(room_id, "⚠️ No has introducido ningún comando.")
+        return "", ""
+    return parts[0], parts[1] if len(parts) > 1 else ""
+
+async def execute_command(client, room_id, event, body):
+    parsed = _parse(body)
+    if parsed is None:
         return
-    
-    cmd = parts[0]
-    args = parts[1:]
 
-    if cmd in COMMANDS:
-        try:
-            await COMMANDS[cmd].run(client, room_id, event, args)
-        except Exception as e:
-            await client.send_text(room_id, f"⚠️ Error ejecutando comando `{cmd}`: {e}")
-    else:
-        await client.send_text(room_id, f"❌ Comando desconocido: {cmd}")
+    trigger, arg_text = parsed
+    if not trigger:
+        outbox.send_text(room_id, "⚠️ No has introducido ningún comando.")
+        return
+
+    cmd = TRIGGERS.get(trigger)
+    if cmd is None:
+        outbox.send_text(room_id, f"❌ Comando desconocido: {trigger}")
+        return
+
+    command = COMMANDS[cmd]
+    args = arg_text.split()
+    min_args, max_args = command["args"]
+    if len(args) < min_args or (max_args is not None and len(args) > max_args):
+        outbox.send_text(room_id, f"⚠️ Uso correcto: {command['usage']}")
+        return
+
+    sender = event.sender
+
+    # Una respuesta cacheada no gasta cupo: el límite es para las ejecuciones reales
+    cache_key = (cmd, sender, tuple(args))
+    if command["cache_ttl"]:
+        cached = _results.get(cache_key)
+        if cached is not None:
+            for text in cached:
+                outbox.send_text(room_id, text)
+            return
+
+    wait = _retry_after(command, room_id, sender)
+    if wait:
+        _reply_busy(room_id, sender, cmd, wait)
+        return
+
+    if command["heavy"] and _heavy.locked():
+        # No se encola: con el límite global lleno, esperar solo alarga la cola
+        _reply_busy(room_id, sender, cmd, 1.0)
+        return
+
+    try:
+        module = _module(cmd)
+        with outbox.capture() as sent:
+            if command["heavy"]:
+                async with _heavy:
+                    await module.run(client, room_id, event, args)
+            else:
+                await module.run(client, room_id, event, args)
+    except Exception as e:
+        outbox.send_text(room_id, f"⚠️ Error ejecutando comando `{cmd}`: {e}")
+        return
+
+    if command["cache_ttl"]:
+        _results.set(cache_key, [text for rid, text in sent if rid == room_id], ttl=command["cache_ttl"])
+
+def command_stats():
+    """Devuelve contadores de la caché de respuestas y de los limitadores."""
+    return {
+        "results": _results.stats(),
+        "limiters": {
+            name: {
+                kind: command[f"{kind}_limiter"].stats()
+                for kind in ("user", "room")
+                if command[f"{kind}_limiter"] is not None
+            }
+            for name, command in COMMANDS.items()
+        },
+    }
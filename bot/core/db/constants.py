@@ -1,9 +1,4 @@
 # core/db/constants.py
-from core.db.postgres import conn as pg_conn, queries as pg_queries
-
-DB_MODULES = {
-    "postgres": {"conn": pg_conn, "queries": pg_queries},
-}
 
 # Users
 TABLE_USERS = "users"
@@ -43,6 +38,42 @@ JOINED_REACTION_STUDENT_MATRIX_ID = "student_matrix_id"
 JOINED_REACTION_STUDENT_MOODLE_ID = "student_moodle_id"
 JOINED_REACTION_ROOM_SHORTCODE = "room_shortcode"
 JOINED_REACTION_ROOM_MOODLE_COURSE_ID = "room_moodle_course_id"
+JOINED_REACTION_TOTAL = "total"
+JOINED_REACTION_EMOJIS = "emojis"
+JOINED_REACTION_COUNTS = "counts"
+JOINED_REACTION_TOTAL_ROWS = "total_rows"
+
+# Reaction events (ledger)
+TABLE_REACTION_EVENTS = "reaction_events"
+
+COL_REACTION_EVENT_ID = "event_id"
+COL_REACTION_EVENT_TEACHER_ID = "teacher_id"
+COL_REACTION_EVENT_STUDENT_ID = "student_id"
+COL_REACTION_EVENT_ROOM_ID = "room_id"
+COL_REACTION_EVENT_EMOJI = "emoji"
+COL_REACTION_EVENT_CREATED_AT = "created_at"
+
+# Sync state
+TABLE_SYNC_STATE = "sync_state"
+
+COL_SYNC_STATE_USER_ID = "user_id"
+COL_SYNC_STATE_NEXT_BATCH = "next_batch"
+COL_SYNC_STATE_UPDATED_AT = "updated_at"
+
+# Processed events (dedup)
+TABLE_PROCESSED_EVENTS = "processed_events"
+
+COL_PROCESSED_EVENT_ID = "event_id"
+COL_PROCESSED_EVENT_PROCESSED_AT = "processed_at"
+
+# State snapshots
+TABLE_STATE_SNAPSHOTS = "state_snapshots"
+
+COL_STATE_SNAPSHOT_ROOM_ID = "room_id"
+COL_STATE_SNAPSHOT_STATE = "state"
+COL_STATE_SNAPSHOT_DATA = "data"
+COL_STATE_SNAPSHOT_USERS = "users"
+COL_STATE_SNAPSHOT_UPDATED_AT = "updated_at"
 
 # Teacher Availability
 TABLE_TEACHER_AVAILABILITY = "teacher_availability"
@@ -52,3 +83,72 @@ COL_TEACHER_AVAILABILITY_TEACHER_ID = "teacher_id"
 COL_TEACHER_AVAILABILITY_DAY_OF_WEEK = "day_of_week"
 COL_TEACHER_AVAILABILITY_START_TIME = "start_time"
 COL_TEACHER_AVAILABILITY_END_TIME = "end_time"
+
+# Questions
+TABLE_QUESTIONS = "questions"
+
+COL_QUESTION_ID = "id"
+COL_QUESTION_TEACHER_ID = "teacher_id"
+COL_QUESTION_ROOM_ID = "room_id"
+COL_QUESTION_TITLE = "title"
+COL_QUESTION_BODY = "body"
+COL_QUESTION_QTYPE = "qtype"
+COL_QUESTION_START_AT = "start_at"
+COL_QUESTION_END_AT = "end_at"
+COL_QUESTION_MANUAL_ACTIVE = "manual_active"
+COL_QUESTION_ALLOW_MULTIPLE_SUBMISSIONS = "allow_multiple_submissions"
+COL_QUESTION_ALLOW_MULTIPLE_ANSWERS = "allow_multiple_answers"
+COL_QUESTION_CLOSE_ON_FIRST_CORRECT = "close_on_first_correct"
+COL_QUESTION_CLOSE_TRIGGERED = "close_triggered"
+COL_QUESTION_CREATED_AT = "created_at"
+
+JOINED_QUESTION_MATRIX_ROOM_ID = "matrix_room_id"
+JOINED_QUESTION_OPTION_IDS = "option_ids"
+JOINED_QUESTION_OPTION_KEYS = "option_keys"
+JOINED_QUESTION_OPTION_TEXTS = "option_texts"
+JOINED_QUESTION_OPTION_CORRECT = "option_correct"
+JOINED_QUESTION_EXPECTED_ANSWER = "expected_answer"
+JOINED_QUESTION_ANSWERED_STUDENT_IDS = "student_ids"
+
+# Canal de NOTIFY con el id de cada pregunta creada, modificada o borrada
+CHANNEL_QUESTION_CHANGED = "question_changed"
+
+# Question options
+TABLE_QUESTION_OPTIONS = "question_options"
+
+COL_QUESTION_OPTION_ID = "id"
+COL_QUESTION_OPTION_QUESTION_ID = "question_id"
+COL_QUESTION_OPTION_KEY = "option_key"
+COL_QUESTION_OPTION_TEXT = "text"
+COL_QUESTION_OPTION_IS_CORRECT = "is_correct"
+COL_QUESTION_OPTION_POSITION = "position"
+
+# Question responses
+TABLE_QUESTION_RESPONSES = "question_responses"
+
+COL_QUESTION_RESPONSE_ID = "id"
+COL_QUESTION_RESPONSE_QUESTION_ID = "question_id"
+COL_QUESTION_RESPONSE_STUDENT_ID = "student_id"
+COL_QUESTION_RESPONSE_OPTION_ID = "option_id"
+COL_QUESTION_RESPONSE_ANSWER_TEXT = "answer_text"
+COL_QUESTION_RESPONSE_SUBMITTED_AT = "submitted_at"
+COL_QUESTION_RESPONSE_IS_GRADED = "is_graded"
+COL_QUESTION_RESPONSE_SCORE = "score"
+COL_QUESTION_RESPONSE_GRADER_ID = "grader_id"
+COL_QUESTION_RESPONSE_FEEDBACK = "feedback"
+COL_QUESTION_RESPONSE_VERSION = "response_version"
+COL_QUESTION_RESPONSE_LATE = "late"
+
+# Response options (multi-select)
+TABLE_RESPONSE_OPTIONS = "response_options"
+
+COL_RESPONSE_OPTION_RESPONSE_ID = "response_id"
+COL_RESPONSE_OPTION_OPTION_ID = "option_id"
+
+# Módulos de cada backend. Se importan al final porque sus sentencias SQL se
+# construyen al importarlos a partir de las constantes de arriba.
+from core.db.postgres import conn as pg_conn, queries as pg_queries
+
+DB_MODULES = {
+    "postgres": {"conn": pg_conn, "queries": pg_queries},
+}
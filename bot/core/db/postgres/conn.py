@@ -1,8 +1,25 @@
 # core/db/postgres/conn.py
+"""
+Pool de conexiones a PostgreSQL.
+
+Las consultas obtienen conexiones con `acquire()`, que lee el pool en cada
+llamada (no al importar) y mide cuánto se espera por una conexión libre.
+`pool_stats()` resume el uso del pool y la latencia de cada sentencia.
+"""
+
+import logging
+import time
+from contextlib import asynccontextmanager
 
 import asyncpg
+import config
 from config import DB_USER, DB_PASSWORD, DB_NAME, DB_HOST, DB_PORT
-from pathlib import Path
+from core.db.postgres.migrate import SchemaMismatchError, apply_migrations, check_schema
+from core.db.postgres.statements import STATEMENT_TIMEOUTS, latency_stats
+from core.db.postgres.utils import breaker
+from core.metrics import Histogram
+
+logger = logging.getLogger("db")
 
 pool: asyncpg.pool.Pool | None = None  # Pool global
 
@@ -14,31 +31,135 @@ DB_CONFIG = {
     "port": DB_PORT
 }
 
+DB_POOL_MIN_SIZE = getattr(config, "DB_POOL_MIN_SIZE", 2)
+DB_POOL_MAX_SIZE = getattr(config, "DB_POOL_MAX_SIZE", 10)
+DB_POOL_MAX_INACTIVE_LIFETIME = getattr(config, "DB_POOL_MAX_INACTIVE_LIFETIME", 300.0)
+DB_POOL_SLOW_ACQUIRE_MS = getattr(config, "DB_POOL_SLOW_ACQUIRE_MS", 100)
+
+POOL_CONFIG = {
+    "min_size": DB_POOL_MIN_SIZE,
+    "max_size": DB_POOL_MAX_SIZE,
+    "max_inactive_connection_lifetime": DB_POOL_MAX_INACTIVE_LIFETIME,
+    # Red de seguridad en el servidor: ninguna sentencia supera el timeout más largo
+    "server_settings": {
+        "statement_timeout": str(int(max(STATEMENT_TIMEOUTS.values()) * 1000)),
+    },
+}
+
 # ────────────────────────────────
 # Conexión y esquema
 # ────────────────────────────────
 
-async def connect():
-    """Crea un pool de conexiones y carga el esquema desde schema.sql"""
+async def connect(migrate=False):
+    """
+    Comprueba que el esquema está en la última versión y crea un pool de conexiones.
+    Con `migrate=True` aplica antes las migraciones pendientes.
+    Lanza SchemaMismatchError si el esquema no coincide.
+    """
     global pool
-    pool = await asyncpg.create_pool(**DB_CONFIG)
-    await init_tables()
+    # La comprobación va antes que el pool: al abrir cada conexión se preparan
+    # sentencias que necesitan que las tablas existan
+    conn = await asyncpg.connect(**DB_CONFIG)
+    try:
+        if migrate:
+            await apply_migrations(conn)
+        await check_schema(conn)
+    finally:
+        await conn.close()
 
-async def init_tables():
-    """Lee schema.sql y ejecuta todas las queries"""
-    global pool
+    pool = await asyncpg.create_pool(**DB_CONFIG, **POOL_CONFIG)
+
+# ────────────────────────────────
+# Acceso al pool
+# ────────────────────────────────
+
+_acquire_wait = Histogram()
+_waiting = 0
+_slow_acquires = 0
+_last_slow_warning = 0.0
+
+
+def get_pool():
+    """Devuelve el pool de conexiones (falla si aún no se ha llamado a connect)."""
     if pool is None:
         raise RuntimeError("El pool de conexiones no está inicializado")
+    return pool
 
-    schema_file = Path(__file__).parent / "schema.sql"
-    if not schema_file.exists():
-        raise FileNotFoundError(f"No se encontró {schema_file}")
 
-    sql = schema_file.read_text()
+@asynccontextmanager
+async def acquire():
+    """Obtiene una conexión del pool midiendo el tiempo de espera."""
+    global _waiting, _slow_acquires, _last_slow_warning
+    current = get_pool()
+
+    _waiting += 1
+    start = time.perf_counter()
+    try:
+        conn = await current.acquire()
+    finally:
+        _waiting -= 1
+    waited = time.perf_counter() - start
+    _acquire_wait.observe(waited)
+
+    if waited * 1000 >= DB_POOL_SLOW_ACQUIRE_MS:
+        _slow_acquires += 1
+        # Como mucho un aviso cada 30 s para no inundar el log en plena avalancha
+        now = time.monotonic()
+        if now - _last_slow_warning >= 30:
+            _last_slow_warning = now
+            logger.warning(
+                f"Pool saturado: {waited * 1000:.0f} ms esperando conexión "
+                f"({current.get_size() - current.get_idle_size()}/{current.get_max_size()} en uso, "
+                f"{_waiting} en espera)"
+            )
+
+    try:
+        yield conn
+    finally:
+        await current.release(conn)
+
+
+def is_available():
+    """False mientras el circuit breaker considera la BD caída (o la está probando)."""
+    return breaker.state == breaker.CLOSED
+
+
+def pool_stats():
+    """Uso del pool, espera por conexiones y latencia por sentencia."""
+    stats = {
+        "size": 0,
+        "in_use": 0,
+        "idle": 0,
+        "max_size": DB_POOL_MAX_SIZE,
+        "waiting": _waiting,
+        "slow_acquires": _slow_acquires,
+        "acquire_wait": _acquire_wait.stats(),
+        "statements": latency_stats(),
+        "breaker": breaker.stats(),
+    }
+    if pool is not None:
+        size, idle = pool.get_size(), pool.get_idle_size()
+        stats.update(size=size, in_use=size - idle, idle=idle)
+    return stats
+
+# ────────────────────────────────
+# Notificaciones (LISTEN)
+# ────────────────────────────────
+
+async def listen(channel, callback):
+    """
+    Abre una conexión dedicada (fuera del pool) que escucha `channel` y llama a
+    `callback(payload)` con cada NOTIFY. Devuelve la conexión; hay que cerrarla
+    con `close_listener`.
+    """
+    conn = await asyncpg.connect(**DB_CONFIG)
+    await conn.add_listener(channel, lambda _conn, _pid, _channel, payload: callback(payload))
+    return conn
 
-    async with pool.acquire() as conn:
-        # asyncpg permite ejecutar varias queries separadas por ;
-        await conn.execute(sql)
+async def close_listener(conn):
+    """Cierra una conexión abierta con `listen` (si sigue abierta)."""
+    if conn is not None and not conn.is_closed():
+        await conn.close()
 
 # ────────────────────────────────
 # Cierre del pool
@@ -0,0 +1,102 @@
+# core/db/postgres/migrate.py
+"""
+Migraciones versionadas del esquema de PostgreSQL.
+
+Cada cambio de esquema es un archivo `NNNN_descripcion.sql` en la carpeta
+migrations/. La tabla schema_migrations registra las versiones aplicadas.
+
+Al arrancar, el bot solo comprueba con una consulta que la BD está en la
+última versión (`check_schema`) y se niega a arrancar si no lo está; las
+migraciones se aplican de forma explícita con `python bot/main.py --migrate` o con
+setup_postgres.py.
+
+Este módulo no depende del resto del bot para poder usarse desde
+setup_postgres.py.
+"""
+
+import re
+from pathlib import Path
+
+import asyncpg
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+MIGRATIONS_TABLE = "schema_migrations"
+
+_MIGRATION_FILE = re.compile(r"^(\d{4})_(\w+)\.sql$")
+
+# Clave del advisory lock que evita que dos procesos migren a la vez
+_MIGRATION_LOCK_KEY = 727_411_001
+
+
+class SchemaMismatchError(RuntimeError):
+    """La versión del esquema de la BD no coincide con la del código."""
+
+
+def available_migrations(directory=MIGRATIONS_DIR):
+    """Devuelve las migraciones disponibles como (versión, nombre, ruta), en orden."""
+    migrations = []
+    for path in directory.iterdir():
+        match = _MIGRATION_FILE.match(path.name)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), path))
+    migrations.sort()
+
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Hay migraciones con el mismo número en {directory}")
+    return migrations
+
+
+def head_version(directory=MIGRATIONS_DIR):
+    """Versión de la última migración disponible (0 si no hay ninguna)."""
+    migrations = available_migrations(directory)
+    return migrations[-1][0] if migrations else 0
+
+
+async def current_version(conn):
+    """Versión aplicada en la BD (0 si nunca se ha migrado). Una sola consulta."""
+    try:
+        return await conn.fetchval(f"SELECT COALESCE(MAX(version), 0) FROM {MIGRATIONS_TABLE}")
+    except asyncpg.UndefinedTableError:
+        return 0
+
+
+async def check_schema(conn):
+    """Lanza SchemaMismatchError si la BD no está exactamente en la última versión."""
+    current, head = await current_version(conn), head_version()
+    if current != head:
+        raise SchemaMismatchError(
+            f"El esquema de la BD está en la versión {current} y el código espera la {head}. "
+            + ("Aplica las migraciones con `python bot/main.py --migrate`."
+               if current < head else
+               "La BD es más reciente que el código: actualiza el bot.")
+        )
+
+
+async def apply_migrations(conn, log=print):
+    """Aplica en orden las migraciones pendientes. Devuelve cuántas se aplicaron."""
+    await conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT NOW()
+        );
+    """)
+
+    await conn.execute("SELECT pg_advisory_lock($1)", _MIGRATION_LOCK_KEY)
+    try:
+        current = await current_version(conn)
+        pending = [m for m in available_migrations() if m[0] > current]
+        for version, name, path in pending:
+            log(f"[*] Aplicando migración {version:04d}_{name}...")
+            async with conn.transaction():
+                await conn.execute(path.read_text())
+                await conn.execute(
+                    f"INSERT INTO {MIGRATIONS_TABLE} (version, name) VALUES ($1, $2)",
+                    version, name,
+                )
+        if pending:
+            log(f"[+] Esquema actualizado a la versión {pending[-1][0]}")
+        return len(pending)
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", _MIGRATION_LOCK_KEY)
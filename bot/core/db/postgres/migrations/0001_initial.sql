@@ -56,6 +56,51 @@ CREATE INDEX IF NOT EXISTS idx_reactions_teacher_id ON reactions(teacher_id);
 CREATE INDEX IF NOT EXISTS idx_reactions_student_id ON reactions(student_id);
 CREATE INDEX IF NOT EXISTS idx_reactions_room_id ON reactions(room_id);
 
+-- Reaction events ledger: one row per counted reaction event, so a redaction
+-- can be undone with a single lookup instead of fetching the redacted event
+CREATE TABLE IF NOT EXISTS reaction_events (
+    event_id TEXT PRIMARY KEY,             -- Matrix event ID of the reaction
+    teacher_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    student_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    room_id INTEGER NOT NULL REFERENCES rooms(id) ON DELETE CASCADE,
+    emoji TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+-- 🔹 Index for purging old ledger rows
+CREATE INDEX IF NOT EXISTS idx_reaction_events_created_at ON reaction_events(created_at);
+
+
+-- Sync state: last sync token of the bot account, to resume incremental sync on restart
+CREATE TABLE IF NOT EXISTS sync_state (
+    user_id TEXT PRIMARY KEY,              -- Matrix user ID of the bot
+    next_batch TEXT NOT NULL,              -- next_batch token of the last processed sync
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Processed events: IDs of events already handled by state-changing handlers,
+-- used to rebuild the in-memory dedup filter on restart
+CREATE TABLE IF NOT EXISTS processed_events (
+    event_id TEXT PRIMARY KEY,             -- Matrix event ID
+    processed_at TIMESTAMP DEFAULT NOW()
+);
+
+-- 🔹 Index for loading recent events and purging old rows
+CREATE INDEX IF NOT EXISTS idx_processed_events_processed_at ON processed_events(processed_at);
+
+-- State snapshots: last known in-memory state of each room (and its users),
+-- so conversations in progress survive a restart
+CREATE TABLE IF NOT EXISTS state_snapshots (
+    room_id TEXT PRIMARY KEY,              -- Matrix room ID
+    state TEXT NOT NULL,                   -- RoomState name
+    data JSONB NOT NULL DEFAULT '{}',      -- Room data
+    users JSONB NOT NULL DEFAULT '{}',     -- {user_id: {"state": ..., "data": {...}}}
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- 🔹 Index for restoring only recently active rooms
+CREATE INDEX IF NOT EXISTS idx_state_snapshots_updated_at ON state_snapshots(updated_at);
+
 DO $$
 BEGIN
     IF NOT EXISTS (
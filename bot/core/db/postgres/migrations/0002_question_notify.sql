@@ -0,0 +1,37 @@
+-- Notify the bot whenever a question or its options change, so it can refresh
+-- its in-memory index of open questions without polling the questions table.
+-- The payload is the question id.
+
+CREATE OR REPLACE FUNCTION notify_question_changed()
+RETURNS TRIGGER AS $$
+DECLARE
+    changed RECORD;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed := OLD;
+    ELSE
+        changed := NEW;
+    END IF;
+
+    IF TG_TABLE_NAME = 'questions' THEN
+        PERFORM pg_notify('question_changed', changed.id::text);
+    ELSE
+        PERFORM pg_notify('question_changed', changed.question_id::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_questions_notify ON questions;
+CREATE TRIGGER trg_questions_notify
+    AFTER INSERT OR UPDATE OR DELETE ON questions
+    FOR EACH ROW EXECUTE FUNCTION notify_question_changed();
+
+DROP TRIGGER IF EXISTS trg_question_options_notify ON question_options;
+CREATE TRIGGER trg_question_options_notify
+    AFTER INSERT OR UPDATE OR DELETE ON question_options
+    FOR EACH ROW EXECUTE FUNCTION notify_question_changed();
+
+-- Open questions are loaded in bulk at startup; skip closed ones cheaply
+CREATE INDEX IF NOT EXISTS idx_questions_open ON questions(end_at)
+    WHERE close_triggered = FALSE;
@@ -1,155 +1,805 @@
 # core/db/postgres/queries.py
 """
 Consulta y manipulación de datos en PostgreSQL.
+
+Las sentencias se declaran una vez con `statement(...)` (ver statements.py) y
+se ejecutan siempre con el mismo texto, de modo que asyncpg las prepara una
+sola vez por conexión.
 """
 
+import config
+from core.cache import TTLCache
 from core.db.constants import *
-from core.db.postgres.conn import pool
+from core.db.postgres.conn import acquire
+from core.db.postgres.statements import statement, READ, WRITE, BATCH, MAINTENANCE
 from core.db.postgres.utils import db_safe
 
+USER_CACHE_SIZE = getattr(config, "USER_CACHE_SIZE", 5000)
+USER_CACHE_TTL = getattr(config, "USER_CACHE_TTL", 60)
+ROOM_CACHE_SIZE = getattr(config, "ROOM_CACHE_SIZE", 1000)
+ROOM_CACHE_TTL = getattr(config, "ROOM_CACHE_TTL", 600)
+
+# ────────────────────────────────
+# Caché de identidades
+# ────────────────────────────────
+
+# Usuarios y salas casi nunca cambian, pero se consultan en cada evento.
+# El TTL de usuarios es corto para que un ascenso a profesor (is_teacher)
+# se note pronto sin tener que invalidar la entrada.
+_users_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+_rooms_cache = TTLCache(maxsize=ROOM_CACHE_SIZE, ttl=ROOM_CACHE_TTL)
+
+
+def cache_stats():
+    """Devuelve los contadores de acierto/fallo de las cachés."""
+    return {
+        TABLE_USERS: _users_cache.stats(),
+        TABLE_ROOMS: _rooms_cache.stats(),
+    }
+
+
 # ────────────────────────────────
 # Users
 # ────────────────────────────────
 
+_USER_BY_ID = statement(
+    "users.by_id",
+    f"SELECT * FROM {TABLE_USERS} WHERE {COL_USER_ID} = $1",
+)
+
+_USER_BY_MATRIX_ID = statement(
+    "users.by_matrix_id",
+    f"SELECT * FROM {TABLE_USERS} WHERE {COL_USER_MATRIX_ID} = $1",
+    READ,
+)
+
+
 @db_safe(default=None)
 async def get_user_by_id(user_id: str):
     """Obtiene un usuario por su matrix_id."""
-    async with pool.acquire() as conn:
-        return await conn.fetchrow(
-            f"SELECT * FROM {TABLE_USERS} WHERE {COL_USER_ID} = $1",
-            user_id,
-        )
+    async with acquire() as conn:
+        return await _USER_BY_ID.fetchrow(conn, user_id)
 
-@db_safe(default=None)
 async def get_user_by_matrix_id(matrix_user_id: str):
-    """Obtiene un usuario por su matrix_id."""
-    async with pool.acquire() as conn:
-        return await conn.fetchrow(
-            f"SELECT * FROM {TABLE_USERS} WHERE {COL_USER_MATRIX_ID} = $1",
-            matrix_user_id,
-        )
+    """Obtiene un usuario por su matrix_id (con caché)."""
+    user = _users_cache.get(matrix_user_id)
+    if user is None:
+        user = await _fetch_user_by_matrix_id(matrix_user_id)
+        # No se cachean los no encontrados: pueden registrarse en cualquier momento
+        if user is not None:
+            _users_cache.set(matrix_user_id, user)
+    return user
+
+@db_safe(default=None)
+async def _fetch_user_by_matrix_id(matrix_user_id: str):
+    async with acquire() as conn:
+        return await _USER_BY_MATRIX_ID.fetchrow(conn, matrix_user_id)
 
 
 # ────────────────────────────────
 # Rooms
 # ────────────────────────────────
 
-@db_safe(default=None)
+_ROOM_BY_MATRIX_ID = statement(
+    "rooms.by_matrix_id",
+    f"SELECT * FROM {TABLE_ROOMS} WHERE {COL_ROOM_ROOM_ID} = $1",
+    READ,
+)
+
+
 async def get_room_by_matrix_id(matrix_room_id: str):
-    """Obtiene los datos de una sala por su Matrix room_id."""
-    async with pool.acquire() as conn:
-        return await conn.fetchrow(
-            f"SELECT * FROM {TABLE_ROOMS} WHERE {COL_ROOM_ROOM_ID} = $1",
-            matrix_room_id,
-        )
+    """Obtiene los datos de una sala por su Matrix room_id (con caché)."""
+    room = _rooms_cache.get(matrix_room_id)
+    if room is None:
+        room = await _fetch_room_by_matrix_id(matrix_room_id)
+        if room is not None:
+            _rooms_cache.set(matrix_room_id, room)
+    return room
+
+@db_safe(default=None)
+async def _fetch_room_by_matrix_id(matrix_room_id: str):
+    async with acquire() as conn:
+        return await _ROOM_BY_MATRIX_ID.fetchrow(conn, matrix_room_id)
 
 
 # ────────────────────────────────
 # Reactions
 # ────────────────────────────────
 
-@db_safe(default=[])
-async def get_reacciones_por_profesor(teacher_matrix_id: str):
-    """Obtiene todas las reacciones puestas por un profesor (usando su matrix_id)."""
-    async with pool.acquire() as conn:
-        query = f"""
-            SELECT r.{COL_REACTION_EMOJI}, r.{COL_REACTION_COUNT}, r.{COL_REACTION_ROOM_ID},
-                   s.{COL_USER_MOODLE_ID} AS {JOINED_REACTION_STUDENT_MOODLE_ID}, 
-                   s.{COL_USER_MATRIX_ID} as {JOINED_REACTION_STUDENT_MATRIX_ID},
-                   room.{COL_ROOM_SHORTCODE} AS {JOINED_REACTION_ROOM_SHORTCODE},
-                   room.{COL_ROOM_MOODLE_COURSE_ID} AS {JOINED_REACTION_ROOM_MOODLE_COURSE_ID}
+def _reactions_summary_sql(own, other, other_matrix_id, other_moodle_id):
+    """
+    Resumen de reacciones de un usuario (`own`) agrupado por sala y contraparte (`other`).
+
+    Toda la agregación se hace en el servidor: una fila por (sala, contraparte)
+    con el total y los emojis ordenados de más a menos usados. $2 filtra por
+    shortcode de sala, $3 se queda con las N contrapartes con más reacciones de
+    cada sala, y $4/$5 paginan (LIMIT/OFFSET). `total_rows` es el número de filas
+    antes de paginar.
+    """
+    return f"""
+        WITH grouped AS (
+            SELECT r.{COL_REACTION_ROOM_ID}, r.{other} AS other_id,
+                   SUM(r.{COL_REACTION_COUNT}) AS {JOINED_REACTION_TOTAL},
+                   array_agg(r.{COL_REACTION_EMOJI} ORDER BY r.{COL_REACTION_COUNT} DESC, r.{COL_REACTION_EMOJI})
+                       AS {JOINED_REACTION_EMOJIS},
+                   array_agg(r.{COL_REACTION_COUNT} ORDER BY r.{COL_REACTION_COUNT} DESC, r.{COL_REACTION_EMOJI})
+                       AS {JOINED_REACTION_COUNTS}
             FROM {TABLE_REACTIONS} r
-            JOIN {TABLE_USERS} t ON r.{COL_REACTION_TEACHER_ID} = t.{COL_USER_ID}
-            JOIN {TABLE_USERS} s ON r.{COL_REACTION_STUDENT_ID} = s.{COL_USER_ID}
+            JOIN {TABLE_USERS} u ON r.{own} = u.{COL_USER_ID}
             JOIN {TABLE_ROOMS} room ON r.{COL_REACTION_ROOM_ID} = room.{COL_ROOM_ID}
-            WHERE t.{COL_USER_MATRIX_ID} = $1
-            ORDER BY r.{COL_REACTION_ROOM_ID}, s.{COL_USER_MOODLE_ID};
-        """
-        rows = await conn.fetch(query, teacher_matrix_id)
+            WHERE u.{COL_USER_MATRIX_ID} = $1
+              AND ($2::text IS NULL OR room.{COL_ROOM_SHORTCODE} = $2)
+            GROUP BY r.{COL_REACTION_ROOM_ID}, r.{other}
+        ), ranked AS (
+            SELECT g.*, ROW_NUMBER() OVER (
+                       PARTITION BY g.{COL_REACTION_ROOM_ID}
+                       ORDER BY g.{JOINED_REACTION_TOTAL} DESC, g.other_id
+                   ) AS rank
+            FROM grouped g
+        )
+        SELECT room.{COL_ROOM_SHORTCODE} AS {JOINED_REACTION_ROOM_SHORTCODE},
+               room.{COL_ROOM_MOODLE_COURSE_ID} AS {JOINED_REACTION_ROOM_MOODLE_COURSE_ID},
+               o.{COL_USER_MATRIX_ID} AS {other_matrix_id},
+               o.{COL_USER_MOODLE_ID} AS {other_moodle_id},
+               x.{JOINED_REACTION_TOTAL}, x.{JOINED_REACTION_EMOJIS}, x.{JOINED_REACTION_COUNTS},
+               COUNT(*) OVER () AS {JOINED_REACTION_TOTAL_ROWS}
+        FROM ranked x
+        JOIN {TABLE_USERS} o ON x.other_id = o.{COL_USER_ID}
+        JOIN {TABLE_ROOMS} room ON x.{COL_REACTION_ROOM_ID} = room.{COL_ROOM_ID}
+        WHERE $3::int IS NULL OR x.rank <= $3
+        ORDER BY room.{COL_ROOM_SHORTCODE}, x.{COL_REACTION_ROOM_ID}, x.rank
+        LIMIT $4 OFFSET $5;
+    """
+
+
+_REACTIONS_BY_TEACHER = statement(
+    "reactions.summary_by_teacher",
+    _reactions_summary_sql(
+        COL_REACTION_TEACHER_ID, COL_REACTION_STUDENT_ID,
+        JOINED_REACTION_STUDENT_MATRIX_ID, JOINED_REACTION_STUDENT_MOODLE_ID,
+    ),
+)
+
+_REACTIONS_BY_STUDENT = statement(
+    "reactions.summary_by_student",
+    _reactions_summary_sql(
+        COL_REACTION_STUDENT_ID, COL_REACTION_TEACHER_ID,
+        JOINED_REACTION_TEACHER_MATRIX_ID, JOINED_REACTION_TEACHER_MOODLE_ID,
+    ),
+)
+
+@db_safe(default=[])
+async def get_reacciones_por_profesor(
+    teacher_matrix_id: str,
+    shortcode: str = None,
+    top: int = None,
+    limit: int = None,
+    offset: int = 0,
+):
+    """
+    Resumen de las reacciones puestas por un profesor (usando su matrix_id),
+    una fila por sala y alumno. Ver `_reactions_summary_sql` para los filtros.
+    """
+    async with acquire() as conn:
+        rows = await _REACTIONS_BY_TEACHER.fetch(conn, teacher_matrix_id, shortcode, top, limit, offset)
     return [dict(row) for row in rows]
 
 
 @db_safe(default=[])
-async def get_reacciones_por_estudiante(student_matrix_id: str):
-    """Obtiene todas las reacciones recibidas por un estudiante (usando su matrix_id)."""
-    async with pool.acquire() as conn:
-        query = f"""
-            SELECT r.{COL_REACTION_EMOJI}, r.{COL_REACTION_COUNT}, r.{COL_REACTION_ROOM_ID},
-                   t.{COL_USER_MOODLE_ID} AS {JOINED_REACTION_TEACHER_MOODLE_ID},
-                   t.{COL_USER_MATRIX_ID} AS {JOINED_REACTION_TEACHER_MATRIX_ID},
-                   room.{COL_ROOM_SHORTCODE} AS {JOINED_REACTION_ROOM_SHORTCODE},
-                   room.{COL_ROOM_MOODLE_COURSE_ID} AS {JOINED_REACTION_ROOM_MOODLE_COURSE_ID}
-            FROM {TABLE_REACTIONS} r
-            JOIN {TABLE_USERS} s ON r.{COL_REACTION_STUDENT_ID} = s.{COL_USER_ID}
-            JOIN {TABLE_USERS} t ON r.{COL_REACTION_TEACHER_ID} = t.{COL_USER_ID}
-            JOIN {TABLE_ROOMS} room ON r.{COL_REACTION_ROOM_ID} = room.{COL_ROOM_ID}
-            WHERE s.{COL_USER_MATRIX_ID} = $1
-            ORDER BY r.{COL_REACTION_ROOM_ID}, t.{COL_USER_MOODLE_ID};
-        """
-        rows = await conn.fetch(query, student_matrix_id)
+async def get_reacciones_por_estudiante(
+    student_matrix_id: str,
+    shortcode: str = None,
+    top: int = None,
+    limit: int = None,
+    offset: int = 0,
+):
+    """
+    Resumen de las reacciones recibidas por un estudiante (usando su matrix_id),
+    una fila por sala y profesor. Ver `_reactions_summary_sql` para los filtros.
+    """
+    async with acquire() as conn:
+        rows = await _REACTIONS_BY_STUDENT.fetch(conn, student_matrix_id, shortcode, top, limit, offset)
     return [dict(row) for row in rows]
 
 
+# Deltas en bloque: $1..$5 son arrays paralelos (teacher_id, student_id, room_id, emoji, delta)
+_DELTAS_TABLE = f"""
+    unnest($1::int[], $2::int[], $3::int[], $4::text[], $5::int[])
+        AS d({COL_REACTION_TEACHER_ID}, {COL_REACTION_STUDENT_ID},
+             {COL_REACTION_ROOM_ID}, {COL_REACTION_EMOJI}, delta)
+"""
+
+_SAME_REACTION_DELTA = f"""
+    r.{COL_REACTION_TEACHER_ID} = d.{COL_REACTION_TEACHER_ID}
+    AND r.{COL_REACTION_STUDENT_ID} = d.{COL_REACTION_STUDENT_ID}
+    AND r.{COL_REACTION_ROOM_ID} = d.{COL_REACTION_ROOM_ID}
+    AND r.{COL_REACTION_EMOJI} = d.{COL_REACTION_EMOJI}
+"""
+
+_DELTAS_DELETE = statement("reactions.deltas_delete", f"""
+    DELETE FROM {TABLE_REACTIONS} r
+    USING {_DELTAS_TABLE}
+    WHERE {_SAME_REACTION_DELTA}
+      AND d.delta < 0
+      AND r.{COL_REACTION_COUNT} + d.delta <= 0;
+""", BATCH)
+
+_DELTAS_DECREASE = statement("reactions.deltas_decrease", f"""
+    UPDATE {TABLE_REACTIONS} r
+    SET {COL_REACTION_COUNT} = r.{COL_REACTION_COUNT} + d.delta,
+        {COL_REACTION_LAST_UPDATED} = NOW()
+    FROM {_DELTAS_TABLE}
+    WHERE {_SAME_REACTION_DELTA}
+      AND d.delta < 0;
+""", BATCH)
+
+_DELTAS_INCREASE = statement("reactions.deltas_increase", f"""
+    INSERT INTO {TABLE_REACTIONS}
+        ({COL_REACTION_TEACHER_ID},
+         {COL_REACTION_STUDENT_ID},
+         {COL_REACTION_ROOM_ID},
+         {COL_REACTION_EMOJI},
+         {COL_REACTION_COUNT})
+    SELECT d.{COL_REACTION_TEACHER_ID}, d.{COL_REACTION_STUDENT_ID},
+           d.{COL_REACTION_ROOM_ID}, d.{COL_REACTION_EMOJI}, d.delta
+    FROM {_DELTAS_TABLE}
+    WHERE d.delta > 0
+    ON CONFLICT ({COL_REACTION_TEACHER_ID},
+                 {COL_REACTION_STUDENT_ID},
+                 {COL_REACTION_ROOM_ID},
+                 {COL_REACTION_EMOJI})
+    DO UPDATE SET
+        {COL_REACTION_COUNT} = {TABLE_REACTIONS}.{COL_REACTION_COUNT} + EXCLUDED.{COL_REACTION_COUNT},
+        {COL_REACTION_LAST_UPDATED} = NOW();
+""", BATCH)
+
+
+# Si falla, el buffer de reacciones conserva el lote (y su registro de eventos,
+# que `retract` necesita encontrar) y lo reintenta él mismo.
 @db_safe(default=False)
-async def add_or_increase_reaccion(
-    teacher_id: int, 
-    student_id: int, 
-    room_id: str, 
-    reaction_type: str, 
-    increment: int = 1
-):
+async def apply_reaccion_deltas(deltas: list, events: list = (), retracted: list = ()):
+    """
+    Aplica en bloque una lista de deltas (teacher_id, student_id, room_id, emoji, delta).
+
+    `events` son las reacciones nuevas incluidas en los deltas, como
+    (event_id, teacher_id, student_id, room_id, emoji). Se registran en
+    reaction_events y las que ya estaban registradas (eventos reprocesados)
+    se descuentan para no contarlas dos veces.
+
+    `retracted` son event_id de reacciones retiradas: las que están en
+    reaction_events se borran del registro y se restan de su contador (las
+    que no están no eran reacciones contadas y se ignoran).
+
+    Los deltas positivos se insertan o suman con un único upsert; los negativos
+    restan del contador y eliminan la fila si llega a cero. Todo se ejecuta en
+    una sola transacción.
     """
-    Añade una reación a la tabla o incrementa su contador si ya existe.
-    """
-    async with pool.acquire() as conn:
-        await conn.execute(f"""
-            INSERT INTO {TABLE_REACTIONS} 
-                ({COL_REACTION_TEACHER_ID}, 
-                 {COL_REACTION_STUDENT_ID}, 
-                 {COL_REACTION_ROOM_ID}, 
-                 {COL_REACTION_EMOJI}, 
-                 {COL_REACTION_COUNT})
-            VALUES ($1, $2, $3, $4, $5)
-            ON CONFLICT ({COL_REACTION_TEACHER_ID}, 
-                         {COL_REACTION_STUDENT_ID}, 
-                         {COL_REACTION_ROOM_ID}, 
-                         {COL_REACTION_EMOJI})
-            DO UPDATE SET
-                {COL_REACTION_COUNT} = {TABLE_REACTIONS}.{COL_REACTION_COUNT} + EXCLUDED.{COL_REACTION_COUNT},
-                {COL_REACTION_LAST_UPDATED} = NOW();
-        """, teacher_id, student_id, room_id, reaction_type, increment)
+    async with acquire() as conn:
+        async with conn.transaction():
+            totals = None
+            if events:
+                rows = await _REACTION_EVENTS_INSERT.fetch(conn, *(list(col) for col in zip(*events)))
+
+                if len(rows) < len(events):
+                    inserted = {row[COL_REACTION_EVENT_ID] for row in rows}
+                    totals = {tuple(d[:4]): d[4] for d in deltas}
+                    for event_id, *key in events:
+                        if event_id not in inserted:
+                            totals[tuple(key)] = totals.get(tuple(key), 0) - 1
+
+            if retracted:
+                rows = await _REACTION_EVENTS_DELETE.fetch(conn, list(retracted))
+                if rows:
+                    if totals is None:
+                        totals = {tuple(d[:4]): d[4] for d in deltas}
+                    for row in rows:
+                        key = tuple(row.values())
+                        totals[key] = totals.get(key, 0) - 1
+
+            if totals is not None:
+                deltas = [(*key, delta) for key, delta in totals.items() if delta]
+
+            if deltas:
+                await _apply_deltas(conn, deltas)
     return True
 
 
+async def _apply_deltas(conn, deltas: list):
+    """Ejecuta los deltas de contadores sobre `conn` (dentro de una transacción)."""
+    args = [list(col) for col in zip(*deltas)]
+    await _DELTAS_DELETE.execute(conn, *args)
+    await _DELTAS_DECREASE.execute(conn, *args)
+    await _DELTAS_INCREASE.execute(conn, *args)
+
+
+# ────────────────────────────────
+# Reaction events (ledger)
+# ────────────────────────────────
+
+_REACTION_EVENTS_INSERT = statement("reaction_events.insert", f"""
+    INSERT INTO {TABLE_REACTION_EVENTS}
+        ({COL_REACTION_EVENT_ID},
+         {COL_REACTION_EVENT_TEACHER_ID},
+         {COL_REACTION_EVENT_STUDENT_ID},
+         {COL_REACTION_EVENT_ROOM_ID},
+         {COL_REACTION_EVENT_EMOJI})
+    SELECT * FROM unnest($1::text[], $2::int[], $3::int[], $4::int[], $5::text[])
+    ON CONFLICT ({COL_REACTION_EVENT_ID}) DO NOTHING
+    RETURNING {COL_REACTION_EVENT_ID};
+""", BATCH)
+
+_REACTION_EVENTS_DELETE = statement("reaction_events.delete", f"""
+    DELETE FROM {TABLE_REACTION_EVENTS}
+    WHERE {COL_REACTION_EVENT_ID} = ANY($1::text[])
+    RETURNING {COL_REACTION_EVENT_TEACHER_ID},
+              {COL_REACTION_EVENT_STUDENT_ID},
+              {COL_REACTION_EVENT_ROOM_ID},
+              {COL_REACTION_EVENT_EMOJI};
+""", BATCH)
+
+_REACTION_EVENTS_PURGE = statement("reaction_events.purge", f"""
+    DELETE FROM {TABLE_REACTION_EVENTS}
+    WHERE {COL_REACTION_EVENT_CREATED_AT} < NOW() - make_interval(days => $1);
+""", MAINTENANCE)
+
+
+@db_safe(default=0)
+async def purge_reaction_events(max_age_days: int):
+    """Elimina del registro las reacciones con más de `max_age_days` días. Devuelve cuántas."""
+    async with acquire() as conn:
+        result = await _REACTION_EVENTS_PURGE.execute(conn, max_age_days)
+    return int(result.split()[-1])
+
+
+# ────────────────────────────────
+# Sync state
+# ────────────────────────────────
+
+_SYNC_TOKEN_GET = statement(
+    "sync_state.get",
+    f"SELECT {COL_SYNC_STATE_NEXT_BATCH} FROM {TABLE_SYNC_STATE} WHERE {COL_SYNC_STATE_USER_ID} = $1",
+)
+
+_SYNC_TOKEN_SAVE = statement("sync_state.save", f"""
+    INSERT INTO {TABLE_SYNC_STATE} ({COL_SYNC_STATE_USER_ID}, {COL_SYNC_STATE_NEXT_BATCH})
+    VALUES ($1, $2)
+    ON CONFLICT ({COL_SYNC_STATE_USER_ID}) DO UPDATE SET
+        {COL_SYNC_STATE_NEXT_BATCH} = EXCLUDED.{COL_SYNC_STATE_NEXT_BATCH},
+        {COL_SYNC_STATE_UPDATED_AT} = NOW();
+""", WRITE)
+
+_SYNC_TOKEN_DELETE = statement(
+    "sync_state.delete",
+    f"DELETE FROM {TABLE_SYNC_STATE} WHERE {COL_SYNC_STATE_USER_ID} = $1",
+    WRITE,
+)
+
+
+@db_safe(default=None)
+async def get_sync_token(user_id: str):
+    """Obtiene el último next_batch guardado para la cuenta `user_id`."""
+    async with acquire() as conn:
+        return await _SYNC_TOKEN_GET.fetchval(conn, user_id)
+
+
 @db_safe(default=False)
-async def decrease_or_delete_reaccion(
-    teacher_id: int,
-    student_id: int,
-    room_id: str,
-    reaction_type: str,
-    decrement: int = 1
-):
+async def save_sync_token(user_id: str, next_batch: str):
+    """Guarda (o reemplaza) el next_batch de la cuenta `user_id`."""
+    async with acquire() as conn:
+        await _SYNC_TOKEN_SAVE.execute(conn, user_id, next_batch)
+    return True
+
+
+@db_safe(default=False)
+async def delete_sync_token(user_id: str):
+    """Borra el next_batch guardado, forzando una sincronización completa."""
+    async with acquire() as conn:
+        await _SYNC_TOKEN_DELETE.execute(conn, user_id)
+    return True
+
+
+# ────────────────────────────────
+# Processed events (dedup)
+# ────────────────────────────────
+
+_PROCESSED_EVENTS_RECENT = statement("processed_events.recent", f"""
+    SELECT {COL_PROCESSED_EVENT_ID} FROM {TABLE_PROCESSED_EVENTS}
+    WHERE {COL_PROCESSED_EVENT_PROCESSED_AT} >= NOW() - make_interval(hours => $1);
+""", MAINTENANCE)
+
+_PROCESSED_EVENTS_EXISTS = statement(
+    "processed_events.exists",
+    f"SELECT EXISTS (SELECT 1 FROM {TABLE_PROCESSED_EVENTS} WHERE {COL_PROCESSED_EVENT_ID} = $1)",
+    READ,
+)
+
+_PROCESSED_EVENTS_MARK = statement("processed_events.mark", f"""
+    INSERT INTO {TABLE_PROCESSED_EVENTS} ({COL_PROCESSED_EVENT_ID})
+    SELECT unnest($1::text[])
+    ON CONFLICT ({COL_PROCESSED_EVENT_ID}) DO NOTHING;
+""", BATCH)
+
+_PROCESSED_EVENTS_PURGE = statement("processed_events.purge", f"""
+    DELETE FROM {TABLE_PROCESSED_EVENTS}
+    WHERE {COL_PROCESSED_EVENT_PROCESSED_AT} < NOW() - make_interval(hours => $1);
+""", MAINTENANCE)
+
+
+@db_safe(default=[])
+async def get_recent_processed_events(max_age_hours: int):
+    """Devuelve los event_id procesados en las últimas `max_age_hours` horas."""
+    async with acquire() as conn:
+        rows = await _PROCESSED_EVENTS_RECENT.fetch(conn, max_age_hours)
+    return [row[COL_PROCESSED_EVENT_ID] for row in rows]
+
+
+@db_safe(default=False)
+async def is_event_processed(event_id: str):
+    """Indica si el evento `event_id` ya fue procesado."""
+    async with acquire() as conn:
+        return await _PROCESSED_EVENTS_EXISTS.fetchval(conn, event_id)
+
+
+@db_safe(default=False)
+async def mark_events_processed(event_ids: list):
+    """Registra un lote de eventos como procesados (los repetidos se ignoran)."""
+    async with acquire() as conn:
+        await _PROCESSED_EVENTS_MARK.execute(conn, event_ids)
+    return True
+
+
+@db_safe(default=0)
+async def purge_processed_events(max_age_hours: int):
+    """Elimina los eventos procesados hace más de `max_age_hours` horas. Devuelve cuántos."""
+    async with acquire() as conn:
+        result = await _PROCESSED_EVENTS_PURGE.execute(conn, max_age_hours)
+    return int(result.split()[-1])
+
+
+# ────────────────────────────────
+# State snapshots
+# ────────────────────────────────
+
+_STATE_SNAPSHOTS_RECENT = statement("state_snapshots.recent", f"""
+    SELECT {COL_STATE_SNAPSHOT_ROOM_ID},
+           {COL_STATE_SNAPSHOT_STATE},
+           {COL_STATE_SNAPSHOT_DATA}::text AS {COL_STATE_SNAPSHOT_DATA},
+           {COL_STATE_SNAPSHOT_USERS}::text AS {COL_STATE_SNAPSHOT_USERS},
+           EXTRACT(EPOCH FROM NOW() - {COL_STATE_SNAPSHOT_UPDATED_AT})::float AS age
+    FROM {TABLE_STATE_SNAPSHOTS}
+    WHERE {COL_STATE_SNAPSHOT_UPDATED_AT} >= NOW() - make_interval(hours => $1)
+    ORDER BY {COL_STATE_SNAPSHOT_UPDATED_AT} DESC
+    LIMIT $2;
+""", MAINTENANCE)
+
+_STATE_SNAPSHOTS_UPSERT = statement("state_snapshots.upsert", f"""
+    INSERT INTO {TABLE_STATE_SNAPSHOTS} (
+        {COL_STATE_SNAPSHOT_ROOM_ID},
+        {COL_STATE_SNAPSHOT_STATE},
+        {COL_STATE_SNAPSHOT_DATA},
+        {COL_STATE_SNAPSHOT_USERS}
+    )
+    SELECT s.room_id, s.state, s.data::jsonb, s.users::jsonb
+    FROM unnest($1::text[], $2::text[], $3::text[], $4::text[])
+        AS s(room_id, state, data, users)
+    ON CONFLICT ({COL_STATE_SNAPSHOT_ROOM_ID}) DO UPDATE SET
+        {COL_STATE_SNAPSHOT_STATE} = EXCLUDED.{COL_STATE_SNAPSHOT_STATE},
+        {COL_STATE_SNAPSHOT_DATA} = EXCLUDED.{COL_STATE_SNAPSHOT_DATA},
+        {COL_STATE_SNAPSHOT_USERS} = EXCLUDED.{COL_STATE_SNAPSHOT_USERS},
+        {COL_STATE_SNAPSHOT_UPDATED_AT} = NOW();
+""", BATCH)
+
+_STATE_SNAPSHOTS_DELETE = statement(
+    "state_snapshots.delete",
+    f"DELETE FROM {TABLE_STATE_SNAPSHOTS} WHERE {COL_STATE_SNAPSHOT_ROOM_ID} = ANY($1::text[])",
+    BATCH,
+)
+
+_STATE_SNAPSHOTS_PURGE = statement("state_snapshots.purge", f"""
+    DELETE FROM {TABLE_STATE_SNAPSHOTS}
+    WHERE {COL_STATE_SNAPSHOT_UPDATED_AT} < NOW() - make_interval(hours => $1);
+""", MAINTENANCE)
+
+
+@db_safe(default=[])
+async def get_state_snapshots(max_age_hours: int, limit: int):
     """
-    Disminuye el contador de una reacción. 
-    Si el contador actual es menor o igual al decremento, elimina la reacción.
-    """
-    async with pool.acquire() as conn:
-        await conn.execute(f"""
-            DELETE FROM {TABLE_REACTIONS}
-            WHERE {COL_REACTION_TEACHER_ID} = $1
-              AND {COL_REACTION_STUDENT_ID} = $2
-              AND {COL_REACTION_ROOM_ID} = $3
-              AND {COL_REACTION_EMOJI} = $4
-              AND {COL_REACTION_COUNT} <= $5;
-
-            UPDATE {TABLE_REACTIONS}
-            SET {COL_REACTION_COUNT} = {COL_REACTION_COUNT} - $5,
-                {COL_REACTION_LAST_UPDATED} = NOW()
-            WHERE {COL_REACTION_TEACHER_ID} = $1
-              AND {COL_REACTION_STUDENT_ID} = $2
-              AND {COL_REACTION_ROOM_ID} = $3
-              AND {COL_REACTION_EMOJI} = $4
-              AND {COL_REACTION_COUNT} > $5;
-        """, teacher_id, student_id, room_id, reaction_type, decrement)
+    Devuelve las instantáneas de las salas con actividad en las últimas
+    `max_age_hours` horas (como mucho `limit`, las más recientes primero).
+    `data` y `users` se devuelven como texto JSON y `age` son los segundos
+    transcurridos desde el último cambio.
+    """
+    async with acquire() as conn:
+        return await _STATE_SNAPSHOTS_RECENT.fetch(conn, max_age_hours, limit)
+
+
+@db_safe(default=False)
+async def save_state_snapshots(snapshots: list, deleted: list = ()):
+    """
+    Guarda en una transacción las instantáneas modificadas y borra las de las
+    salas que ya no tienen estado.
+
+    `snapshots` es una lista de tuplas (room_id, state, data_json, users_json).
+    """
+    async with acquire() as conn:
+        async with conn.transaction():
+            if snapshots:
+                await _STATE_SNAPSHOTS_UPSERT.execute(conn, *(list(col) for col in zip(*snapshots)))
+            if deleted:
+                await _STATE_SNAPSHOTS_DELETE.execute(conn, list(deleted))
     return True
 
+
+@db_safe(default=0)
+async def purge_state_snapshots(max_age_hours: int):
+    """Elimina las instantáneas sin cambios en las últimas `max_age_hours` horas. Devuelve cuántas."""
+    async with acquire() as conn:
+        result = await _STATE_SNAPSHOTS_PURGE.execute(conn, max_age_hours)
+    return int(result.split()[-1])
+
+
+# ────────────────────────────────
+# Questions
+# ────────────────────────────────
+
+# Una fila por pregunta con sus opciones como arrays paralelos (ordenadas por posición)
+_QUESTION_SELECT = f"""
+    SELECT q.{COL_QUESTION_ID}, q.{COL_QUESTION_ROOM_ID}, q.{COL_QUESTION_TEACHER_ID},
+           room.{COL_ROOM_ROOM_ID} AS {JOINED_QUESTION_MATRIX_ROOM_ID},
+           q.{COL_QUESTION_TITLE}, q.{COL_QUESTION_BODY}, q.{COL_QUESTION_QTYPE}::text AS {COL_QUESTION_QTYPE},
+           q.{COL_QUESTION_START_AT}, q.{COL_QUESTION_END_AT}, q.{COL_QUESTION_MANUAL_ACTIVE},
+           q.{COL_QUESTION_ALLOW_MULTIPLE_SUBMISSIONS}, q.{COL_QUESTION_ALLOW_MULTIPLE_ANSWERS},
+           q.{COL_QUESTION_CLOSE_ON_FIRST_CORRECT}, q.{COL_QUESTION_CLOSE_TRIGGERED},
+           COALESCE(array_agg(o.{COL_QUESTION_OPTION_ID} ORDER BY o.{COL_QUESTION_OPTION_POSITION})
+                    FILTER (WHERE o.{COL_QUESTION_OPTION_ID} IS NOT NULL), '{{}}') AS {JOINED_QUESTION_OPTION_IDS},
+           COALESCE(array_agg(o.{COL_QUESTION_OPTION_KEY} ORDER BY o.{COL_QUESTION_OPTION_POSITION})
+                    FILTER (WHERE o.{COL_QUESTION_OPTION_ID} IS NOT NULL), '{{}}') AS {JOINED_QUESTION_OPTION_KEYS},
+           COALESCE(array_agg(o.{COL_QUESTION_OPTION_TEXT} ORDER BY o.{COL_QUESTION_OPTION_POSITION})
+                    FILTER (WHERE o.{COL_QUESTION_OPTION_ID} IS NOT NULL), '{{}}') AS {JOINED_QUESTION_OPTION_TEXTS},
+           COALESCE(array_agg(o.{COL_QUESTION_OPTION_IS_CORRECT} ORDER BY o.{COL_QUESTION_OPTION_POSITION})
+                    FILTER (WHERE o.{COL_QUESTION_OPTION_ID} IS NOT NULL), '{{}}') AS {JOINED_QUESTION_OPTION_CORRECT}
+    FROM {TABLE_QUESTIONS} q
+    JOIN {TABLE_ROOMS} room ON q.{COL_QUESTION_ROOM_ID} = room.{COL_ROOM_ID}
+    LEFT JOIN {TABLE_QUESTION_OPTIONS} o ON o.{COL_QUESTION_OPTION_QUESTION_ID} = q.{COL_QUESTION_ID}
+"""
+
+# Abiertas o que pueden abrirse solas: activadas a mano, con ventana sin fin o
+# cuyo fin aún no ha llegado. Las demás solo cambian si el panel las edita (NOTIFY).
+_QUESTIONS_OPEN = statement("questions.open", f"""
+    {_QUESTION_SELECT}
+    WHERE room.{COL_ROOM_ACTIVE}
+      AND NOT q.{COL_QUESTION_CLOSE_TRIGGERED}
+      AND (q.{COL_QUESTION_MANUAL_ACTIVE}
+           OR (q.{COL_QUESTION_START_AT} IS NOT NULL AND q.{COL_QUESTION_END_AT} IS NULL)
+           OR q.{COL_QUESTION_END_AT} > NOW())
+    GROUP BY q.{COL_QUESTION_ID}, room.{COL_ROOM_ROOM_ID};
+""", MAINTENANCE)
+
+_QUESTIONS_BY_IDS = statement("questions.by_ids", f"""
+    {_QUESTION_SELECT}
+    WHERE q.{COL_QUESTION_ID} = ANY($1::int[])
+      AND room.{COL_ROOM_ACTIVE}
+    GROUP BY q.{COL_QUESTION_ID}, room.{COL_ROOM_ROOM_ID};
+""")
+
+# Lote de respuestas: $1..$9 son arrays paralelos (question_id, student_id,
+# option_id, answer_text, allow_multiple_submissions, submitted_at, opciones
+# de respuesta múltiple separadas por comas, cierra la pregunta, puntuación
+# automática o NULL si no se corrige sola). La versión de
+# cada respuesta es la última guardada del alumno más su posición dentro del
+# lote; sin reenvíos solo entra la primera. Devuelve una fila por respuesta
+# guardada con su posición en el lote (ord, desde 1).
+#
+# Una respuesta correcta a una pregunta con close_on_first_correct la cierra en
+# la misma sentencia, y solo si la respuesta se guardó: el UPDATE condicionado
+# a `NOT close_triggered` bloquea la fila de la pregunta, así que si dos
+# escritores lo intentan a la vez solo uno la cierra (`closed`).
+_RESPONSES_INSERT_BATCH = statement("question_responses.insert_batch", f"""
+    WITH input AS (
+        SELECT *
+        FROM unnest($1::int[], $2::int[], $3::int[], $4::text[], $5::bool[], $6::timestamptz[],
+                    $7::text[], $8::bool[], $9::numeric[])
+            WITH ORDINALITY AS i(question_id, student_id, option_id, answer_text,
+                                 allow_multiple, submitted_at, option_list, closes, score, ord)
+    ), versioned AS (
+        SELECT i.*,
+               COALESCE((
+                   SELECT MAX(r.{COL_QUESTION_RESPONSE_VERSION})
+                   FROM {TABLE_QUESTION_RESPONSES} r
+                   WHERE r.{COL_QUESTION_RESPONSE_QUESTION_ID} = i.question_id
+                     AND r.{COL_QUESTION_RESPONSE_STUDENT_ID} = i.student_id
+               ), 0) AS prev,
+               ROW_NUMBER() OVER (PARTITION BY i.question_id, i.student_id ORDER BY i.ord) AS n
+        FROM input i
+    ), inserted AS (
+        INSERT INTO {TABLE_QUESTION_RESPONSES} (
+            {COL_QUESTION_RESPONSE_QUESTION_ID},
+            {COL_QUESTION_RESPONSE_STUDENT_ID},
+            {COL_QUESTION_RESPONSE_OPTION_ID},
+            {COL_QUESTION_RESPONSE_ANSWER_TEXT},
+            {COL_QUESTION_RESPONSE_SUBMITTED_AT},
+            {COL_QUESTION_RESPONSE_VERSION},
+            {COL_QUESTION_RESPONSE_LATE},
+            {COL_QUESTION_RESPONSE_SCORE},
+            {COL_QUESTION_RESPONSE_IS_GRADED}
+        )
+        SELECT v.question_id, v.student_id, v.option_id, v.answer_text, v.submitted_at,
+               v.prev + v.n,
+               q.{COL_QUESTION_END_AT} IS NOT NULL AND v.submitted_at > q.{COL_QUESTION_END_AT},
+               v.score, v.score IS NOT NULL
+        FROM versioned v
+        JOIN {TABLE_QUESTIONS} q ON q.{COL_QUESTION_ID} = v.question_id
+        WHERE v.allow_multiple OR (v.prev = 0 AND v.n = 1)
+        ON CONFLICT ({COL_QUESTION_RESPONSE_QUESTION_ID},
+                     {COL_QUESTION_RESPONSE_STUDENT_ID},
+                     {COL_QUESTION_RESPONSE_VERSION}) DO NOTHING
+        RETURNING {COL_QUESTION_RESPONSE_ID}, {COL_QUESTION_RESPONSE_QUESTION_ID},
+                  {COL_QUESTION_RESPONSE_STUDENT_ID}, {COL_QUESTION_RESPONSE_VERSION},
+                  {COL_QUESTION_RESPONSE_LATE}
+    ), matched AS (
+        SELECT v.ord, v.option_list, v.closes, ins.*
+        FROM versioned v
+        JOIN inserted ins
+          ON ins.{COL_QUESTION_RESPONSE_QUESTION_ID} = v.question_id
+         AND ins.{COL_QUESTION_RESPONSE_STUDENT_ID} = v.student_id
+         AND ins.{COL_QUESTION_RESPONSE_VERSION} = v.prev + v.n
+    ), options AS (
+        INSERT INTO {TABLE_RESPONSE_OPTIONS} ({COL_RESPONSE_OPTION_RESPONSE_ID}, {COL_RESPONSE_OPTION_OPTION_ID})
+        SELECT m.{COL_QUESTION_RESPONSE_ID}, unnest(string_to_array(m.option_list, ',')::int[])
+        FROM matched m
+        WHERE m.option_list IS NOT NULL
+        ON CONFLICT DO NOTHING
+    ), closer AS (
+        SELECT DISTINCT ON (m.{COL_QUESTION_RESPONSE_QUESTION_ID}) m.ord, m.{COL_QUESTION_RESPONSE_QUESTION_ID}
+        FROM matched m
+        WHERE m.closes
+        ORDER BY m.{COL_QUESTION_RESPONSE_QUESTION_ID}, m.ord
+    ), closed AS (
+        UPDATE {TABLE_QUESTIONS} q
+        SET {COL_QUESTION_CLOSE_TRIGGERED} = TRUE,
+            {COL_QUESTION_MANUAL_ACTIVE} = FALSE,
+            {COL_QUESTION_END_AT} = LEAST(COALESCE(q.{COL_QUESTION_END_AT}, NOW()), NOW())
+        FROM closer c
+        WHERE q.{COL_QUESTION_ID} = c.{COL_QUESTION_RESPONSE_QUESTION_ID}
+          AND q.{COL_QUESTION_CLOSE_ON_FIRST_CORRECT}
+          AND NOT q.{COL_QUESTION_CLOSE_TRIGGERED}
+        RETURNING c.ord
+    )
+    SELECT m.ord, m.{COL_QUESTION_RESPONSE_ID}, m.{COL_QUESTION_RESPONSE_VERSION}, m.{COL_QUESTION_RESPONSE_LATE},
+           m.ord IN (SELECT ord FROM closed) AS closed
+    FROM matched m;
+""", BATCH)
+
+
+# Alumnos que ya han respondido a cada pregunta
+_RESPONSES_ANSWERED_STUDENTS = statement("question_responses.answered_students", f"""
+    SELECT {COL_QUESTION_RESPONSE_QUESTION_ID},
+           array_agg(DISTINCT {COL_QUESTION_RESPONSE_STUDENT_ID}) AS {JOINED_QUESTION_ANSWERED_STUDENT_IDS}
+    FROM {TABLE_QUESTION_RESPONSES}
+    WHERE {COL_QUESTION_RESPONSE_QUESTION_ID} = ANY($1::int[])
+    GROUP BY {COL_QUESTION_RESPONSE_QUESTION_ID};
+""")
+
+# Tipo y respuesta esperada (opción ANSWER) de una pregunta, para recorregirla
+_QUESTION_ANSWER_KEY = statement("questions.answer_key", f"""
+    SELECT q.{COL_QUESTION_QTYPE}, q.{COL_QUESTION_TEACHER_ID},
+           o.{COL_QUESTION_OPTION_TEXT} AS {JOINED_QUESTION_EXPECTED_ANSWER}
+    FROM {TABLE_QUESTIONS} q
+    LEFT JOIN {TABLE_QUESTION_OPTIONS} o
+      ON o.{COL_QUESTION_OPTION_QUESTION_ID} = q.{COL_QUESTION_ID}
+     AND o.{COL_QUESTION_OPTION_KEY} = 'ANSWER'
+    WHERE q.{COL_QUESTION_ID} = $1
+    LIMIT 1;
+""")
+
+# Página (por id) de las respuestas de una pregunta que no ha corregido un profesor
+_RESPONSES_GRADING_PAGE = statement("question_responses.grading_page", f"""
+    SELECT {COL_QUESTION_RESPONSE_ID}, {COL_QUESTION_RESPONSE_ANSWER_TEXT}
+    FROM {TABLE_QUESTION_RESPONSES}
+    WHERE {COL_QUESTION_RESPONSE_QUESTION_ID} = $1
+      AND {COL_QUESTION_RESPONSE_GRADER_ID} IS NULL
+      AND {COL_QUESTION_RESPONSE_ID} > $2
+    ORDER BY {COL_QUESTION_RESPONSE_ID}
+    LIMIT $3;
+""")
+
+# Puntuaciones de un lote de respuestas: $1 ids, $2 puntuaciones (NULL = sin corregir)
+_RESPONSES_SET_SCORES = statement("question_responses.set_scores", f"""
+    UPDATE {TABLE_QUESTION_RESPONSES} r
+    SET {COL_QUESTION_RESPONSE_SCORE} = s.score,
+        {COL_QUESTION_RESPONSE_IS_GRADED} = s.score IS NOT NULL
+    FROM unnest($1::int[], $2::numeric[]) AS s(id, score)
+    WHERE r.{COL_QUESTION_RESPONSE_ID} = s.id
+      AND r.{COL_QUESTION_RESPONSE_GRADER_ID} IS NULL;
+""", BATCH)
+
+
+@db_safe(default=None)
+async def get_open_questions():
+    """
+    Devuelve las preguntas abiertas o pendientes de abrirse, con sus opciones.
+    Devuelve None (no una lista vacía) si la consulta falla.
+    """
+    async with acquire() as conn:
+        return await _QUESTIONS_OPEN.fetch(conn)
+
+
+@db_safe(default=None)
+async def get_questions_by_ids(question_ids: list):
+    """Devuelve las preguntas indicadas (las borradas no aparecen). None si la consulta falla."""
+    async with acquire() as conn:
+        return await _QUESTIONS_BY_IDS.fetch(conn, question_ids)
+
+
+@db_safe(default=None)
+async def get_answered_students(question_ids: list):
+    """Devuelve (question_id, student_ids) de las preguntas indicadas con respuestas. None si falla."""
+    async with acquire() as conn:
+        return await _RESPONSES_ANSWERED_STUDENTS.fetch(conn, question_ids)
+
+
+@db_safe(default=None)
+async def insert_question_responses(responses: list):
+    """
+    Guarda un lote de respuestas con una sola sentencia.
+
+    `responses` es una lista de tuplas (question_id, student_id, option_ids,
+    answer_text, allow_multiple_submissions, multiple_answers, submitted_at,
+    closes, score). Devuelve un diccionario posición en el lote → (response_id,
+    response_version, late, closed), donde `closed` indica que esa respuesta
+    cerró la pregunta; las respuestas que no aparecen no se guardaron
+    porque el alumno ya había respondido y la pregunta no admite reenvíos.
+    Devuelve None si el lote no se pudo guardar.
+    """
+    columns = ([], [], [], [], [], [], [], [], [])
+    for (question_id, student_id, option_ids, answer_text,
+         allow_multiple, multiple_answers, submitted_at, closes, score) in responses:
+        columns[0].append(question_id)
+        columns[1].append(student_id)
+        columns[2].append(option_ids[0] if len(option_ids) == 1 else None)
+        columns[3].append(answer_text)
+        columns[4].append(allow_multiple)
+        columns[5].append(submitted_at)
+        columns[6].append(",".join(map(str, option_ids)) if multiple_answers and option_ids else None)
+        columns[7].append(closes)
+        columns[8].append(score)
+
+    async with acquire() as conn:
+        rows = await _RESPONSES_INSERT_BATCH.fetch(conn, *columns)
+    return {
+        row["ord"] - 1: (
+            row[COL_QUESTION_RESPONSE_ID],
+            row[COL_QUESTION_RESPONSE_VERSION],
+            row[COL_QUESTION_RESPONSE_LATE],
+            row["closed"],
+        )
+        for row in rows
+    }
+
+
+@db_safe(default=None)
+async def get_question_answer_key(question_id: int):
+    """Devuelve (qtype, teacher_id, expected_answer) de la pregunta, o None si no existe o la consulta falla."""
+    async with acquire() as conn:
+        return await _QUESTION_ANSWER_KEY.fetchrow(conn, question_id)
+
+
+@db_safe(default=None)
+async def get_responses_page_for_grading(question_id: int, after_id: int, limit: int):
+    """
+    Devuelve hasta `limit` respuestas (id, answer_text) de la pregunta con id
+    mayor que `after_id` y sin corregir a mano. None si la consulta falla.
+    """
+    async with acquire() as conn:
+        return await _RESPONSES_GRADING_PAGE.fetch(conn, question_id, after_id, limit)
+
+
+@db_safe(default=None)
+async def set_response_scores(response_ids: list, scores: list):
+    """
+    Guarda las puntuaciones de un lote de respuestas con un único UPDATE (las
+    corregidas a mano se respetan). Devuelve cuántas se actualizaron, o None si falla.
+    """
+    async with acquire() as conn:
+        result = await _RESPONSES_SET_SCORES.execute(conn, response_ids, scores)
+    return int(result.split()[-1])
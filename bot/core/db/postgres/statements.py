@@ -0,0 +1,101 @@
+# core/db/postgres/statements.py
+"""
+Registro de sentencias SQL.
+
+Cada sentencia se construye una única vez, al importar el módulo que la
+declara con `statement(...)`, y se ejecuta siempre con el mismo texto. asyncpg
+guarda por conexión una caché de sentencias preparadas indexada por ese texto,
+así que cada sentencia se analiza y planifica una vez por conexión, en su
+primer uso. No se preparan por adelantado al abrir la conexión: asyncpg no
+permite llenar esa caché con su API pública, y un `conn.prepare()` aparte
+solo serviría para preparar cada sentencia dos veces.
+
+Cada sentencia pertenece a una clase (lectura, escritura, lote, mantenimiento)
+con su propio timeout, configurable con `DB_STATEMENT_TIMEOUTS`, y lleva un
+histograma de latencias (ver `latency_stats()`).
+"""
+
+import time
+
+import config
+from core.metrics import Histogram
+
+READ = "read"
+WRITE = "write"
+BATCH = "batch"
+MAINTENANCE = "maintenance"
+
+# Timeouts (s) por clase de sentencia; config.DB_STATEMENT_TIMEOUTS puede sobrescribir algunos
+STATEMENT_TIMEOUTS = {
+    READ: 2.0,
+    WRITE: 5.0,
+    BATCH: 15.0,
+    MAINTENANCE: 60.0,
+    **getattr(config, "DB_STATEMENT_TIMEOUTS", {}),
+}
+
+_REGISTRY = {}
+
+
+class Statement:
+    """Sentencia SQL registrada, con su clase y timeout."""
+
+    __slots__ = ("name", "sql", "kind", "latency", "errors")
+
+    def __init__(self, name, sql, kind):
+        self.name = name
+        self.sql = sql
+        self.kind = kind
+        self.latency = Histogram()
+        self.errors = 0
+
+    @property
+    def timeout(self):
+        return STATEMENT_TIMEOUTS[self.kind]
+
+    async def _run(self, method, args):
+        start = time.perf_counter()
+        try:
+            return await method(self.sql, *args, timeout=self.timeout)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.latency.observe(time.perf_counter() - start)
+
+    async def fetch(self, conn, *args):
+        return await self._run(conn.fetch, args)
+
+    async def fetchrow(self, conn, *args):
+        return await self._run(conn.fetchrow, args)
+
+    async def fetchval(self, conn, *args):
+        return await self._run(conn.fetchval, args)
+
+    async def execute(self, conn, *args):
+        """Ejecuta la sentencia y devuelve la etiqueta de estado (p. ej. "DELETE 3")."""
+        return await self._run(conn.execute, args)
+
+
+def statement(name, sql, kind=READ):
+    """Registra una sentencia con un nombre único y la devuelve."""
+    if name in _REGISTRY:
+        raise ValueError(f"Sentencia duplicada: {name}")
+    if kind not in STATEMENT_TIMEOUTS:
+        raise ValueError(f"Clase de sentencia desconocida: {kind}")
+    stmt = _REGISTRY[name] = Statement(name, sql, kind)
+    return stmt
+
+
+def registered():
+    """Devuelve todas las sentencias registradas."""
+    return list(_REGISTRY.values())
+
+
+def latency_stats():
+    """Histograma de latencias y errores de cada sentencia ejecutada al menos una vez."""
+    return {
+        stmt.name: {**stmt.latency.stats(), "errors": stmt.errors}
+        for stmt in _REGISTRY.values()
+        if stmt.latency.count
+    }
@@ -3,7 +3,11 @@
 import functools
 import logging
 import asyncio
+import random
+import time
+
 import asyncpg
+import config
 
 logger = logging.getLogger("db")
 logger.setLevel(logging.INFO)
@@ -14,35 +18,147 @@ if not logger.handlers:
     handler.setFormatter(formatter)
     logger.addHandler(handler)
 
+DB_RETRY_MAX_DELAY = getattr(config, "DB_RETRY_MAX_DELAY", 10.0)
+DB_BREAKER_THRESHOLD = getattr(config, "DB_BREAKER_THRESHOLD", 5)
+DB_BREAKER_RESET_TIMEOUT = getattr(config, "DB_BREAKER_RESET_TIMEOUT", 15.0)
+
+# Errores que indican que la BD no está disponible (no que la consulta sea incorrecta).
+# InterfaceError (y su subclase DataError) y OSError en general no entran: un
+# parámetro mal formado no debe reintentarse ni abrir el circuito. Sí entran,
+# explícitamente, los que produce un failover o reinicio de Postgres: la
+# conexión cerrada a mitad de consulta (ConnectionDoesNotExistError, que es
+# InterfaceError) y los cierres por el servidor (57P01-57P03).
+CONNECTION_ERRORS = (
+    asyncpg.PostgresConnectionError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.TooManyConnectionsError,
+    asyncpg.ConnectionDoesNotExistError,
+    asyncpg.AdminShutdownError,
+    asyncpg.CrashShutdownError,
+    asyncpg.OperatorInterventionError,
+    ConnectionError,
+)
+
+# Timeouts del lado del cliente: se reintentan, pero no cuentan como BD caída
+# (una consulta lenta no significa que la conexión esté perdida)
+TIMEOUT_ERRORS = (asyncio.TimeoutError, TimeoutError)
+
+
+def backoff_delay(attempt, base, max_delay=DB_RETRY_MAX_DELAY):
+    """Espera para el intento `attempt` (1, 2, ...): exponencial con jitter completo."""
+    return random.uniform(0, min(max_delay, base * 2 ** (attempt - 1)))
+
+
+# ────────────────────────────────
+# Circuit breaker
+# ────────────────────────────────
+
+class CircuitBreaker:
+    """
+    Corta las consultas cuando la BD está caída.
+
+    Tras `threshold` fallos de conexión seguidos se abre: las consultas fallan
+    al instante sin tocar la BD. Pasados `reset_timeout` segundos deja pasar
+    una única consulta de prueba; si funciona se cierra, si no vuelve a abrirse.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold=DB_BREAKER_THRESHOLD, reset_timeout=DB_BREAKER_RESET_TIMEOUT):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+
+    def allow(self):
+        """Indica si se puede intentar una consulta ahora."""
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at >= self.reset_timeout:
+            # Una sola consulta de prueba por periodo; las demás siguen fallando rápido
+            self.state = self.HALF_OPEN
+            self.opened_at = now
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("✅ Conexión con la BD recuperada; circuito cerrado")
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                logger.error(
+                    f"❌ BD no disponible ({self.failures} fallos seguidos); "
+                    f"circuito abierto durante {self.reset_timeout}s"
+                )
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def stats(self):
+        return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
+
+
+breaker = CircuitBreaker()
+
+
+# ────────────────────────────────
+# Decorador
+# ────────────────────────────────
 
 def db_safe(default=None, retries=3, delay=1.0):
     """
     Decorador para manejar errores de base de datos en funciones async y reintentar.
 
+    Los reintentos esperan de forma exponencial con jitter (`delay`, 2·`delay`,
+    4·`delay`... hasta `DB_RETRY_MAX_DELAY`, escogiendo al azar dentro de ese
+    intervalo) para que no lleguen todos a la vez a la BD. Si el circuit breaker
+    está abierto no se intenta la consulta.
+
     Args:
         default: valor a devolver si falla definitivamente.
         retries: número de intentos antes de rendirse.
-        delay: segundos a esperar entre reintentos.
+        delay: espera base (s) entre reintentos.
+
+    Las escrituras que fallan no se reintentan en segundo plano: quien llama
+    decide (el buffer de reacciones conserva su lote, el filtro de eventos sus
+    pendientes, y al alumno se le pide que reenvíe su respuesta).
     """
     def decorator(func):
         @functools.wraps(func)
         async def wrapper(*args, **kwargs):
-            attempt = 0
-            while attempt < retries:
+            if not breaker.allow():
+                return default
+
+            for attempt in range(1, retries + 1):
                 try:
-                    return await func(*args, **kwargs)
-                except (asyncpg.PostgresConnectionError,
-                        asyncpg.CannotConnectNowError) as e:
-                    attempt += 1
+                    result = await func(*args, **kwargs)
+                    breaker.record_success()
+                    return result
+                except CONNECTION_ERRORS + TIMEOUT_ERRORS as e:
+                    if not isinstance(e, TIMEOUT_ERRORS):
+                        breaker.record_failure()
+                    if attempt == retries or not breaker.allow():
+                        logger.error(f"❌ {func.__name__} falló después de {attempt} intentos: {e}")
+                        break
+                    wait = backoff_delay(attempt, delay)
                     logger.warning(
                         f"⚠️ Intento {attempt}/{retries} fallido en {func.__name__}: {e}. "
-                        f"Reintentando en {delay}s..."
+                        f"Reintentando en {wait:.1f}s..."
                     )
-                    await asyncio.sleep(delay)
+                    await asyncio.sleep(wait)
                 except Exception as e:
                     logger.exception(f"❌ Excepción inesperada en {func.__name__}: {e}")
-                    break
-            logger.error(f"❌ {func.__name__} falló después de {retries} intentos. Devolviendo valor por defecto.")
+                    return default
             return default
         return wrapper
     return decorator
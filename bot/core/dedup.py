@@ -0,0 +1,209 @@
+# core/dedup.py
+"""
+Filtro de eventos ya procesados (deduplicación por event_id).
+
+Los reintentos de sync, los reinicios y los timelines con huecos pueden
+entregar el mismo evento más de una vez. Los handlers que modifican estado
+llaman a `seen_events.claim(event_id, timestamp_ms)` antes de actuar:
+
+- Un filtro de Bloom en memoria responde en O(1). Si dice "quizá visto"
+  (posible falso positivo), se confirma contra la tabla processed_events.
+- Si dice "no visto", el evento es nuevo siempre que no haya podido
+  procesarse antes de la última rotación (ver abajo); en ese caso se procesa
+  sin tocar la BD.
+
+Los event_id procesados se escriben por lotes en processed_events y, al
+arrancar, se cargan los de las últimas `DEDUP_RETENTION_HOURS` horas para
+reconstruir el filtro. El filtro tiene dos generaciones que rotan al llenarse,
+así la tasa de falsos positivos se mantiene acotada sin crecer sin límite; al
+rotar se olvida la generación más antigua. Por eso un "no visto" solo es
+definitivo para eventos enviados después de que empezara la generación más
+antigua que se conserva (`_horizon_ms`); para los anteriores (o sin
+timestamp) se consulta processed_events. En ningún caso se detectan
+duplicados de más de `DEDUP_RETENTION_HOURS` horas: es lo que se guarda en
+processed_events.
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import time
+
+import config
+from config import DB_TYPE
+from core.db.constants import DB_MODULES
+
+logger = logging.getLogger("dedup")
+
+DEDUP_BLOOM_CAPACITY = getattr(config, "DEDUP_BLOOM_CAPACITY", 200000)
+DEDUP_BLOOM_ERROR_RATE = getattr(config, "DEDUP_BLOOM_ERROR_RATE", 0.001)
+DEDUP_RETENTION_HOURS = getattr(config, "DEDUP_RETENTION_HOURS", 72)
+DEDUP_FLUSH_INTERVAL = getattr(config, "DEDUP_FLUSH_INTERVAL", 2.0)
+DEDUP_PURGE_INTERVAL = getattr(config, "DEDUP_PURGE_INTERVAL", 3600)
+
+
+class BloomFilter:
+    """Filtro de Bloom sobre un bytearray, con doble hashing a partir de blake2b."""
+
+    __slots__ = ("size", "hashes", "bits", "count")
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class SeenEventFilter:
+    """Deduplicación de eventos: Bloom en memoria + confirmación en Postgres."""
+
+    def __init__(self, capacity=DEDUP_BLOOM_CAPACITY, error_rate=DEDUP_BLOOM_ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous = BloomFilter(capacity, error_rate)
+        # Los eventos procesados antes de este instante pueden haberse olvidado
+        # (0 = todavía no se ha rotado); y desde cuándo se llena la generación actual
+        self._horizon_ms = 0
+        self._current_started_ms = _now_ms()
+
+        # Procesados pero aún no escritos en processed_events
+        self._pending = set()
+        self._task = None
+        self._closing = False
+        self._wakeup = asyncio.Event()
+
+        self.duplicates = 0
+        self.confirmations = 0
+        self.false_positives = 0
+
+    def _might_contain(self, event_id):
+        return event_id in self._current or event_id in self._previous
+
+    def _remember(self, event_id):
+        if self._current.count >= self.capacity:
+            # Se olvida la generación anterior: lo procesado antes de que
+            # empezara la actual ya no está en memoria
+            self._horizon_ms = self._current_started_ms
+            self._current_started_ms = _now_ms()
+            self._previous = self._current
+            self._current = BloomFilter(self.capacity, self.error_rate)
+        self._current.add(event_id)
+
+    async def claim(self, event_id, timestamp_ms=None):
+        """
+        Marca el evento como procesado. Devuelve False si ya lo estaba
+        (el handler debe ignorarlo) y True si es la primera vez.
+
+        `timestamp_ms` es la hora del evento (origin_server_ts): si es
+        posterior al horizonte del filtro, un "no visto" no necesita la BD.
+        """
+        if not event_id:
+            return True
+
+        if event_id in self._pending:
+            self.duplicates += 1
+            return False
+
+        maybe_seen = self._might_contain(event_id)
+        forgotten = self._horizon_ms and (timestamp_ms is None or timestamp_ms < self._horizon_ms)
+        if maybe_seen or forgotten:
+            self.confirmations += 1
+            db = DB_MODULES[DB_TYPE]["queries"]
+            if await db.is_event_processed(event_id):
+                self.duplicates += 1
+                return False
+            if maybe_seen:
+                self.false_positives += 1
+
+        self._remember(event_id)
+        self._pending.add(event_id)
+        return True
+
+    # ──────────────────────────────────────────────
+    # Persistencia
+    # ──────────────────────────────────────────────
+
+    async def load(self, hours=DEDUP_RETENTION_HOURS):
+        """Reconstruye el filtro con los eventos procesados en las últimas `hours` horas."""
+        db = DB_MODULES[DB_TYPE]["queries"]
+        event_ids = await db.get_recent_processed_events(hours)
+        rotated_ms = self._current_started_ms
+        for event_id in event_ids:
+            self._remember(event_id)
+        if self._current_started_ms != rotated_ms:
+            # Si la carga hizo rotar, lo olvidado puede ser de hasta ahora mismo
+            self._horizon_ms = self._current_started_ms
+        logger.info(f"Filtro de eventos procesados cargado con {len(event_ids)} eventos")
+
+    async def flush(self):
+        """Escribe en processed_events los eventos pendientes."""
+        if not self._pending:
+            return
+        batch = list(self._pending)
+        db = DB_MODULES[DB_TYPE]["queries"]
+        if await db.mark_events_processed(batch):
+            self._pending.difference_update(batch)
+
+    def start(self):
+        """Arranca la escritura periódica en segundo plano."""
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run(), name="seen-events")
+
+    async def close(self):
+        """Detiene la escritura periódica y escribe lo pendiente."""
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        else:
+            await self.flush()
+
+    async def _run(self):
+        db = DB_MODULES[DB_TYPE]["queries"]
+        last_purge = None
+        while not self._closing:
+            if last_purge is None or time.monotonic() - last_purge >= DEDUP_PURGE_INTERVAL:
+                await db.purge_processed_events(DEDUP_RETENTION_HOURS)
+                last_purge = time.monotonic()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=DEDUP_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+        await self.flush()
+
+    def stats(self):
+        """Devuelve contadores del filtro."""
+        return {
+            "remembered": self._current.count + self._previous.count,
+            "pending": len(self._pending),
+            "duplicates": self.duplicates,
+            "confirmations": self.confirmations,
+            "false_positives": self.false_positives,
+        }
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+seen_events = SeenEventFilter()
@@ -0,0 +1,241 @@
+# core/dispatcher.py
+"""
+Despachador de eventos con una cola ordenada por sala y un pool acotado de workers.
+
+Los handlers ya no se cuelgan directamente de `client.syncer.on(...)`: el
+despachador registra un único callback por tipo de evento que encola el evento
+en la cola de su sala. Un número fijo de workers consume las salas listas de
+una en una, de modo que:
+
+- Los eventos de una misma sala se procesan en orden (nunca hay dos workers
+  trabajando a la vez sobre la misma sala).
+- Salas distintas se procesan en paralelo, turnándose evento a evento para que
+  una sala muy activa no acapare los workers.
+- Hay límites de eventos pendientes (global y por sala); al alcanzarlos, quien
+  encola espera, aplicando contrapresión en lugar de acumular sin límite.
+
+Fase de puesta al día: tras un reinicio, el primer sync reenvía eventos
+antiguos del timeline. Los handlers registrados con `live_only=True` (los que
+envían mensajes) solo reciben eventos posteriores al arranque del proceso; el
+resto debe tratarlos de forma idempotente.
+
+Cada evento encolado recibe un número de secuencia; `processed_upto()` indica
+hasta qué número están procesados todos (en cualquier sala), para que el
+token de sincronización solo se guarde cuando sus eventos ya se han tratado.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+import config
+
+logger = logging.getLogger("dispatcher")
+
+DISPATCH_WORKERS = getattr(config, "DISPATCH_WORKERS", 8)
+DISPATCH_MAX_PENDING = getattr(config, "DISPATCH_MAX_PENDING", 5000)
+DISPATCH_ROOM_QUEUE_LIMIT = getattr(config, "DISPATCH_ROOM_QUEUE_LIMIT", 500)
+
+
+class _RoomQueue:
+    """Cola FIFO de eventos pendientes de una sala."""
+
+    __slots__ = ("room_id", "pending", "slots", "scheduled", "refs")
+
+    def __init__(self, room_id, limit):
+        self.room_id = room_id
+        self.pending = deque()
+        self.slots = asyncio.Semaphore(limit)
+        self.scheduled = False
+        # Eventos encolados o esperando hueco; la sala se libera al llegar a 0
+        self.refs = 0
+
+
+class EventDispatcher:
+    """Encola los eventos de Matrix por sala y los ejecuta con N workers."""
+
+    def __init__(self, client, workers=DISPATCH_WORKERS, max_pending=DISPATCH_MAX_PENDING,
+                 room_queue_limit=DISPATCH_ROOM_QUEUE_LIMIT):
+        self.client = client
+        self.workers = workers
+        self.room_queue_limit = room_queue_limit
+
+        # Tipos de evento con algún handler registrado (para el filtro de sync)
+        self.event_types = []
+
+        self._rooms = {}
+        self._ready = asyncio.Queue()
+        self._slots = asyncio.Semaphore(max_pending)
+        self._tasks = []
+        self._pending = 0
+        # Secuencia del último evento encolado y de los que aún no han terminado
+        self._seq = 0
+        self._unfinished = set()
+
+        # Los eventos anteriores a este instante son históricos (puesta al día)
+        self.started_at_ms = int(time.time() * 1000)
+
+        self.dispatched = 0
+        self.failed = 0
+        self.skipped_historical = 0
+
+    # ──────────────────────────────────────────────
+    # Registro de handlers
+    # ──────────────────────────────────────────────
+
+    def on(self, event_type, live_only=False, accept=None):
+        """
+        Decorador equivalente a `client.syncer.on(event_type)`, pero encolado por sala.
+
+        Con `live_only=True` se descartan los eventos anteriores al arranque
+        del bot, para que la puesta al día no reenvíe bienvenidas o respuestas.
+        `accept(*args)`, si se indica, se evalúa antes de encolar: los eventos
+        que rechaza no llegan a ocupar sitio en la cola de la sala.
+        """
+        def decorator(handler):
+            async def enqueue(*args):
+                if accept is not None and not accept(*args):
+                    return
+                if live_only and self.is_historical(args[-1]):
+                    self.skipped_historical += 1
+                    return
+                await self.submit(handler, *args)
+
+            self.client.syncer.on(event_type)(enqueue)
+            self._track(event_type)
+            return handler
+        return decorator
+
+    def observe(self, event_type):
+        """
+        Decorador para observadores síncronos y baratos (p. ej. indexar eventos).
+
+        Se ejecutan en cuanto llega el evento, sin pasar por la cola, así que
+        ya han visto un evento antes de que cualquier handler encolado posterior
+        de la misma sala se ejecute.
+        """
+        def decorator(observer):
+            async def run(*args):
+                observer(*args)
+
+            self.client.syncer.on(event_type)(run)
+            self._track(event_type)
+            return observer
+        return decorator
+
+    def _track(self, event_type):
+        if event_type not in self.event_types:
+            self.event_types.append(event_type)
+
+    def is_historical(self, event):
+        """True si el evento se envió antes de arrancar el bot."""
+        timestamp = getattr(event, "timestamp", None)
+        return timestamp is not None and timestamp < self.started_at_ms
+
+    async def submit(self, handler, *args):
+        """Encola `handler(*args)` en la cola de la sala del evento."""
+        room_id = _room_id_of(args)
+        room = self._rooms.get(room_id)
+        if room is None:
+            room = self._rooms[room_id] = _RoomQueue(room_id, self.room_queue_limit)
+        room.refs += 1
+        # Se numera antes de esperar hueco, para que cuente desde que llega
+        self._seq += 1
+        seq = self._seq
+        self._unfinished.add(seq)
+
+        # Contrapresión: primero el límite de la sala, luego el global
+        await room.slots.acquire()
+        await self._slots.acquire()
+
+        room.pending.append((handler, args, seq))
+        self._pending += 1
+        if not room.scheduled:
+            room.scheduled = True
+            self._ready.put_nowait(room)
+
+    # ──────────────────────────────────────────────
+    # Ciclo de vida
+    # ──────────────────────────────────────────────
+
+    def start(self):
+        """Arranca los workers."""
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"dispatcher-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(f"Despachador iniciado con {self.workers} workers")
+
+    async def stop(self, drain=True):
+        """Detiene los workers, procesando antes lo pendiente si `drain` es True."""
+        if drain and self._pending:
+            await self._ready.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            room = await self._ready.get()
+            handler, args, seq = room.pending.popleft()
+            try:
+                await handler(*args)
+                self.dispatched += 1
+            except Exception:
+                self.failed += 1
+                logger.exception(f"Error en el handler {handler.__name__} (sala {room.room_id})")
+            finally:
+                self._unfinished.discard(seq)
+                self._pending -= 1
+                room.refs -= 1
+                room.slots.release()
+                self._slots.release()
+                # La sala vuelve al final de la cola si le quedan eventos, así
+                # cada sala avanza un evento por turno y se mantiene el orden.
+                if room.pending:
+                    self._ready.put_nowait(room)
+                else:
+                    room.scheduled = False
+                    if room.refs == 0:
+                        del self._rooms[room.room_id]
+                self._ready.task_done()
+
+    # ──────────────────────────────────────────────
+    # Progreso
+    # ──────────────────────────────────────────────
+
+    def submitted(self):
+        """Número de secuencia del último evento encolado."""
+        return self._seq
+
+    def processed_upto(self):
+        """Mayor número de secuencia tal que todos los eventos hasta él ya se procesaron."""
+        return min(self._unfinished) - 1 if self._unfinished else self._seq
+
+    # ──────────────────────────────────────────────
+    # Métricas
+    # ──────────────────────────────────────────────
+
+    def stats(self):
+        """Devuelve contadores básicos del despachador."""
+        return {
+            "workers": len(self._tasks),
+            "pending": self._pending,
+            "active_rooms": len(self._rooms),
+            "dispatched": self.dispatched,
+            "failed": self.failed,
+            "skipped_historical": self.skipped_historical,
+        }
+
+
+def _room_id_of(args):
+    """Obtiene el room_id a partir de los argumentos que recibe un handler `(room, event)`."""
+    for arg in args:
+        room_id = getattr(arg, "room_id", None)
+        if room_id:
+            return room_id
+    return None
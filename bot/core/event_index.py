@@ -0,0 +1,100 @@
+# core/event_index.py
+"""
+Índice local y acotado de eventos vistos en el sync: event_id → remitente,
+sala, tipo y clave de reacción.
+
+Los handlers de reacciones y redacciones necesitan saber quién envió el evento
+al que se reacciona. En lugar de pedírselo al homeserver (`client.get_event`)
+en cada reacción, el índice se alimenta del propio flujo de sync y solo se
+recurre a `get_event` cuando el evento no está indexado.
+"""
+
+import sys
+from collections import OrderedDict
+
+import config
+
+EVENT_INDEX_SIZE = getattr(config, "EVENT_INDEX_SIZE", 50000)
+
+
+class IndexedEvent:
+    """Datos mínimos de un evento. `key` y `relates_to` solo aplican a reacciones."""
+
+    __slots__ = ("sender", "room_id", "type", "key", "relates_to")
+
+    def __init__(self, sender, room_id, type, key=None, relates_to=None):
+        # Remitentes y salas se repiten mucho: se internan para compartir la cadena
+        self.sender = sys.intern(sender)
+        self.room_id = sys.intern(room_id)
+        self.type = type
+        self.key = key
+        self.relates_to = relates_to
+
+
+class EventIndex:
+    """Mapa FIFO acotado de event_id → IndexedEvent."""
+
+    def __init__(self, maxsize=EVENT_INDEX_SIZE):
+        self.maxsize = maxsize
+        self._events = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, event):
+        """Indexa un evento recibido en el sync (o devuelto por `get_event`)."""
+        event_id = getattr(event, "event_id", None)
+        if not event_id or not getattr(event, "sender", None):
+            return None
+
+        key = relates_to = None
+        content = getattr(event, "content", None)
+        if content is not None and hasattr(content, "get"):
+            relation = content.get("m.relates_to") or {}
+            key = relation.get("key")
+            relates_to = relation.get("event_id")
+
+        entry = IndexedEvent(event.sender, event.room_id, event.type, key, relates_to)
+        self._events[event_id] = entry
+        if len(self._events) > self.maxsize:
+            self._events.popitem(last=False)
+        return entry
+
+    def get(self, event_id):
+        """Devuelve la entrada indexada o None, sin consultar al homeserver."""
+        return self._events.get(event_id)
+
+    def forget(self, event_id):
+        """Elimina un evento del índice (p. ej. tras redactarlo)."""
+        self._events.pop(event_id, None)
+
+    async def resolve(self, client, room_id, event_id):
+        """Devuelve la entrada del evento; si no está indexado, la pide con `get_event`."""
+        entry = self._events.get(event_id)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        try:
+            event = await client.get_event(room_id, event_id)
+        except Exception:
+            return None
+        if not event:
+            return None
+        return self.record(event)
+
+    def stats(self):
+        """Devuelve tamaño y contadores de acierto/fallo del índice."""
+        return {
+            "size": len(self._events),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def __len__(self):
+        return len(self._events)
+
+
+event_index = EventIndex()
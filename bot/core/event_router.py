@@ -1,9 +1,14 @@
 # core/event_router.py
 
-from handlers import messages, members, reactions
+from core.dispatcher import EventDispatcher
+from handlers import index, messages, members, reactions, redactions
 
 def register_event_handlers(client):
-    members.register(client)
-    messages.register(client)
-    reactions.register(client)
+    dispatcher = EventDispatcher(client)
+    index.register(client, dispatcher)
+    members.register(client, dispatcher)
+    messages.register(client, dispatcher)
+    reactions.register(client, dispatcher)
+    redactions.register(client, dispatcher)
     print("[+] Handlers de eventos registrados")
+    return dispatcher
@@ -0,0 +1,258 @@
+# core/grading.py
+"""
+Corrección automática de respuestas.
+
+Las preguntas de opciones se corrigen comparando los option_id elegidos con
+los marcados como correctos (todos y solo ellos si la pregunta admite varias
+opciones). Las de texto (short_answer, numeric) se comparan con la respuesta
+esperada (la opción `ANSWER`). Las encuestas y las preguntas sin respuesta
+esperada no se corrigen (None).
+
+Para las de texto, la respuesta esperada se compila una sola vez en un
+`Grader` (cacheado por tipo y texto esperado), así que corregir cada
+respuesta es normalizarla y comparar:
+
+- short_answer: sin distinguir mayúsculas, tildes ni espacios repetidos.
+  Se admiten varias respuestas válidas separadas por `|` ("Madrid | Madriz").
+- numeric: coma o punto decimal ("3,14" = "3.14"), con la tolerancia
+  `GRADING_NUMERIC_TOLERANCE` (absoluta) y `GRADING_NUMERIC_REL_TOLERANCE`
+  (relativa), o la que indique la propia respuesta esperada ("9,8 ± 0,1").
+  Se compara en decimal (Decimal), así que el límite de la tolerancia entra
+  ("9,7" vale para "9,8 ± 0,1"). Los separadores de miles solo se aceptan
+  en grupos de tres cifras bien formados ("1.000.000", "1.000,5"); "1.2.3"
+  no es un número. Un único separador seguido de tres cifras ("1.500") es
+  ambiguo: se lee como decimal (1,5) y, si así no coincide, como miles (1500).
+  Si la respuesta esperada no es un número se compara como texto.
+
+Las respuestas de texto se puntúan al guardarlas (score 100 o 0, is_graded).
+`regrade_question(question_id)` vuelve a corregir todas las respuestas de una
+pregunta (p. ej. tras cambiar la respuesta esperada) por lotes de
+`GRADING_BATCH_SIZE`, cada uno con un único UPDATE. Las respuestas corregidas a
+mano desde el panel (con grader_id) no se tocan. Se lanza sola cuando el índice
+de preguntas ve cambiar la respuesta esperada (`watch_answer_keys`) y a mano
+con `!corregir <id>`.
+"""
+
+import asyncio
+import logging
+import re
+import unicodedata
+from decimal import Decimal
+from functools import lru_cache
+
+import config
+from config import DB_TYPE
+from core.db.constants import *
+from core.db.constants import DB_MODULES
+from core.question_index import CHOICE_TYPES, question_index
+
+logger = logging.getLogger("grading")
+
+GRADING_NUMERIC_TOLERANCE = getattr(config, "GRADING_NUMERIC_TOLERANCE", 0.0)
+GRADING_NUMERIC_REL_TOLERANCE = getattr(config, "GRADING_NUMERIC_REL_TOLERANCE", 1e-9)
+GRADING_BATCH_SIZE = getattr(config, "GRADING_BATCH_SIZE", 1000)
+
+# Tipos de texto que se puntúan automáticamente
+GRADED_TYPES = frozenset({"short_answer", "numeric"})
+
+SCORE_CORRECT = 100
+SCORE_WRONG = 0
+
+_WHITESPACE = re.compile(r"\s+")
+_NUMBER = re.compile(r"[+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:e[+-]?\d+)?")
+# Parte entera agrupada de tres en tres con un único tipo de separador
+_GROUPED = {sep: re.compile(rf"[+-]?[1-9]\d{{0,2}}(?:\{sep}\d{{3}})+") for sep in ".,"}
+_TOLERANCE = re.compile(r"\s*(?:±|\+/-|\+-)\s*")
+# Mismo rango que un float: lo que se sale no se considera número
+_MAX_EXPONENT = 308
+_ALTERNATIVES = "|"
+
+
+def normalize_text(text):
+    """Quita tildes, mayúsculas y espacios repetidos ("  Canción  X " → "cancion x")."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _WHITESPACE.sub(" ", text.casefold()).strip()
+
+
+def number_readings(text):
+    """
+    Lecturas posibles de `text` como número (Decimal), de la preferida a la
+    menos probable: (1.5,) para "1,5"; (1.5, 1500) para el ambiguo "1.500";
+    () si no es un número ("1.2.3", "abc").
+    """
+    text = _WHITESPACE.sub("", text).casefold()
+    if "," in text and "." in text:
+        # El último separador es el decimal; el otro, de miles
+        decimal = "," if text.rfind(",") > text.rfind(".") else "."
+        thousands = "." if decimal == "," else ","
+        integer, _, fraction = text.rpartition(decimal)
+        if not _GROUPED[thousands].fullmatch(integer) or thousands in fraction:
+            return ()
+        candidates = [f"{integer.replace(thousands, '')}.{fraction}"]
+    elif text.count(",") + text.count(".") > 1:
+        sep = "," if "," in text else "."
+        if not _GROUPED[sep].fullmatch(text):
+            return ()
+        candidates = [text.replace(sep, "")]
+    elif "," in text or "." in text:
+        sep = "," if "," in text else "."
+        candidates = [text.replace(sep, ".")]
+        if _GROUPED[sep].fullmatch(text):
+            candidates.append(text.replace(sep, ""))
+    else:
+        candidates = [text]
+    return tuple(
+        value for value in (Decimal(c) for c in candidates if _NUMBER.fullmatch(c))
+        if value.is_zero() or abs(value.adjusted()) <= _MAX_EXPONENT
+    )
+
+
+def parse_number(text):
+    """
+    Convierte "3,14", "1.000,5", "1 000.5" o "-2e3" en Decimal (la lectura
+    preferida, ver `number_readings`). Devuelve None si el texto no es un número.
+    """
+    readings = number_readings(text)
+    return readings[0] if readings else None
+
+
+class Grader:
+    """Respuesta esperada de una pregunta de texto, ya normalizada."""
+
+    __slots__ = ("texts", "number", "tolerance")
+
+    def __init__(self, qtype, expected):
+        self.texts = frozenset(
+            normalize_text(alternative) for alternative in expected.split(_ALTERNATIVES)
+            if alternative.strip()
+        )
+        self.number = None
+        self.tolerance = _ABS_TOLERANCE
+        if qtype == "numeric":
+            value, tolerance = _split_tolerance(expected)
+            self.number = parse_number(value)
+            if tolerance is not None:
+                self.tolerance = tolerance
+
+    def grade(self, text):
+        """True/False según si `text` coincide con la respuesta esperada."""
+        if self.number is not None:
+            readings = number_readings(text)
+            if readings:
+                return any(self._matches(value) for value in readings)
+        return normalize_text(text) in self.texts
+
+
+    def _matches(self, value):
+        # Como math.isclose, pero sin el error de redondeo de los float
+        allowed = max(self.tolerance, _REL_TOLERANCE * max(abs(value), abs(self.number)))
+        return abs(value - self.number) <= allowed
+
+
+def _split_tolerance(expected):
+    """Separa "9,8 ± 0,1" en ("9,8", Decimal("0.1")). La tolerancia es None si no se indica o no es válida."""
+    parts = _TOLERANCE.split(expected, maxsplit=1)
+    if len(parts) == 1:
+        return expected, None
+    tolerance = parse_number(parts[1])
+    return parts[0], abs(tolerance) if tolerance is not None else None
+
+
+_ABS_TOLERANCE = Decimal(str(GRADING_NUMERIC_TOLERANCE))
+_REL_TOLERANCE = Decimal(str(GRADING_NUMERIC_REL_TOLERANCE))
+
+
+@lru_cache(maxsize=1024)
+def grader(qtype, expected):
+    """Devuelve el `Grader` de una respuesta esperada (compilado una sola vez)."""
+    return Grader(qtype, expected)
+
+
+def is_correct(question, option_ids=(), text=None):
+    """True/False si la respuesta se puede corregir automáticamente, None si no."""
+    if question.qtype in CHOICE_TYPES:
+        if not question.correct:
+            return None
+        if question.allow_multiple_answers:
+            return set(option_ids) == question.correct
+        return len(option_ids) == 1 and option_ids[0] in question.correct
+
+    if question.expected is None or text is None:
+        return None
+    return grader(question.qtype, question.expected).grade(text)
+
+
+def auto_score(question, text):
+    """Puntuación (SCORE_CORRECT/SCORE_WRONG) de una respuesta de texto, o None si no se puntúa."""
+    if question.qtype not in GRADED_TYPES or question.expected is None or text is None:
+        return None
+    return SCORE_CORRECT if grader(question.qtype, question.expected).grade(text) else SCORE_WRONG
+
+
+async def regrade_question(question_id, batch_size=GRADING_BATCH_SIZE):
+    """
+    Vuelve a puntuar todas las respuestas de una pregunta de texto con su
+    respuesta esperada actual. Devuelve el número de respuestas actualizadas, o
+    None si la pregunta no existe, no es de texto o la BD falla.
+    """
+    db = DB_MODULES[DB_TYPE]["queries"]
+    question = await db.get_question_answer_key(question_id)
+    if question is None or question[COL_QUESTION_QTYPE] not in GRADED_TYPES:
+        return None
+
+    expected = question[JOINED_QUESTION_EXPECTED_ANSWER]
+    compiled = grader(question[COL_QUESTION_QTYPE], expected) if expected is not None else None
+
+    updated = 0
+    after_id = 0
+    while True:
+        rows = await db.get_responses_page_for_grading(question_id, after_id, batch_size)
+        if rows is None:
+            return None
+        if not rows:
+            break
+        ids = [row[COL_QUESTION_RESPONSE_ID] for row in rows]
+        scores = [
+            None if compiled is None or text is None
+            else SCORE_CORRECT if compiled.grade(text) else SCORE_WRONG
+            for text in (row[COL_QUESTION_RESPONSE_ANSWER_TEXT] for row in rows)
+        ]
+        count = await db.set_response_scores(ids, scores)
+        if count is None:
+            return None
+        updated += count
+        after_id = ids[-1]
+        if len(rows) < batch_size:
+            break
+        # Deja pasar al resto de tareas entre lote y lote
+        await asyncio.sleep(0)
+
+    logger.info(f"Pregunta {question_id}: {updated} respuestas recorregidas")
+    return updated
+
+
+_regrades = {}
+
+
+def _on_question_change(old, new):
+    if old is None or new is None or new.qtype not in GRADED_TYPES or old.expected == new.expected:
+        return
+    running = _regrades.get(new.id)
+    if running is not None:
+        # Cada lote es un UPDATE completo: se puede cortar entre lotes y empezar de nuevo
+        running.cancel()
+    task = asyncio.create_task(regrade_question(new.id), name=f"regrade-{new.id}")
+    _regrades[new.id] = task
+    task.add_done_callback(lambda done: _forget_regrade(new.id, done))
+
+
+def _forget_regrade(question_id, task):
+    if _regrades.get(question_id) is task:
+        del _regrades[question_id]
+
+
+def watch_answer_keys():
+    """Recorrige las respuestas de una pregunta indexada cuando el panel cambia su respuesta esperada."""
+    question_index.watch(_on_question_change)
+
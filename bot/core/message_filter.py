@@ -0,0 +1,96 @@
+# core/message_filter.py
+"""
+Filtro rápido de mensajes, antes de encolarlos en el despachador.
+
+En una sala concurrida casi ningún mensaje es un comando o una respuesta. El
+filtro decide con una sola comprobación de prefijo (`str.startswith` con la
+tupla de prefijos registrados) si un mensaje merece trabajo; el resto se
+descarta sin copiar ni registrar el texto y sin pasar por la cola de la sala.
+Cada prefijo tiene su ruta (`add_route`), que recibe los mensajes aceptados.
+Una ruta puede llevar además una condición sobre la sala (`when(room_id)`):
+p. ej. los mensajes que empiezan por "=" solo son respuestas si la sala tiene
+alguna pregunta abierta; si no, son charla ("=)", "=D") y se descartan aquí.
+Las rutas `live_only` (los comandos) descartan además los mensajes enviados
+antes del arranque, que llegan en la puesta al día; las demás (las respuestas)
+los reciben para no perder lo que se envió con el bot parado.
+
+Los contadores `seen` y `dispatched` permiten medir qué fracción de los
+mensajes llega realmente a los handlers.
+"""
+
+
+class MessageFilter:
+    """Deja pasar solo los mensajes que empiezan por alguno de los prefijos registrados."""
+
+    def __init__(self):
+        self.prefixes = ()
+        self.own_mxid = None
+        self._routes = {}
+        self._conditions = {}
+        self._live_only = set()
+        self.is_historical = None
+
+        self.seen = 0
+        self.dispatched = 0
+        self.skipped_historical = 0
+
+    def bind(self, client, is_historical=None):
+        """
+        Asocia el cliente del bot, para ignorar sus propios mensajes, y
+        `is_historical(event)` (el del despachador) para las rutas `live_only`.
+        """
+        self.own_mxid = client.mxid
+        self.is_historical = is_historical
+
+    def add_route(self, prefix, handler, when=None, live_only=False):
+        """
+        Envía a `handler(client, room_id, event, body)` los mensajes que empiezan
+        por `prefix` (y, si se indica `when(room_id)`, solo en las salas donde devuelve True).
+        Con `live_only=True` no recibe los mensajes anteriores al arranque.
+        """
+        self._routes[prefix] = handler
+        if when is not None:
+            self._conditions[prefix] = when
+        if live_only:
+            self._live_only.add(prefix)
+        # Los prefijos más largos primero, para que "!!" no se confunda con "!"
+        self.prefixes = tuple(sorted(self._routes, key=len, reverse=True))
+
+    def route(self, body):
+        """Devuelve el handler del prefijo por el que empieza `body` (o None)."""
+        prefix = self._prefix(body)
+        return self._routes[prefix] if prefix is not None else None
+
+    def _prefix(self, body):
+        for prefix in self.prefixes:
+            if body.startswith(prefix):
+                return prefix
+        return None
+
+    def accept(self, room, event):
+        """True si el mensaje debe llegar a los handlers. No reserva memoria si no."""
+        self.seen += 1
+        body = getattr(event, "body", None)
+        if body is None or not body.startswith(self.prefixes) or event.sender == self.own_mxid:
+            return False
+        prefix = self._prefix(body)
+        when = self._conditions.get(prefix)
+        if when is not None and not when(room.room_id):
+            return False
+        if prefix in self._live_only and self.is_historical is not None and self.is_historical(event):
+            self.skipped_historical += 1
+            return False
+        self.dispatched += 1
+        return True
+
+    def stats(self):
+        """Devuelve los contadores del filtro."""
+        return {
+            "seen": self.seen,
+            "dispatched": self.dispatched,
+            "skipped_historical": self.skipped_historical,
+            "dispatch_ratio": self.dispatched / self.seen if self.seen else 0.0,
+        }
+
+
+message_filter = MessageFilter()
@@ -0,0 +1,61 @@
+# core/metrics.py
+"""
+Histogramas de latencia con cubos fijos.
+
+Registrar una observación es O(número de cubos) y no guarda las muestras,
+así que se puede medir cada consulta sin que la memoria crezca.
+"""
+
+from bisect import bisect_left
+
+# Límites superiores de los cubos, en milisegundos
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """Histograma acumulativo de duraciones (en segundos al observar, en ms al leer)."""
+
+    __slots__ = ("buckets", "counts", "count", "total", "max")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        # Un cubo más para lo que supera el último límite
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        ms = seconds * 1000
+        self.counts[bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, p):
+        """Cota superior (en ms) del percentil `p` (0-100), según los cubos."""
+        if not self.count:
+            return 0.0
+        rank = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return float(self.buckets[i]) if i < len(self.buckets) else self.max
+        return self.max
+
+    def stats(self):
+        """Resumen del histograma (tiempos en ms)."""
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count, 2) if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(self.max, 2),
+            "buckets": {
+                **{f"<={b}": n for b, n in zip(self.buckets, self.counts)},
+                f">{self.buckets[-1]}": self.counts[-1],
+            },
+        }
@@ -0,0 +1,322 @@
+# core/outbox.py
+"""
+Cola de salida de mensajes con limitación de ritmo por sala y agrupación.
+
+Handlers y comandos no esperan a `client.send_text`: encolan el mensaje con
+`outbox.send_text(...)` y siguen. Cada sala tiene un cubo de tokens
+(`OUTBOX_RATE` mensajes/s con ráfagas de hasta `OUTBOX_BURST`) y, delante de
+todos, hay uno global (`OUTBOX_GLOBAL_RATE`, `OUTBOX_GLOBAL_BURST`): Synapse
+limita por remitente, no por sala, así que muchas salas a la vez no deben
+sumar más que eso. Si el homeserver responde M_LIMIT_EXCEEDED, se pausan
+todos los envíos durante `retry_after_ms` y la sala reintenta el mismo
+mensaje sin perder el orden.
+
+Las salas sin mensajes pendientes se olvidan en cuanto su cubo se ha
+rellenado del todo (entonces una sala nueva empezaría igual), para que
+`_rooms` no crezca con cada sala a la que el bot ha escrito alguna vez.
+
+`send_coalesced(...)` agrupa avisos parecidos que llegan en ráfaga (p. ej. 40
+altas en pocos segundos) en un único mensaje tras `OUTBOX_COALESCE_WINDOW`
+segundos.
+
+Los textos largos se construyen con `outbox.chunked(room_id)`: se añaden línea
+a línea y se envían en mensajes de como mucho `OUTBOX_MAX_MESSAGE_BYTES` bytes
+(el homeserver rechaza eventos de más de 64 KiB).
+"""
+
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from mautrix.errors import MLimitExceeded
+
+import config
+
+logger = logging.getLogger("outbox")
+
+OUTBOX_RATE = getattr(config, "OUTBOX_RATE", 1.0)
+OUTBOX_BURST = getattr(config, "OUTBOX_BURST", 5)
+OUTBOX_GLOBAL_RATE = getattr(config, "OUTBOX_GLOBAL_RATE", 5.0)
+OUTBOX_GLOBAL_BURST = getattr(config, "OUTBOX_GLOBAL_BURST", 10)
+OUTBOX_COALESCE_WINDOW = getattr(config, "OUTBOX_COALESCE_WINDOW", 5.0)
+OUTBOX_ROOM_QUEUE_LIMIT = getattr(config, "OUTBOX_ROOM_QUEUE_LIMIT", 200)
+OUTBOX_MAX_ATTEMPTS = getattr(config, "OUTBOX_MAX_ATTEMPTS", 5)
+OUTBOX_MAX_MESSAGE_BYTES = getattr(config, "OUTBOX_MAX_MESSAGE_BYTES", 16000)
+
+# Espera por defecto si un M_LIMIT_EXCEEDED no indica retry_after_ms
+_DEFAULT_RETRY_AFTER_MS = 2000
+
+# Lista donde `capture()` registra lo enviado desde la tarea actual
+_captured = contextvars.ContextVar("outbox_captured", default=None)
+
+
+class _Bucket:
+    """Cubo de tokens: `rate` tokens/s hasta un máximo de `burst`."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def take(self):
+        while True:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def until_full(self):
+        """Segundos hasta que el cubo esté lleno."""
+        self.refill()
+        return (self.burst - self.tokens) / self.rate
+
+
+class _RoomOutbox(_Bucket):
+    """Cola y cubo de tokens de una sala."""
+
+    __slots__ = ("queue", "task", "prune")
+
+    def __init__(self, rate, burst):
+        super().__init__(rate, burst)
+        self.queue = deque()
+        self.task = None
+        self.prune = None
+
+
+class ChunkedMessage:
+    """
+    Texto largo que se envía en varios mensajes de tamaño acotado.
+
+    Las líneas se acumulan en una lista y se unen una sola vez por mensaje;
+    cuando la siguiente línea no cabe, el mensaje en curso se encola y se
+    empieza otro, de modo que nunca se parte una línea entre dos mensajes.
+    """
+
+    __slots__ = ("outbox", "room_id", "max_bytes", "messages", "_lines", "_size")
+
+    def __init__(self, outbox, room_id, max_bytes=OUTBOX_MAX_MESSAGE_BYTES):
+        self.outbox = outbox
+        self.room_id = room_id
+        self.max_bytes = max_bytes
+        self.messages = 0
+        self._lines = []
+        self._size = 0
+
+    def add(self, line=""):
+        """Añade una línea; encola el mensaje en curso si con ella se pasaría del límite."""
+        size = len(line.encode("utf-8")) + 1  # + salto de línea
+        if size > self.max_bytes:
+            # Una sola línea enorme: se recorta para que quepa en un mensaje
+            line = line.encode("utf-8")[:self.max_bytes - 4].decode("utf-8", "ignore") + "…"
+            size = len(line.encode("utf-8")) + 1
+        if self._lines and self._size + size > self.max_bytes:
+            self.flush()
+        self._lines.append(line)
+        self._size += size
+
+    def flush(self):
+        """Encola lo acumulado como un mensaje (sin líneas en blanco al final)."""
+        while self._lines and not self._lines[-1]:
+            self._lines.pop()
+        if self._lines:
+            self.outbox.send_text(self.room_id, "\n".join(self._lines))
+            self.messages += 1
+        self._lines = []
+        self._size = 0
+
+
+class Outbox:
+    """Envía los mensajes en segundo plano respetando el ritmo de cada sala."""
+
+    def __init__(self, rate=OUTBOX_RATE, burst=OUTBOX_BURST,
+                 coalesce_window=OUTBOX_COALESCE_WINDOW, room_queue_limit=OUTBOX_ROOM_QUEUE_LIMIT,
+                 global_rate=OUTBOX_GLOBAL_RATE, global_burst=OUTBOX_GLOBAL_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.coalesce_window = coalesce_window
+        self.room_queue_limit = room_queue_limit
+
+        self.client = None
+        self._rooms = {}
+        self._groups = {}
+        self._global = _Bucket(global_rate, global_burst)
+        # Instante (monotonic) hasta el que el homeserver pidió no enviar nada
+        self._paused_until = 0.0
+
+        self.sent = 0
+        self.dropped = 0
+        self.rate_limited = 0
+
+    def bind(self, client):
+        """Asocia el cliente de Matrix con el que se enviarán los mensajes."""
+        self.client = client
+
+    # ──────────────────────────────────────────────
+    # Encolado
+    # ──────────────────────────────────────────────
+
+    def send_text(self, room_id, text):
+        """Encola un mensaje de texto para la sala. No bloquea."""
+        captured = _captured.get()
+        if captured is not None:
+            captured.append((room_id, text))
+
+        room = self._rooms.get(room_id)
+        if room is None:
+            room = self._rooms[room_id] = _RoomOutbox(self.rate, self.burst)
+        elif room.prune is not None:
+            room.prune.cancel()
+            room.prune = None
+
+        if len(room.queue) >= self.room_queue_limit:
+            # Se descarta el más antiguo: en una avalancha importa más lo reciente
+            room.queue.popleft()
+            self.dropped += 1
+            logger.warning(f"Cola de salida llena en {room_id}; se descarta un mensaje")
+
+        room.queue.append(text)
+        if room.task is None:
+            room.task = asyncio.create_task(self._drain(room_id, room))
+
+    @contextmanager
+    def capture(self):
+        """
+        Registra los mensajes que se encolan desde la tarea actual (y sus subtareas)
+        como una lista de (room_id, texto). Los mensajes se envían igualmente.
+        """
+        captured = []
+        token = _captured.set(captured)
+        try:
+            yield captured
+        finally:
+            _captured.reset(token)
+
+    def chunked(self, room_id, max_bytes=OUTBOX_MAX_MESSAGE_BYTES):
+        """Devuelve un `ChunkedMessage` para enviar un texto largo a la sala."""
+        return ChunkedMessage(self, room_id, max_bytes)
+
+    def send_coalesced(self, room_id, key, item, render):
+        """
+        Agrupa `item` con los recibidos para (`room_id`, `key`) en la ventana actual.
+
+        Al cerrar la ventana se envía un único mensaje `render(items)`.
+        """
+        group_key = (room_id, key)
+        group = self._groups.get(group_key)
+        if group is not None:
+            group[0].append(item)
+            return
+
+        items = [item]
+        loop = asyncio.get_running_loop()
+        handle = loop.call_later(self.coalesce_window, self._flush_group, group_key)
+        self._groups[group_key] = (items, render, handle)
+
+    def _flush_group(self, group_key):
+        items, render, _ = self._groups.pop(group_key)
+        self.send_text(group_key[0], render(items))
+
+    # ──────────────────────────────────────────────
+    # Envío
+    # ──────────────────────────────────────────────
+
+    async def _drain(self, room_id, room):
+        try:
+            while room.queue:
+                await room.take()
+                await self._take_global()
+                # Los reintentos se hacen dentro de _send, así que el orden se mantiene
+                text = room.queue.popleft()
+                if await self._send(room_id, text):
+                    self.sent += 1
+        finally:
+            room.task = None
+            if not room.queue:
+                # Se olvida cuando su cubo esté lleno: antes, una sala nueva
+                # tendría más tokens de los que le quedan a esta
+                room.prune = asyncio.get_running_loop().call_later(
+                    room.until_full(), self._prune, room_id, room,
+                )
+
+    def _prune(self, room_id, room):
+        room.prune = None
+        if room.task is None and not room.queue and self._rooms.get(room_id) is room:
+            del self._rooms[room_id]
+
+    async def _take_global(self):
+        while True:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self._global.take()
+            # Otra sala pudo recibir un M_LIMIT_EXCEEDED mientras se esperaba el token
+            if self._paused_until <= time.monotonic():
+                return
+            self._global.tokens += 1
+
+    async def _send(self, room_id, text):
+        """Envía un mensaje reintentando ante M_LIMIT_EXCEEDED. Devuelve True si se envió."""
+        for attempt in range(1, OUTBOX_MAX_ATTEMPTS + 1):
+            try:
+                await self.client.send_text(room_id, text)
+                return True
+            except MLimitExceeded as e:
+                self.rate_limited += 1
+                retry_after_ms = getattr(e, "retry_after_ms", None) or _DEFAULT_RETRY_AFTER_MS
+                logger.warning(f"Límite de envío en {room_id}; reintento en {retry_after_ms} ms")
+                # El límite es del remitente: se pausan todas las salas
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after_ms / 1000)
+                await self._take_global()
+            except Exception as e:
+                logger.warning(f"Error enviando a {room_id} (intento {attempt}/{OUTBOX_MAX_ATTEMPTS}): {e}")
+                await asyncio.sleep(attempt)
+        self.dropped += 1
+        logger.error(f"Se descarta un mensaje para {room_id} tras {OUTBOX_MAX_ATTEMPTS} intentos")
+        return False
+
+    # ──────────────────────────────────────────────
+    # Cierre y métricas
+    # ──────────────────────────────────────────────
+
+    async def close(self, timeout=10.0):
+        """Envía los grupos abiertos y espera (hasta `timeout` s) a vaciar las colas."""
+        for group_key in list(self._groups):
+            self._groups[group_key][2].cancel()
+            self._flush_group(group_key)
+
+        for room in self._rooms.values():
+            if room.prune is not None:
+                room.prune.cancel()
+                room.prune = None
+
+        tasks = [room.task for room in self._rooms.values() if room.task is not None]
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        """Devuelve contadores de la cola de salida."""
+        return {
+            "rooms": len(self._rooms),
+            "queued": sum(len(room.queue) for room in self._rooms.values()),
+            "coalescing": len(self._groups),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "rate_limited": self.rate_limited,
+        }
+
+
+outbox = Outbox()
@@ -0,0 +1,481 @@
+# core/question_index.py
+"""
+Índice en memoria de las preguntas abiertas de cada sala.
+
+Al arrancar se cargan con una sola consulta todas las preguntas abiertas o que
+pueden abrirse solas (por su ventana start_at/end_at), con sus opciones. A
+partir de ahí el índice se mantiene al día de forma incremental:
+
+- La migración 0002 añade un trigger que hace NOTIFY con el id de cada
+  pregunta (u opción) que el panel crea, modifica o borra. El índice escucha
+  ese canal, agrupa los ids que llegan en `QUESTION_NOTIFY_DELAY` segundos y
+  vuelve a leer solo esas preguntas.
+- Cada `QUESTION_REFRESH_INTERVAL` segundos se recarga todo, por si se perdió
+  alguna notificación (p. ej. si se cayó la conexión de escucha).
+
+Para las preguntas sin reenvíos, el índice sabe además qué alumnos ya han
+respondido (se carga con las preguntas y se actualiza con cada respuesta), de
+modo que un reenvío que la BD va a rechazar se descarta sin consultarla.
+
+Otros módulos pueden seguir los cambios con `watch(callback)`: se llama a
+`callback(old, new)` cada vez que una pregunta entra, cambia o sale del índice
+(`old` o `new` son None si no estaba o ya no está).
+
+Si una pregunta está abierta o no se decide en memoria con sus campos de
+tiempo, igual que el panel (manual_active o dentro de la ventana, y sin
+close_triggered). Así cada mensaje se clasifica como respuesta o no sin tocar
+la BD: `classify(room_id, texto)` devuelve un `Answer` con los option_id ya
+resueltos a partir de las claves (A, B...) o del texto de la opción.
+"""
+
+import asyncio
+import logging
+import re
+import time
+
+import config
+from config import DB_TYPE
+from core.db.constants import *
+from core.db.constants import DB_MODULES
+
+logger = logging.getLogger("questions")
+
+ANSWER_PREFIX = getattr(config, "ANSWER_PREFIX", "=")
+QUESTION_REFRESH_INTERVAL = getattr(config, "QUESTION_REFRESH_INTERVAL", 300)
+QUESTION_NOTIFY_DELAY = getattr(config, "QUESTION_NOTIFY_DELAY", 0.2)
+
+# Tipos que se responden eligiendo opciones; el resto se responde con texto
+CHOICE_TYPES = frozenset({"multiple_choice", "poll", "true_false"})
+
+# Clave de la opción que guarda la respuesta esperada en short_answer/numeric
+EXPECTED_ANSWER_KEY = "ANSWER"
+
+_SEPARATORS = re.compile(r"[\s,;]+")
+_TARGET = re.compile(r"#(\d+)\s*")
+
+
+class InvalidAnswer(ValueError):
+    """La respuesta no encaja con la pregunta (opción inexistente, varias opciones...)."""
+
+
+def _epoch(value):
+    return value.timestamp() if value is not None else None
+
+
+class OpenQuestion:
+    """Pregunta indexada: campos de tiempo como epoch y opciones ya resueltas."""
+
+    __slots__ = (
+        "id", "room_db_id", "room_id", "teacher_id", "title", "body", "qtype",
+        "start_at", "end_at", "manual_active", "allow_multiple_submissions",
+        "allow_multiple_answers", "close_on_first_correct", "close_triggered",
+        "options", "option_keys", "correct", "expected",
+    )
+
+    def __init__(self, row):
+        self.id = row[COL_QUESTION_ID]
+        self.room_db_id = row[COL_QUESTION_ROOM_ID]
+        self.room_id = row[JOINED_QUESTION_MATRIX_ROOM_ID]
+        self.teacher_id = row[COL_QUESTION_TEACHER_ID]
+        self.title = row[COL_QUESTION_TITLE]
+        self.body = row[COL_QUESTION_BODY]
+        self.qtype = row[COL_QUESTION_QTYPE]
+        self.start_at = _epoch(row[COL_QUESTION_START_AT])
+        self.end_at = _epoch(row[COL_QUESTION_END_AT])
+        self.manual_active = bool(row[COL_QUESTION_MANUAL_ACTIVE])
+        self.allow_multiple_submissions = bool(row[COL_QUESTION_ALLOW_MULTIPLE_SUBMISSIONS])
+        self.allow_multiple_answers = bool(row[COL_QUESTION_ALLOW_MULTIPLE_ANSWERS])
+        self.close_on_first_correct = bool(row[COL_QUESTION_CLOSE_ON_FIRST_CORRECT])
+        self.close_triggered = bool(row[COL_QUESTION_CLOSE_TRIGGERED])
+
+        # Texto de respuesta → option_id. Las claves (A, B...) tienen prioridad
+        # sobre el texto de las opciones si coinciden.
+        self.options = {}
+        self.option_keys = []
+        self.correct = set()
+        self.expected = None
+        by_text = {}
+        options = zip(
+            row[JOINED_QUESTION_OPTION_IDS], row[JOINED_QUESTION_OPTION_KEYS],
+            row[JOINED_QUESTION_OPTION_TEXTS], row[JOINED_QUESTION_OPTION_CORRECT],
+        )
+        for option_id, key, text, is_correct in options:
+            if is_correct:
+                self.correct.add(option_id)
+            if key == EXPECTED_ANSWER_KEY and self.qtype not in CHOICE_TYPES:
+                self.expected = text
+                continue
+            self.option_keys.append((key, text))
+            self.options[key.casefold()] = option_id
+            by_text.setdefault(text.strip().casefold(), option_id)
+        for text, option_id in by_text.items():
+            self.options.setdefault(text, option_id)
+
+    def is_open(self, now=None):
+        """True si la pregunta admite respuestas en este momento (mismo criterio que el panel)."""
+        if self.close_triggered:
+            return False
+        if self.manual_active:
+            return True
+        if self.start_at is None and self.end_at is None:
+            return False
+        now = time.time() if now is None else now
+        return (self.start_at is None or now >= self.start_at) and (self.end_at is None or now <= self.end_at)
+
+    def may_open(self, now=None):
+        """True si está abierta o puede abrirse sola más adelante (si no, no hace falta indexarla)."""
+        if self.close_triggered:
+            return False
+        if self.manual_active or (self.start_at is not None and self.end_at is None):
+            return True
+        now = time.time() if now is None else now
+        return self.end_at is not None and self.end_at > now
+
+    @property
+    def opened_at(self):
+        return self.start_at or 0.0
+
+
+class Answer:
+    """Respuesta clasificada: la pregunta y las opciones elegidas o el texto."""
+
+    __slots__ = ("question", "option_ids", "text")
+
+    def __init__(self, question, option_ids=(), text=None):
+        self.question = question
+        self.option_ids = option_ids
+        self.text = text
+
+
+class QuestionIndex:
+    """Preguntas abiertas por sala, mantenidas al día con NOTIFY y recargas periódicas."""
+
+    def __init__(self):
+        self._questions = {}
+        # room_id de Matrix -> {question_id: OpenQuestion}
+        self._rooms = {}
+
+        # question_id -> alumnos que ya respondieron (solo preguntas sin reenvíos)
+        self._answered = {}
+        # Preguntas cerradas en memoria (close_on_first_correct) cuyo cierre aún
+        # no ha llegado de la BD: se mantienen cerradas aunque se recarguen
+        self._closed_pending = set()
+        self._watchers = []
+        self._changed = set()
+        self._refresh_handle = None
+        self._listener = None
+        self._task = None
+        self._closing = False
+        self._wakeup = asyncio.Event()
+
+        self.classified = 0
+        self.not_answers = 0
+        self.notifications = 0
+        self.refreshes = 0
+
+    # ──────────────────────────────────────────────
+    # Consulta
+    # ──────────────────────────────────────────────
+
+    def get(self, question_id):
+        """Devuelve la pregunta indexada con ese id (abierta o no) o None."""
+        return self._questions.get(question_id)
+
+    def questions(self):
+        """Todas las preguntas indexadas (abiertas o por abrir)."""
+        return list(self._questions.values())
+
+    def has_open(self, room_id, now=None):
+        """True si la sala tiene alguna pregunta abierta (sin ordenar ni copiar nada)."""
+        questions = self._rooms.get(room_id)
+        if not questions:
+            return False
+        now = time.time() if now is None else now
+        return any(q.is_open(now) for q in questions.values())
+
+    def open_questions(self, room_id, now=None):
+        """Preguntas abiertas ahora en la sala, la más reciente primero."""
+        questions = self._rooms.get(room_id)
+        if not questions:
+            return []
+        now = time.time() if now is None else now
+        return sorted(
+            (q for q in questions.values() if q.is_open(now)),
+            key=lambda q: (q.opened_at, q.id),
+            reverse=True,
+        )
+
+    def classify(self, room_id, text):
+        """
+        Clasifica `text` (sin el prefijo de respuesta) como respuesta a una
+        pregunta abierta de la sala. Devuelve None si no hay ninguna abierta y
+        lanza InvalidAnswer si la respuesta no encaja con la pregunta.
+
+        Por defecto responde a la pregunta abierta más reciente; con `#<id>`
+        delante se elige otra.
+        """
+        open_questions = self.open_questions(room_id)
+        if not open_questions:
+            self.not_answers += 1
+            return None
+
+        text = text.strip()
+        question = open_questions[0]
+        target = _TARGET.match(text)
+        if target:
+            question_id = int(target.group(1))
+            question = next((q for q in open_questions if q.id == question_id), None)
+            if question is None:
+                raise InvalidAnswer(f"La pregunta #{question_id} no está abierta en esta sala.")
+            text = text[target.end():]
+
+        if not text:
+            raise InvalidAnswer("La respuesta está vacía.")
+
+        self.classified += 1
+        if question.qtype not in CHOICE_TYPES:
+            return Answer(question, text=text)
+        return Answer(question, option_ids=self._choose(question, text))
+
+    @staticmethod
+    def _choose(question, text):
+        """Resuelve las opciones elegidas (por clave o por texto) a option_id."""
+        option_id = question.options.get(text.casefold())
+        if option_id is not None:
+            return (option_id,)
+
+        chosen = []
+        for token in _SEPARATORS.split(text):
+            if not token:
+                continue
+            option_id = question.options.get(token.casefold())
+            if option_id is None:
+                keys = ", ".join(key for key, _ in question.option_keys)
+                raise InvalidAnswer(f"La opción `{token}` no existe. Opciones: {keys}.")
+            if option_id not in chosen:
+                chosen.append(option_id)
+
+        if len(chosen) > 1 and not question.allow_multiple_answers:
+            raise InvalidAnswer("Esta pregunta solo admite una opción.")
+        return tuple(chosen)
+
+    def has_answered(self, question, student_id):
+        """True si se sabe que el alumno ya respondió a una pregunta sin reenvíos."""
+        return not question.allow_multiple_submissions and student_id in self._answered.get(question.id, ())
+
+    def record_answer(self, question, student_id):
+        """Apunta que el alumno respondió (al encolar la respuesta, antes de que se guarde)."""
+        if not question.allow_multiple_submissions:
+            self._answered.setdefault(question.id, set()).add(student_id)
+
+    def forget_answer(self, question, student_id):
+        """Deshace `record_answer` si la respuesta no se llegó a guardar."""
+        answered = self._answered.get(question.id)
+        if answered is not None:
+            answered.discard(student_id)
+
+    def mark_closed(self, question):
+        """
+        Cierra la pregunta en memoria (close_on_first_correct). Es síncrono, así
+        que ninguna respuesta posterior la ve abierta, sin esperar a la BD. El
+        cierre se mantiene aunque la pregunta se recargue antes de que la BD lo
+        refleje.
+        """
+        self._closed_pending.add(question.id)
+        question.close_triggered = True
+
+    def unmark_closed(self, question_id):
+        """Deshace `mark_closed` si la respuesta que cerraba la pregunta no cerró la pregunta en la BD."""
+        if question_id not in self._closed_pending:
+            return
+        self._closed_pending.discard(question_id)
+        current = self._questions.get(question_id)
+        if current is not None:
+            current.close_triggered = False
+
+    # ──────────────────────────────────────────────
+    # Mantenimiento del índice
+    # ──────────────────────────────────────────────
+
+    def watch(self, callback):
+        """Registra `callback(old, new)`, al que se avisa de cada pregunta que entra, cambia o sale."""
+        self._watchers.append(callback)
+
+    def _notify(self, old, new):
+        for callback in self._watchers:
+            try:
+                callback(old, new)
+            except Exception:
+                logger.exception("Error en un observador del índice de preguntas")
+
+    def _put(self, question, old=None):
+        if question.close_triggered:
+            # La BD ya refleja el cierre
+            self._closed_pending.discard(question.id)
+        elif question.id in self._closed_pending:
+            question.close_triggered = True
+        old = self._remove(question.id) or old
+        self._questions[question.id] = question
+        self._rooms.setdefault(question.room_id, {})[question.id] = question
+        self._notify(old, question)
+
+    def _drop(self, question_id):
+        self._closed_pending.discard(question_id)
+        self._answered.pop(question_id, None)
+        old = self._remove(question_id)
+        if old is not None:
+            self._notify(old, None)
+
+    def _remove(self, question_id):
+        old = self._questions.pop(question_id, None)
+        if old is None:
+            return None
+        room = self._rooms.get(old.room_id)
+        if room is not None:
+            room.pop(question_id, None)
+            if not room:
+                del self._rooms[old.room_id]
+        return old
+
+    async def load(self):
+        """Carga todas las preguntas abiertas (o por abrir) con una sola consulta."""
+        db = DB_MODULES[DB_TYPE]["queries"]
+        rows = await db.get_open_questions()
+        if rows is None:
+            # Si la BD falla se conserva el índice actual en lugar de vaciarlo
+            return False
+
+        questions = [OpenQuestion(row) for row in rows]
+        previous = self._questions
+        self._questions = {}
+        self._rooms = {}
+        for question in questions:
+            self._put(question, previous.pop(question.id, None))
+        for old in previous.values():
+            self._closed_pending.discard(old.id)
+            self._answered.pop(old.id, None)
+            self._notify(old, None)
+        await self._load_answered(questions)
+        self.refreshes += 1
+        logger.info(f"Índice de preguntas cargado: {len(self._questions)} preguntas en {len(self._rooms)} salas")
+        return True
+
+    async def refresh(self, question_ids):
+        """Vuelve a leer las preguntas indicadas; las borradas o ya cerradas salen del índice."""
+        question_ids = list(question_ids)
+        if not question_ids:
+            return
+        db = DB_MODULES[DB_TYPE]["queries"]
+        rows = await db.get_questions_by_ids(question_ids)
+        if rows is None:
+            # Se reintentará en la siguiente recarga completa
+            return
+
+        now = time.time()
+        found = set()
+        kept = []
+        for row in rows:
+            question = OpenQuestion(row)
+            found.add(question.id)
+            if question.may_open(now):
+                self._put(question)
+                kept.append(question)
+            else:
+                self._drop(question.id)
+        for question_id in question_ids:
+            if question_id not in found:
+                self._drop(question_id)
+        await self._load_answered(kept)
+        self.refreshes += 1
+
+    async def _load_answered(self, questions):
+        """Carga qué alumnos ya respondieron a las preguntas sin reenvíos."""
+        question_ids = [q.id for q in questions if not q.allow_multiple_submissions]
+        if not question_ids:
+            return
+        db = DB_MODULES[DB_TYPE]["queries"]
+        rows = await db.get_answered_students(question_ids)
+        if rows is None:
+            # Sin esta información los reenvíos se siguen rechazando en la BD
+            return
+        for row in rows:
+            question_id = row[COL_QUESTION_RESPONSE_QUESTION_ID]
+            if question_id in self._questions:
+                # Se conservan las respuestas encoladas que aún no se han guardado
+                self._answered.setdefault(question_id, set()).update(row[JOINED_QUESTION_ANSWERED_STUDENT_IDS])
+
+    def notify_changed(self, payload):
+        """Callback de NOTIFY: agrupa los ids recibidos y los refresca tras un breve retardo."""
+        try:
+            self._changed.add(int(payload))
+        except (TypeError, ValueError):
+            return
+        self.notifications += 1
+        if self._refresh_handle is None:
+            loop = asyncio.get_running_loop()
+            self._refresh_handle = loop.call_later(QUESTION_NOTIFY_DELAY, self._refresh_changed)
+
+    def _refresh_changed(self):
+        self._refresh_handle = None
+        changed, self._changed = self._changed, set()
+        asyncio.create_task(self.refresh(changed), name="questions-refresh")
+
+    # ──────────────────────────────────────────────
+    # Ciclo de vida
+    # ──────────────────────────────────────────────
+
+    async def _listen(self):
+        db_conn = DB_MODULES[DB_TYPE]["conn"]
+        if self._listener is not None and not self._listener.is_closed():
+            return
+        try:
+            self._listener = await db_conn.listen(CHANNEL_QUESTION_CHANGED, self.notify_changed)
+        except Exception as e:
+            self._listener = None
+            logger.warning(f"No se pudo escuchar {CHANNEL_QUESTION_CHANGED}; solo recargas periódicas: {e}")
+
+    def start(self):
+        """Arranca la escucha de cambios y la recarga periódica."""
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run(), name="question-index")
+
+    async def close(self):
+        """Detiene la recarga periódica y cierra la conexión de escucha."""
+        self._closing = True
+        self._wakeup.set()
+        if self._refresh_handle is not None:
+            self._refresh_handle.cancel()
+            self._refresh_handle = None
+        if self._task is not None:
+            await self._task
+            self._task = None
+        db_conn = DB_MODULES[DB_TYPE]["conn"]
+        await db_conn.close_listener(self._listener)
+        self._listener = None
+
+    async def _run(self):
+        while not self._closing:
+            await self._listen()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=QUESTION_REFRESH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self._closing:
+                await self.load()
+
+    def stats(self):
+        """Devuelve tamaño y contadores del índice."""
+        return {
+            "questions": len(self._questions),
+            "rooms": len(self._rooms),
+            "classified": self.classified,
+            "not_answers": self.not_answers,
+            "notifications": self.notifications,
+            "refreshes": self.refreshes,
+            "listening": self._listener is not None and not self._listener.is_closed(),
+        }
+
+
+question_index = QuestionIndex()
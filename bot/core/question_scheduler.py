@@ -0,0 +1,202 @@
+# core/question_scheduler.py
+"""
+Avisos de apertura y cierre de preguntas en su sala.
+
+No se consulta la tabla questions periódicamente: el planificador parte de las
+preguntas del índice (core/question_index.py), que ya están en memoria, y
+guarda en un montículo (heapq) el instante de start_at y end_at de cada una.
+Un único temporizador del bucle de asyncio duerme hasta el primer instante
+pendiente; al vencer, se comprueba si la pregunta está abierta y se avisa en
+la sala si su estado cambió respecto al último aviso.
+
+Cuando el panel modifica una pregunta (p. ej. `toggle_question_active` pone
+end_at = ahora o cambia manual_active), el índice la refresca por NOTIFY y
+avisa al planificador con `watch`, que la reprograma y anuncia el cambio al
+momento. Las entradas antiguas del montículo no se borran: llevan un número de
+generación y se descartan al salir si ya no es el vigente.
+
+Las preguntas cerradas por la primera respuesta correcta no se anuncian aquí
+(ya lo hace core/answers.py). Al arrancar no se anuncian las preguntas que ya
+estaban abiertas.
+"""
+
+import asyncio
+import heapq
+import logging
+import time
+
+import config
+from core.outbox import outbox
+from core.question_index import ANSWER_PREFIX, CHOICE_TYPES, question_index
+
+logger = logging.getLogger("questions")
+
+QUESTION_ANNOUNCEMENTS = getattr(config, "QUESTION_ANNOUNCEMENTS", True)
+
+# Tope de espera del temporizador, por si el reloj del sistema se ajusta
+_MAX_SLEEP = 60.0
+# is_open() incluye el instante end_at: el cierre se comprueba justo después
+_CLOSE_MARGIN = 0.001
+
+
+class QuestionScheduler:
+    """Montículo de instantes de apertura/cierre con un único temporizador."""
+
+    def __init__(self, announce=QUESTION_ANNOUNCEMENTS):
+        self.announce = announce
+
+        # (instante epoch, secuencia, question_id, generación)
+        self._heap = []
+        self._seq = 0
+        # question_id -> (generación, start_at, end_at) programados
+        self._armed = {}
+        # question_id -> True si el último aviso (o el estado al arrancar) era "abierta"
+        self._open = {}
+        self._handle = None
+        self._started = False
+
+        self.fired = 0
+        self.opened = 0
+        self.closed = 0
+
+    def start(self):
+        """Programa las preguntas ya indexadas y empieza a seguir los cambios del índice."""
+        if self._started:
+            return
+        self._started = True
+        now = time.time()
+        for question in question_index.questions():
+            self._open[question.id] = question.is_open(now)
+            self._arm(question, now)
+        question_index.watch(self._on_change)
+        self._rearm_timer()
+
+    async def close(self):
+        """Detiene el temporizador."""
+        self._started = False
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    # ──────────────────────────────────────────────
+    # Programación
+    # ──────────────────────────────────────────────
+
+    def _arm(self, question, now):
+        """Programa los instantes futuros de la pregunta, si cambiaron desde la última vez."""
+        armed = self._armed.get(question.id)
+        if armed is not None and armed[1:] == (question.start_at, question.end_at):
+            return
+        generation = armed[0] + 1 if armed is not None else 0
+        self._armed[question.id] = (generation, question.start_at, question.end_at)
+
+        if question.start_at is not None and question.start_at > now:
+            self._push(question.start_at, question.id, generation)
+        if question.end_at is not None and question.end_at >= now:
+            self._push(question.end_at + _CLOSE_MARGIN, question.id, generation)
+
+    def _disarm(self, question_id):
+        self._armed.pop(question_id, None)
+        self._open.pop(question_id, None)
+
+    def _push(self, when, question_id, generation):
+        self._seq += 1
+        heapq.heappush(self._heap, (when, self._seq, question_id, generation))
+
+    def _compact(self):
+        """Quita las entradas caducadas si el montículo crece demasiado."""
+        if len(self._heap) <= 2 * len(self._armed) + 64:
+            return
+        self._heap = [
+            entry for entry in self._heap
+            if entry[2] in self._armed and self._armed[entry[2]][0] == entry[3]
+        ]
+        heapq.heapify(self._heap)
+
+    def _rearm_timer(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if not self._started or not self._heap:
+            return
+        delay = min(max(self._heap[0][0] - time.time(), 0.0), _MAX_SLEEP)
+        self._handle = asyncio.get_running_loop().call_later(delay, self._fire)
+
+    def _fire(self):
+        self._handle = None
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, question_id, generation = heapq.heappop(self._heap)
+            armed = self._armed.get(question_id)
+            if armed is None or armed[0] != generation:
+                continue
+            question = question_index.get(question_id)
+            if question is not None:
+                self.fired += 1
+                self._update(question, question, now)
+        self._rearm_timer()
+
+    def _on_change(self, old, new):
+        """Observador del índice: reprograma la pregunta y anuncia el cambio si lo hay."""
+        now = time.time()
+        if new is None:
+            self._update(old, None, now)
+            self._disarm(old.id)
+        else:
+            self._arm(new, now)
+            self._update(old or new, new, now)
+        self._compact()
+        self._rearm_timer()
+
+    # ──────────────────────────────────────────────
+    # Avisos
+    # ──────────────────────────────────────────────
+
+    def _update(self, old, new, now):
+        """Compara el estado actual con el último avisado y anuncia el cambio."""
+        question = new or old
+        is_open = new is not None and new.is_open(now)
+        was_open = self._open.get(question.id, False)
+        self._open[question.id] = is_open
+        if is_open == was_open:
+            return
+        if is_open:
+            self.opened += 1
+            self._send(question.room_id, _render_open(question))
+        elif not (old.close_triggered or question.close_triggered):
+            self.closed += 1
+            self._send(question.room_id, _render_closed(question))
+
+    def _send(self, room_id, text):
+        if self.announce:
+            outbox.send_text(room_id, text)
+
+    def stats(self):
+        """Devuelve tamaño y contadores del planificador."""
+        return {
+            "scheduled": len(self._armed),
+            "heap": len(self._heap),
+            "fired": self.fired,
+            "opened": self.opened,
+            "closed": self.closed,
+        }
+
+
+def _render_open(question):
+    lines = [f"📢 **Pregunta #{question.id} abierta:** {question.title or ''}".rstrip()]
+    if question.body:
+        lines.append(question.body)
+    if question.qtype in CHOICE_TYPES:
+        lines.extend(f"    {key}) {text}" for key, text in question.option_keys)
+        lines.append(f"Responde con `{ANSWER_PREFIX}<opción>`.")
+    else:
+        lines.append(f"Responde con `{ANSWER_PREFIX}<respuesta>`.")
+    return "\n".join(lines)
+
+
+def _render_closed(question):
+    title = f" «{question.title}»" if question.title else ""
+    return f"🔒 La pregunta #{question.id}{title} se ha cerrado."
+
+
+question_scheduler = QuestionScheduler()
@@ -0,0 +1,48 @@
+# core/ratelimit.py
+"""
+Limitación de ritmo por clave (usuario, sala...) con cubos de tokens.
+
+Cada clave tiene un cubo de `calls` tokens que se rellena a `calls/period`
+tokens por segundo. Los cubos se guardan en una TTLCache acotada: un cubo que
+lleva `period` segundos sin usarse ya estaría lleno, así que se puede olvidar.
+"""
+
+import time
+
+from core.cache import TTLCache
+
+
+class RateLimiter:
+    """Permite como mucho `calls` llamadas cada `period` segundos por clave."""
+
+    def __init__(self, calls, period, maxsize=10000):
+        self.calls = calls
+        self.period = period
+        self.rate = calls / period
+        self._buckets = TTLCache(maxsize=maxsize, ttl=period)
+
+        self.allowed = 0
+        self.limited = 0
+
+    def acquire(self, key):
+        """Consume un token de `key`. Devuelve 0 si se permite, o los segundos que faltan."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.calls, now))
+        tokens = min(self.calls, tokens + (now - updated) * self.rate)
+
+        if tokens >= 1:
+            self._buckets.set(key, (tokens - 1, now))
+            self.allowed += 1
+            return 0.0
+
+        self._buckets.set(key, (tokens, now))
+        self.limited += 1
+        return (1 - tokens) / self.rate
+
+    def stats(self):
+        """Devuelve contadores del limitador."""
+        return {
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
@@ -0,0 +1,245 @@
+# core/reaction_buffer.py
+"""
+Buffer de escritura diferida para los contadores de reacciones.
+
+Los handlers no escriben cada reacción en la base de datos: suman un delta
+(+1 al reaccionar, -1 al retirar la reacción) bajo la clave
+(profesor, alumno, sala, emoji). Cada `REACTION_FLUSH_INTERVAL_MS` ms, o en
+cuanto hay `REACTION_FLUSH_MAX_ENTRIES` claves pendientes, los deltas se
+vuelcan con una única llamada a `apply_reaccion_deltas`.
+
+Cada reacción contada queda además registrada en la tabla reaction_events
+(event_id → profesor, alumno, sala, emoji), de modo que una redacción se
+resuelve con `retract(event_id)` sin necesidad de recuperar el evento
+redactado: si la reacción ya se volcó, su event_id se apunta y, en el
+siguiente volcado, se borra del registro y se resta del contador en la misma
+transacción (nunca queda borrada del registro sin restar, ni al revés). Las
+filas antiguas del registro se purgan periódicamente.
+
+Si un volcado falla porque la BD no está disponible, el lote vuelve al buffer
+y se reintenta con espera exponencial (hasta `REACTION_FLUSH_MAX_BACKOFF` s).
+Si falla con la BD disponible, el problema está en los datos (p. ej. una sala
+o un usuario ya borrados): se vuelca clave a clave y se descartan, con un
+aviso en el log, solo las claves que fallan.
+"""
+
+import asyncio
+import logging
+
+import config
+from config import DB_TYPE
+from core.db.constants import DB_MODULES
+
+logger = logging.getLogger("reactions")
+
+REACTION_FLUSH_INTERVAL_MS = getattr(config, "REACTION_FLUSH_INTERVAL_MS", 500)
+REACTION_FLUSH_MAX_ENTRIES = getattr(config, "REACTION_FLUSH_MAX_ENTRIES", 200)
+REACTION_LEDGER_RETENTION_DAYS = getattr(config, "REACTION_LEDGER_RETENTION_DAYS", 120)
+REACTION_LEDGER_PURGE_INTERVAL = getattr(config, "REACTION_LEDGER_PURGE_INTERVAL", 3600)
+REACTION_FLUSH_MAX_BACKOFF = getattr(config, "REACTION_FLUSH_MAX_BACKOFF", 30.0)
+
+
+class ReactionBuffer:
+    """Agrega deltas de reacciones en memoria y los vuelca por lotes."""
+
+    def __init__(self, flush_interval_ms=REACTION_FLUSH_INTERVAL_MS,
+                 max_entries=REACTION_FLUSH_MAX_ENTRIES):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_entries = max_entries
+
+        self._deltas = {}
+        self._events = {}
+        # Reacciones ya volcadas que hay que deshacer en el siguiente volcado
+        self._retracted = set()
+        self._last_purge = 0.0
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closing = False
+        # Volcados fallidos seguidos (para la espera exponencial)
+        self._failures = 0
+
+        self.dropped = 0
+
+    def add(self, teacher_id, student_id, room_id, emoji, delta=1, event_id=None):
+        """
+        Suma `delta` a la reacción indicada. No bloquea ni toca la base de datos.
+
+        Si se indica `event_id`, la reacción se registra en reaction_events al
+        volcarse para poder deshacerla después con `retract`.
+        """
+        key = (teacher_id, student_id, room_id, emoji)
+        if event_id is not None:
+            if event_id in self._events:
+                return  # evento repetido antes de volcarse
+            self._events[event_id] = key
+        self._merge(key, delta)
+
+        # Tras un fallo se respeta la espera aunque el buffer se llene
+        if len(self._deltas) >= self.max_entries and not self._failures:
+            self._wakeup.set()
+
+    def _merge(self, key, delta):
+        total = self._deltas.get(key, 0) + delta
+        if total:
+            self._deltas[key] = total
+        else:
+            # +1 y -1 sobre la misma reacción se anulan sin llegar a la BD
+            self._deltas.pop(key, None)
+
+    def _restore(self, batch, events, retracted=()):
+        """Devuelve al buffer un lote que no se pudo volcar (sin despertar el volcado)."""
+        for key, delta in batch.items():
+            self._merge(key, delta)
+        for event_id, key in events.items():
+            self._events.setdefault(event_id, key)
+        self._retracted.update(retracted)
+
+    async def retract(self, event_id):
+        """
+        Deshace la reacción `event_id` si fue contada.
+
+        Si aún no se había volcado, se anula en memoria y devuelve True. Si no,
+        devuelve False y se deshace en el siguiente volcado, solo si está en
+        reaction_events (si no era una reacción contada no se resta nada).
+        """
+        if event_id not in self._events and self._flush_lock.locked():
+            # Puede estar en el volcado en curso; si falla, vuelve a self._events
+            async with self._flush_lock:
+                pass
+        key = self._events.pop(event_id, None)
+        if key is not None:
+            self.add(*key, delta=-1)
+            return True
+        self._retracted.add(event_id)
+        if len(self._retracted) >= self.max_entries and not self._failures:
+            self._wakeup.set()
+        return False
+
+    async def flush(self):
+        """
+        Vuelca los deltas pendientes. Devuelve False si la BD no estaba
+        disponible (el lote vuelve al buffer y se reintentará).
+        """
+        async with self._flush_lock:
+            if not self._deltas and not self._events and not self._retracted:
+                return True
+            batch, self._deltas = self._deltas, {}
+            events, self._events = self._events, {}
+            retracted, self._retracted = self._retracted, set()
+
+            db = DB_MODULES[DB_TYPE]["queries"]
+            db_conn = DB_MODULES[DB_TYPE]["conn"]
+            ok = await db.apply_reaccion_deltas(
+                [(*key, delta) for key, delta in batch.items()],
+                [(event_id, *key) for event_id, key in events.items()],
+                list(retracted),
+            )
+            if not ok and db_conn.is_available():
+                # La BD responde: el fallo está en los datos de alguna clave
+                ok = await self._flush_each(db, db_conn, batch, events, retracted)
+            elif not ok:
+                self._restore(batch, events, retracted)
+
+            if ok:
+                self._failures = 0
+                return True
+            self._failures += 1
+            logger.warning("No se pudieron volcar los deltas de reacciones (BD no disponible); se reintentará")
+            return False
+
+    async def _flush_each(self, db, db_conn, batch, events, retracted):
+        """
+        Vuelca clave a clave un lote que falló con la BD disponible, para
+        descartar solo las claves con datos inválidos. Si la BD deja de estar
+        disponible, devuelve al buffer lo que falta y devuelve False.
+        """
+        by_key = {key: {} for key in batch}
+        for event_id, key in events.items():
+            by_key.setdefault(key, {})[event_id] = key
+
+        remaining = list(by_key.items())
+        while remaining:
+            key, key_events = remaining.pop()
+            key_batch = {key: batch[key]} if key in batch else {}
+            ok = await db.apply_reaccion_deltas(
+                [(*key, delta) for key, delta in key_batch.items()],
+                [(event_id, *key) for event_id in key_events],
+            )
+            if ok:
+                continue
+            if not db_conn.is_available():
+                self._restore(key_batch, key_events, retracted)
+                for other, other_events in remaining:
+                    self._restore({other: batch[other]} if other in batch else {}, other_events)
+                return False
+            self._drop(key_batch, key_events)
+
+        if retracted and not await db.apply_reaccion_deltas([], [], list(retracted)):
+            if not db_conn.is_available():
+                self._restore({}, {}, retracted)
+                return False
+            self.dropped += len(retracted)
+            logger.error(f"Se descartan {len(retracted)} reacciones retiradas: la BD las rechaza")
+        return True
+
+    def _drop(self, batch, events):
+        self.dropped += len(batch) or len(events)
+        for key, delta in batch.items():
+            logger.error(f"Se descarta el delta {delta:+d} de la reacción {key}: la BD lo rechaza")
+        for event_id, key in events.items():
+            if key not in batch:
+                logger.error(f"Se descarta la reacción {event_id} ({key}): la BD la rechaza")
+
+    async def purge(self, max_age_days=REACTION_LEDGER_RETENTION_DAYS):
+        """Purga del registro las reacciones antiguas (ya no se podrán deshacer)."""
+        db = DB_MODULES[DB_TYPE]["queries"]
+        purged = await db.purge_reaction_events(max_age_days)
+        if purged:
+            logger.info(f"Purgadas {purged} reacciones con más de {max_age_days} días del registro")
+
+    # ──────────────────────────────────────────────
+    # Ciclo de vida
+    # ──────────────────────────────────────────────
+
+    def start(self):
+        """Arranca el volcado periódico en segundo plano."""
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run(), name="reaction-buffer")
+
+    async def close(self):
+        """Detiene el volcado periódico y vuelca lo pendiente."""
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        else:
+            await self.flush()
+
+    def _delay(self):
+        if not self._failures:
+            return self.flush_interval
+        return min(self.flush_interval * 2 ** min(self._failures, 16), REACTION_FLUSH_MAX_BACKOFF)
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._delay())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+            now = asyncio.get_running_loop().time()
+            if now - self._last_purge >= REACTION_LEDGER_PURGE_INTERVAL:
+                self._last_purge = now
+                await self.purge()
+        await self.flush()
+
+    def __len__(self):
+        return len(self._deltas)
+
+
+reaction_buffer = ReactionBuffer()
@@ -3,11 +3,49 @@
 Gestor de estados para salas y usuarios en el bot de Matrix.
 Permite que cada sala y usuario mantengan un estado y datos asociados.
 Usa constantes definidas en core/state_keys.py para evitar strings mágicas.
+
+La memoria está acotada: las salas y usuarios sin actividad durante
+`STATE_IDLE_TTL` segundos se olvidan (vuelven a IDLE), y como mucho se guardan
+`STATE_MAX_ROOMS` salas y `STATE_MAX_USERS_PER_ROOM` usuarios por sala,
+expulsando primero los menos usados.
+
+Los handlers se ejecutan en paralelo, así que una lectura-modificación-escritura
+debe hacerse dentro de `async with state_manager.room_lock(room_id):`.
+
+Cada `STATE_SNAPSHOT_INTERVAL` segundos se guardan en la tabla state_snapshots
+las salas modificadas desde la última instantánea (solo cambios hechos con los
+métodos set_*). Al arrancar se restauran únicamente las salas con actividad en
+las últimas `STATE_RESTORE_HOURS` horas, como mucho `STATE_MAX_ROOMS`, así que
+el tiempo de arranque no crece con el número total de salas.
 """
 
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from enum import Enum, auto
+
+import config
+from config import DB_TYPE
+from core.db.constants import (
+    DB_MODULES,
+    COL_STATE_SNAPSHOT_ROOM_ID,
+    COL_STATE_SNAPSHOT_STATE,
+    COL_STATE_SNAPSHOT_DATA,
+    COL_STATE_SNAPSHOT_USERS,
+)
 from core.state_keys import ROOM_STATE, ROOM_DATA, USERS, USER_STATE, USER_DATA
 
+logger = logging.getLogger("state")
+
+STATE_IDLE_TTL = getattr(config, "STATE_IDLE_TTL", 6 * 3600)
+STATE_MAX_ROOMS = getattr(config, "STATE_MAX_ROOMS", 5000)
+STATE_MAX_USERS_PER_ROOM = getattr(config, "STATE_MAX_USERS_PER_ROOM", 1000)
+STATE_SNAPSHOT_INTERVAL = getattr(config, "STATE_SNAPSHOT_INTERVAL", 5.0)
+STATE_RESTORE_HOURS = getattr(config, "STATE_RESTORE_HOURS", 6)
+
 
 class RoomState(Enum):
     """Posibles estados de una sala."""
@@ -25,24 +63,154 @@ class UserState(Enum):
     MUTED = auto()
 
 
+class _UserEntry:
+    """Estado y datos de un usuario dentro de una sala."""
+
+    __slots__ = ("state", "data", "touched")
+
+    def __init__(self, now):
+        self.state = UserState.IDLE
+        self.data = {}
+        self.touched = now
+
+
+class _RoomEntry:
+    """Estado, datos y usuarios (en orden de uso) de una sala."""
+
+    __slots__ = ("state", "data", "users", "touched")
+
+    def __init__(self, now):
+        self.state = RoomState.IDLE
+        self.data = {}
+        self.users = OrderedDict()
+        self.touched = now
+
+
+class _RoomLock:
+    """Lock de una sala con el número de corrutinas que lo usan o esperan."""
+
+    __slots__ = ("lock", "refs")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.refs = 0
+
+
 class StateManager:
     """Gestor central de estados de salas y usuarios."""
 
-    def __init__(self):
-        # Estructura:
-        # rooms = {
-        #   room_id: {
-        #       "_state": RoomState,
-        #       "_data": {...},
-        #       "users": {
-        #           "@user:server": {
-        #               "state": UserState,
-        #               "data": {...}
-        #           }
-        #       }
-        #   }
-        # }
-        self.rooms = {}
+    def __init__(self, idle_ttl=STATE_IDLE_TTL, max_rooms=STATE_MAX_ROOMS,
+                 max_users_per_room=STATE_MAX_USERS_PER_ROOM):
+        self.idle_ttl = idle_ttl
+        self.max_rooms = max_rooms
+        self.max_users_per_room = max_users_per_room
+
+        # room_id -> _RoomEntry, de la menos a la más usada recientemente
+        self.rooms = OrderedDict()
+        # room_id -> _RoomLock; solo existe mientras alguien lo usa
+        self._locks = {}
+
+        # Salas pendientes de guardar / de borrar en la próxima instantánea
+        self._dirty = set()
+        self._deleted = set()
+        self._task = None
+        self._closing = False
+        self._wakeup = asyncio.Event()
+
+        self.evictions = 0
+
+    # ──────────────────────────────────────────────
+    # Acceso interno y expulsión
+    # ──────────────────────────────────────────────
+
+    def _get_room(self, room_id, create=False):
+        now = time.monotonic()
+        entry = self.rooms.get(room_id)
+        if entry is not None and now - entry.touched > self.idle_ttl:
+            del self.rooms[room_id]
+            self._forget(room_id)
+            self.evictions += 1
+            entry = None
+
+        if entry is None:
+            if not create:
+                return None
+            entry = self.rooms[room_id] = _RoomEntry(now)
+            self._evict_rooms(now)
+        else:
+            self.rooms.move_to_end(room_id)
+            entry.touched = now
+        return entry
+
+    def _get_user(self, room, user_id, create=False):
+        now = room.touched
+        entry = room.users.get(user_id)
+        if entry is not None and now - entry.touched > self.idle_ttl:
+            del room.users[user_id]
+            entry = None
+
+        if entry is None:
+            if not create:
+                return None
+            entry = room.users[user_id] = _UserEntry(now)
+            self._evict_users(room, now)
+        else:
+            room.users.move_to_end(user_id)
+            entry.touched = now
+        return entry
+
+    def _evict_rooms(self, now):
+        # Las salas están ordenadas por último uso: basta con mirar la primera
+        while self.rooms:
+            room_id, oldest = next(iter(self.rooms.items()))
+            if len(self.rooms) <= self.max_rooms and now - oldest.touched <= self.idle_ttl:
+                break
+            del self.rooms[room_id]
+            self._forget(room_id)
+            self.evictions += 1
+            logger.debug("Estado de la sala %s expulsado de memoria", room_id)
+
+    def _evict_users(self, room, now):
+        while room.users:
+            user_id, oldest = next(iter(room.users.items()))
+            if len(room.users) <= self.max_users_per_room and now - oldest.touched <= self.idle_ttl:
+                break
+            del room.users[user_id]
+            self.evictions += 1
+
+    def _mark(self, room_id):
+        self._dirty.add(room_id)
+        self._deleted.discard(room_id)
+
+    def _forget(self, room_id):
+        self._dirty.discard(room_id)
+        self._deleted.add(room_id)
+
+    # ──────────────────────────────────────────────
+    # Concurrencia
+    # ──────────────────────────────────────────────
+
+    @asynccontextmanager
+    async def room_lock(self, room_id):
+        """
+        Serializa las lecturas-modificaciones-escrituras sobre una sala:
+
+            async with state_manager.room_lock(room_id):
+                data = state_manager.get_room_data(room_id)
+                ...
+                state_manager.set_room_data(room_id, data)
+        """
+        entry = self._locks.get(room_id)
+        if entry is None:
+            entry = self._locks[room_id] = _RoomLock()
+        entry.refs += 1
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            entry.refs -= 1
+            if entry.refs == 0:
+                del self._locks[room_id]
 
     # ──────────────────────────────────────────────
     # Métodos para SALAS
@@ -50,27 +218,31 @@ class StateManager:
 
     def get_room_state(self, room_id):
         """Devuelve el estado actual de una sala."""
-        return self.rooms.get(room_id, {}).get(ROOM_STATE, RoomState.IDLE)
+        room = self._get_room(room_id)
+        return room.state if room else RoomState.IDLE
 
     def set_room_state(self, room_id, state: RoomState, data=None):
         """Establece el estado y los datos de una sala."""
-        if room_id not in self.rooms:
-            self.rooms[room_id] = {USERS: {}}
-
-        self.rooms[room_id][ROOM_STATE] = state
-        self.rooms[room_id][ROOM_DATA] = data or {}
-
-        print(f"[ROOM STATE] {room_id} -> {state.name}")
+        room = self._get_room(room_id, create=True)
+        room.state = state
+        room.data = data or {}
+        self._mark(room_id)
+        logger.debug("Sala %s -> %s", room_id, state.name)
 
     def get_room_data(self, room_id):
         """Devuelve los datos asociados a la sala."""
-        return self.rooms.get(room_id, {}).get(ROOM_DATA, {})
+        room = self._get_room(room_id)
+        return room.data if room else {}
 
     def set_room_data(self, room_id, data: dict):
         """Reemplaza los datos asociados a la sala."""
-        if room_id not in self.rooms:
-            self.rooms[room_id] = {USERS: {}}
-        self.rooms[room_id][ROOM_DATA] = data or {}
+        self._get_room(room_id, create=True).data = data or {}
+        self._mark(room_id)
+
+    def clear_room(self, room_id):
+        """Olvida el estado de una sala y de todos sus usuarios."""
+        self.rooms.pop(room_id, None)
+        self._forget(room_id)
 
     # ──────────────────────────────────────────────
     # Métodos para USUARIOS
@@ -78,53 +250,150 @@ class StateManager:
 
     def get_user_state(self, room_id, user_id):
         """Obtiene el estado actual de un usuario dentro de una sala."""
-        return (
-            self.rooms.get(room_id, {})
-            .get(USERS, {})
-            .get(user_id, {})
-            .get(USER_STATE, UserState.IDLE)
-        )
+        room = self._get_room(room_id)
+        user = self._get_user(room, user_id) if room else None
+        return user.state if user else UserState.IDLE
 
     def set_user_state(self, room_id, user_id, state: UserState, data=None):
         """Establece el estado y los datos de un usuario dentro de una sala."""
-        if room_id not in self.rooms:
-            self.rooms[room_id] = {USERS: {}}
-        if USERS not in self.rooms[room_id]:
-            self.rooms[room_id][USERS] = {}
-
-        self.rooms[room_id][USERS][user_id] = {
-            USER_STATE: state,
-            USER_DATA: data or {}
-        }
-
-        print(f"[USER STATE] {user_id} @ {room_id} -> {state.name}")
+        user = self._get_user(self._get_room(room_id, create=True), user_id, create=True)
+        user.state = state
+        user.data = data or {}
+        self._mark(room_id)
+        logger.debug("Usuario %s @ %s -> %s", user_id, room_id, state.name)
 
     def get_user_data(self, room_id, user_id):
         """Devuelve los datos asociados a un usuario en una sala."""
-        return (
-            self.rooms.get(room_id, {})
-            .get(USERS, {})
-            .get(user_id, {})
-            .get(USER_DATA, {})
-        )
+        room = self._get_room(room_id)
+        user = self._get_user(room, user_id) if room else None
+        return user.data if user else {}
 
     def set_user_data(self, room_id, user_id, data: dict):
         """Reemplaza los datos asociados a un usuario dentro de una sala."""
-        if room_id not in self.rooms:
-            self.rooms[room_id] = {USERS: {}}
-        if USERS not in self.rooms[room_id]:
-            self.rooms[room_id][USERS] = {}
-        if user_id not in self.rooms[room_id][USERS]:
-            self.rooms[room_id][USERS][user_id] = {}
+        user = self._get_user(self._get_room(room_id, create=True), user_id, create=True)
+        user.data = data or {}
+        self._mark(room_id)
+
+    # ──────────────────────────────────────────────
+    # Instantáneas en la BD
+    # ──────────────────────────────────────────────
+
+    @staticmethod
+    def _serialize(room_id, room):
+        users = {
+            user_id: {USER_STATE: user.state.name, USER_DATA: user.data}
+            for user_id, user in room.users.items()
+        }
+        return (
+            room_id,
+            room.state.name,
+            json.dumps(room.data, default=str),
+            json.dumps(users, default=str),
+        )
+
+    async def snapshot(self):
+        """Guarda las salas modificadas y borra las olvidadas desde la última instantánea."""
+        if not self._dirty and not self._deleted:
+            return
+
+        snapshots = []
+        deleted = set(self._deleted)
+        for room_id in self._dirty:
+            room = self.rooms.get(room_id)
+            if room is None or (room.state is RoomState.IDLE and not room.data and not room.users):
+                # Una sala sin nada que recordar no necesita fila
+                deleted.add(room_id)
+            else:
+                snapshots.append(self._serialize(room_id, room))
+
+        dirty, forgotten = self._dirty, self._deleted
+        self._dirty, self._deleted = set(), set()
+
+        db = DB_MODULES[DB_TYPE]["queries"]
+        if not await db.save_state_snapshots(snapshots, list(deleted)):
+            # Se reintenta en la próxima instantánea, salvo lo que haya cambiado entretanto
+            self._dirty |= dirty - self._deleted
+            self._deleted |= forgotten - self._dirty
+
+    async def restore(self, hours=STATE_RESTORE_HOURS):
+        """Carga las salas con actividad en las últimas `hours` horas."""
+        db = DB_MODULES[DB_TYPE]["queries"]
+        await db.purge_state_snapshots(hours)
+        rows = await db.get_state_snapshots(hours, self.max_rooms)
+
+        now = time.monotonic()
+        # Las filas llegan de la más reciente a la más antigua; el LRU se llena al revés
+        for row in reversed(rows):
+            try:
+                room = _RoomEntry(now - row["age"])
+                room.state = RoomState[row[COL_STATE_SNAPSHOT_STATE]]
+                room.data = json.loads(row[COL_STATE_SNAPSHOT_DATA])
+                for user_id, saved in json.loads(row[COL_STATE_SNAPSHOT_USERS]).items():
+                    user = room.users[user_id] = _UserEntry(room.touched)
+                    user.state = UserState[saved[USER_STATE]]
+                    user.data = saved[USER_DATA]
+            except (KeyError, ValueError) as e:
+                logger.warning(f"Instantánea de {row[COL_STATE_SNAPSHOT_ROOM_ID]} ignorada: {e}")
+                continue
+            self.rooms[row[COL_STATE_SNAPSHOT_ROOM_ID]] = room
 
-        self.rooms[room_id][USERS][user_id][USER_DATA] = data or {}
+        logger.info(f"Estado restaurado para {len(self.rooms)} salas")
+
+    def start(self):
+        """Arranca las instantáneas periódicas en segundo plano."""
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run(), name="state-snapshots")
+
+    async def close(self):
+        """Detiene las instantáneas periódicas y guarda lo pendiente."""
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        else:
+            await self.snapshot()
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=STATE_SNAPSHOT_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.snapshot()
+        await self.snapshot()
 
     # ──────────────────────────────────────────────
     # Métodos de depuración
     # ──────────────────────────────────────────────
 
+    def stats(self):
+        """Devuelve contadores del gestor de estados."""
+        return {
+            "rooms": len(self.rooms),
+            "users": sum(len(room.users) for room in self.rooms.values()),
+            "locked_rooms": len(self._locks),
+            "dirty_rooms": len(self._dirty),
+            "evictions": self.evictions,
+        }
+
     def debug_dump(self):
         """Imprime el estado completo actual (solo para depuración)."""
-        import json
+        dump = {
+            room_id: {
+                ROOM_STATE: room.state,
+                ROOM_DATA: room.data,
+                USERS: {
+                    user_id: {USER_STATE: user.state, USER_DATA: user.data}
+                    for user_id, user in room.users.items()
+                },
+            }
+            for room_id, room in self.rooms.items()
+        }
         print("[STATE DUMP]")
-        print(json.dumps(self.rooms, indent=4, default=str))
+        print(json.dumps(dump, indent=4, default=str))
+
+
+state_manager = StateManager()
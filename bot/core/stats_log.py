@@ -0,0 +1,84 @@
+# core/stats_log.py
+"""
+Resumen periódico en el log del estado de la base de datos.
+
+Cada `STATS_LOG_INTERVAL` segundos se escribe una línea con el uso del pool
+(conexiones en uso, libres y en espera, espera p95 por una conexión y
+adquisiciones lentas), el estado del circuit breaker, el acierto de las cachés
+de usuarios y salas y las sentencias más lentas (p95). Así se ve un pool
+saturado o una caché que no acierta sin tener que depurar en caliente.
+Con `STATS_LOG_INTERVAL = 0` no se escribe nada.
+"""
+
+import asyncio
+import logging
+
+import config
+from config import DB_TYPE
+from core.db.constants import DB_MODULES
+
+logger = logging.getLogger("stats")
+
+STATS_LOG_INTERVAL = getattr(config, "STATS_LOG_INTERVAL", 300)
+# Sentencias que se incluyen en el resumen (las de mayor p95)
+STATS_LOG_TOP_STATEMENTS = 3
+
+
+def render_db_stats(pool, caches):
+    """Línea de resumen a partir de `pool_stats()` y `cache_stats()`."""
+    wait = pool["acquire_wait"]
+    parts = [
+        f"pool {pool['in_use']}/{pool['max_size']} en uso ({pool['idle']} libres, {pool['waiting']} en espera)",
+        f"espera p95 {wait['p95_ms']:.0f} ms ({pool['slow_acquires']} lentas)",
+        f"breaker {pool['breaker']['state']}",
+    ]
+    parts.extend(
+        f"caché {name} {cache['hit_ratio']:.0%} ({cache['size']}/{cache['maxsize']})"
+        for name, cache in caches.items()
+    )
+    slowest = sorted(pool["statements"].items(), key=lambda item: item[1]["p95_ms"], reverse=True)
+    if slowest:
+        parts.append("p95 " + ", ".join(
+            f"{name} {stats['p95_ms']:.0f} ms" for name, stats in slowest[:STATS_LOG_TOP_STATEMENTS]
+        ))
+    return "BD: " + "; ".join(parts)
+
+
+class StatsLogger:
+    """Escribe el resumen de la BD en el log cada `interval` segundos."""
+
+    def __init__(self, interval=STATS_LOG_INTERVAL):
+        self.interval = interval
+        self._task = None
+        self._closing = False
+        self._wakeup = asyncio.Event()
+
+    def log_once(self):
+        db = DB_MODULES[DB_TYPE]
+        logger.info(render_db_stats(db["conn"].pool_stats(), db["queries"].cache_stats()))
+
+    def start(self):
+        """Arranca el resumen periódico en segundo plano."""
+        if self._task is None and self.interval > 0:
+            self._closing = False
+            self._task = asyncio.create_task(self._run(), name="stats-log")
+
+    async def close(self):
+        """Detiene el resumen periódico."""
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self.log_once()
+
+
+stats_logger = StatsLogger()
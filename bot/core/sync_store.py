@@ -0,0 +1,100 @@
+# core/sync_store.py
+"""
+Almacén persistente del token de sincronización (`next_batch`).
+
+Al reiniciar, el bot retoma la sincronización incremental desde el último
+token guardado en lugar de descargar de nuevo el estado completo de todas las
+salas. El token se guarda como mucho cada `SYNC_TOKEN_SAVE_INTERVAL` segundos
+(y siempre al cerrar) para no escribir en la BD en cada sync.
+
+Con `bind(dispatcher)`, solo se guarda un token cuando el despachador ya ha
+procesado todos los eventos de su sync (y de los anteriores): si el bot se
+cae con eventos en cola, al reiniciar se vuelven a recibir en lugar de
+perderse. Los eventos de un sync se encolan mientras se espera el siguiente,
+así que cada token se asocia al número de secuencia del despachador cuando
+llega el token siguiente; al cerrar, con el despachador ya vaciado, se guarda
+el último.
+"""
+
+import time
+from collections import deque
+
+from mautrix.client.state_store import SyncStore
+
+import config
+from config import DB_TYPE
+from core.db.constants import DB_MODULES
+
+SYNC_TOKEN_SAVE_INTERVAL = getattr(config, "SYNC_TOKEN_SAVE_INTERVAL", 10)
+
+
+class DBSyncStore(SyncStore):
+    """SyncStore de mautrix respaldado por la tabla sync_state."""
+
+    def __init__(self, user_id, save_interval=SYNC_TOKEN_SAVE_INTERVAL):
+        self.user_id = user_id
+        self.save_interval = save_interval
+
+        self._next_batch = None
+        self._saved_batch = None
+        self._last_save = 0.0
+
+        self._dispatcher = None
+        # (secuencia del último evento del sync en el despachador, token), en orden
+        self._tokens = deque()
+        # Último token cuyos eventos ya se han procesado
+        self._processed_batch = None
+
+    def bind(self, dispatcher):
+        """Guarda solo los tokens cuyos eventos ya ha procesado `dispatcher`."""
+        self._dispatcher = dispatcher
+
+    async def get_next_batch(self):
+        if self._next_batch is None:
+            db = DB_MODULES[DB_TYPE]["queries"]
+            self._next_batch = self._saved_batch = await db.get_sync_token(self.user_id)
+        return self._next_batch
+
+    async def put_next_batch(self, next_batch):
+        if self._dispatcher is None:
+            self._processed_batch = next_batch
+        elif self._next_batch:
+            # Los eventos del sync anterior ya están encolados: el token anterior
+            # se podrá guardar cuando el despachador los haya procesado
+            self._tokens.append((self._dispatcher.submitted(), self._next_batch))
+        # El siguiente sync continúa siempre desde el último token
+        self._next_batch = next_batch
+        if time.monotonic() - self._last_save >= self.save_interval:
+            await self.flush()
+
+    def _advance(self):
+        """Avanza el token guardable hasta el último cuyos eventos ya se han procesado."""
+        if self._dispatcher is None:
+            return
+        done = self._dispatcher.processed_upto()
+        while self._tokens and self._tokens[0][0] <= done:
+            self._processed_batch = self._tokens.popleft()[1]
+
+    async def flush(self, final=False):
+        """
+        Guarda el último token ya procesado si ha cambiado desde el último
+        guardado. Con `final=True` (al cerrar, tras vaciar el despachador) se
+        guarda el último token si no queda ningún evento por procesar.
+        """
+        self._advance()
+        if final and self._dispatcher is not None and self._dispatcher.processed_upto() == self._dispatcher.submitted():
+            self._processed_batch = self._next_batch
+        token = self._processed_batch
+        if not token or token == self._saved_batch:
+            return
+        db = DB_MODULES[DB_TYPE]["queries"]
+        if await db.save_sync_token(self.user_id, token):
+            self._saved_batch = token
+            self._last_save = time.monotonic()
+
+    async def reset(self):
+        """Olvida el token guardado; la siguiente sincronización será completa."""
+        db = DB_MODULES[DB_TYPE]["queries"]
+        await db.delete_sync_token(self.user_id)
+        self._next_batch = self._saved_batch = self._processed_batch = None
+        self._tokens.clear()
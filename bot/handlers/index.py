@@ -0,0 +1,11 @@
+# handlers/index.py
+
+from mautrix.types import EventType
+from core.event_index import event_index
+
+def register(client, dispatcher):
+    @dispatcher.observe(EventType.ROOM_MESSAGE)
+    def index_message(room, event):
+        """Indexa el remitente de cada mensaje para resolver reacciones sin `get_event`."""
+        event_index.record(event)
+
@@ -1,9 +1,10 @@
 # handlers/members.py
 
 from mautrix.types import EventType, Membership
+from core.outbox import outbox
 
-def register(client):
-    @client.syncer.on(EventType.ROOM_MEMBER)
+def register(client, dispatcher):
+    @dispatcher.on(EventType.ROOM_MEMBER, live_only=True)
     async def on_member_event(room, event):
         content = event.content
         membership = content.get("membership")
@@ -12,23 +13,40 @@ def register(client):
         if event.state_key == client.mxid:
             return
 
+        # Los avisos se agrupan: una invitación masiva genera un solo mensaje
+
         # Detecta unirse a la sala
         if membership == Membership.JOIN:
-            await client.send_text(
-                room.room_id,
-                f"🎓 ¡Bienvenido/a {event.state_key} a la sala {room.display_name}!"
+            outbox.send_coalesced(
+                room.room_id, "join", event.state_key,
+                lambda users: _welcome_text(users, room.display_name)
             )
 
         # Detecta abandonar la sala
         elif membership == Membership.LEAVE:
-            await client.send_text(
-                room.room_id,
-                f"👋 {event.state_key} ha salido de la sala."
-            )
+            outbox.send_coalesced(room.room_id, "leave", event.state_key, _goodbye_text)
 
         # Detecta cambio de nombre
         elif membership == Membership.INVITE:
-            await client.send_text(
-                room.room_id,
-                f"📩 {event.sender} ha invitado a {event.state_key}."
+            outbox.send_coalesced(
+                room.room_id, ("invite", event.sender), event.state_key,
+                lambda users: _invite_text(event.sender, users)
             )
+
+
+def _welcome_text(users, room_name):
+    if len(users) == 1:
+        return f"🎓 ¡Bienvenido/a {users[0]} a la sala {room_name}!"
+    return f"🎓 ¡Bienvenidos/as a la sala {room_name}: {', '.join(users)}!"
+
+
+def _goodbye_text(users):
+    if len(users) == 1:
+        return f"👋 {users[0]} ha salido de la sala."
+    return f"👋 Han salido de la sala: {', '.join(users)}."
+
+
+def _invite_text(sender, users):
+    if len(users) == 1:
+        return f"📩 {sender} ha invitado a {users[0]}."
+    return f"📩 {sender} ha invitado a {len(users)} personas: {', '.join(users)}."
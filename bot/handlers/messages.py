@@ -1,13 +1,35 @@
 # handlers/messages.py
 
+import logging
+
 from mautrix.types import EventType
+from config import COMMAND_PREFIX
+from core.answers import handle_answer
 from core.command_registry import execute_command
+from core.message_filter import message_filter
+from core.question_index import ANSWER_PREFIX, question_index
+
+logger = logging.getLogger("messages")
+
+def register(client, dispatcher):
+    async def on_answer(client, room_id, event, body):
+        # Las de la puesta al día se guardan sin contestar en la sala
+        await handle_answer(client, room_id, event, body, quiet=dispatcher.is_historical(event))
 
-def register(client):
-    @client.syncer.on(EventType.ROOM_MESSAGE)
+    message_filter.bind(client, dispatcher.is_historical)
+    # Los comandos de antes del arranque no se ejecutan (contestarían tarde)
+    message_filter.add_route(COMMAND_PREFIX, execute_command, live_only=True)
+    # "=..." solo es una respuesta si la sala tiene alguna pregunta abierta
+    message_filter.add_route(ANSWER_PREFIX, on_answer, when=question_index.has_open)
+
+    # Los mensajes que no son comandos ni respuestas se descartan en el filtro,
+    # antes de encolarlos, registrarlos o copiar su texto. No es live_only: las
+    # respuestas enviadas con el bot parado llegan en la puesta al día
+    @dispatcher.on(EventType.ROOM_MESSAGE, accept=message_filter.accept)
     async def on_message(room, event):
-        if not hasattr(event, "body") or event.sender == client.mxid:
-            return
         body = event.body.strip()
-        print(f"[Mensaje] {event.sender}: {body}")
-        await execute_command(client, room.room_id, event, body)
+        handler = message_filter.route(body)
+        if handler is None:
+            return
+        logger.debug("Mensaje de %s: %s", event.sender, body)
+        await handler(client, room.room_id, event, body)
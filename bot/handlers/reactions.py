@@ -1,90 +1,82 @@
 # handlers/reactions.py
 
 from mautrix.types import EventType
-from core.db.constants import COL_USER_IS_TEACHER, COL_ROOM_MOODLE_COURSE_ID
+from core.db.constants import COL_USER_IS_TEACHER, COL_ROOM_ID
 from core.db.constants import DB_MODULES
+from core.dedup import seen_events
+from core.event_index import event_index
+from core.reaction_buffer import reaction_buffer
 from config import DB_TYPE
 
-def register(client):
-    @client.syncer.on(EventType.REACTION)
+def register(client, dispatcher):
+    # También recibe reacciones históricas de la puesta al día: es seguro porque
+    # reaction_events no deja contar dos veces el mismo evento.
+    @dispatcher.on(EventType.REACTION)
     async def on_add_reaction(room, event):
         """Handler para agregar o incrementar reacciones."""
         relates_to = event.content.get("m.relates_to", {})
         emoji = relates_to.get("key", "❓")
         reacted_to_event_id = relates_to.get("event_id", "desconocido")
-        sender_mxid = event.sender
 
-        db = DB_MODULES[DB_TYPE]["queries"]
+        await add_reaction(
+            client, room.room_id, event.event_id, event.sender, reacted_to_event_id, emoji,
+            timestamp_ms=getattr(event, "timestamp", None),
+        )
 
-        if sender_mxid == client.mxid:
-            return
 
-        # Verificar profesor
-        teacher = await db.get_user_by_matrix_id(sender_mxid)
-        if not teacher or not teacher[COL_USER_IS_TEACHER]:
-            return
+async def redact_reaction(redacted_event_id):
+    """
+    Deshace una reacción redactada (disminuye o elimina su contador).
+    Se resuelve con el registro reaction_events, sin recuperar el evento redactado.
+    Devuelve True si se deshizo en memoria; si la reacción ya se había volcado
+    se deshace en el siguiente volcado del buffer.
+    """
+    return await reaction_buffer.retract(redacted_event_id)
 
-        # Obtener estudiante
-        reacted_event = await client.get_event(room.room_id, reacted_to_event_id)
-        if not reacted_event:
-            return
-        student_mxid = reacted_event.sender
-        student = await db.get_user_by_matrix_id(student_mxid)
-        if not student:
-            return
 
-        # Obtener moodle_course_id
-        room_data = await db.get_room_by_matrix_id(room.room_id)
-        if not room_data:
-            return
-        moodle_course_id = room_data[COL_ROOM_MOODLE_COURSE_ID]
+async def add_reaction(client, room_id, event_id, sender_mxid, reacted_to_event_id, emoji, timestamp_ms=None):
+    """
+    Cuenta la reacción de un profesor sobre el mensaje de un alumno. Devuelve
+    True si la reacción entró en el buffer.
 
-        # Agregar o incrementar reacción
-        await db.add_or_increase_reaccion(
-            teacher_id=teacher["id"],
-            student_id=student["id"],
-            moodle_course_id=moodle_course_id,
-            reaction_type=emoji,
-            increment=1
-        )
+    El evento se marca como procesado (`seen_events.claim`) solo justo antes de
+    entrar en el buffer: si una consulta falla por la BD y la reacción se
+    descarta, una nueva entrega del mismo evento la vuelve a procesar.
+    """
+    db = DB_MODULES[DB_TYPE]["queries"]
 
-    async def redact_reaction(room, event):
-        """Handler para redactar reacciones."""
-        relates_to = event.content.get("m.relates_to", {})
-        emoji = relates_to.get("key", "❓")
-        reacted_to_event_id = relates_to.get("event_id", "desconocido")
-        sender_mxid = event.sender
-
-        db = DB_MODULES[DB_TYPE]["queries"]
+    if sender_mxid == client.mxid:
+        return False
 
-        if sender_mxid == client.mxid:
-            return
+    # Verificar profesor
+    teacher = await db.get_user_by_matrix_id(sender_mxid)
+    if not teacher or not teacher[COL_USER_IS_TEACHER]:
+        return False
 
-        # Verificar profesor
-        teacher = await db.get_user_by_matrix_id(sender_mxid)
-        if not teacher or not teacher[COL_USER_IS_TEACHER]:
-            return
+    # Obtener estudiante (del índice local; solo pregunta al homeserver si no está)
+    reacted_event = await event_index.resolve(client, room_id, reacted_to_event_id)
+    if not reacted_event:
+        return False
+    student = await db.get_user_by_matrix_id(reacted_event.sender)
+    if not student:
+        return False
 
-        # Obtener estudiante
-        reacted_event = await client.get_event(room.room_id, reacted_to_event_id)
-        if not reacted_event:
-            return
-        student_mxid = reacted_event.sender
-        student = await db.get_user_by_matrix_id(student_mxid)
-        if not student:
-            return
+    # Obtener la sala
+    room_data = await db.get_room_by_matrix_id(room_id)
+    if not room_data:
+        return False
 
-        # Obtener moodle_course_id
-        room_data = await db.get_room_by_matrix_id(room.room_id)
-        if not room_data:
-            return
-        moodle_course_id = room_data[COL_ROOM_MOODLE_COURSE_ID]
+    # Un evento repetido por la puesta al día o por un reintento de sync no se cuenta dos veces
+    if not await seen_events.claim(event_id, timestamp_ms):
+        return False
 
-        # Disminuir o eliminar reacción
-        await db.decrease_or_delete_reaccion(
-            teacher_id=teacher["id"],
-            student_id=student["id"],
-            moodle_course_id=moodle_course_id,
-            reaction_type=emoji,
-            decrement=1
-        )
+    # Agregar o incrementar reacción (se vuelca a la BD por lotes)
+    reaction_buffer.add(
+        teacher_id=teacher["id"],
+        student_id=student["id"],
+        room_id=room_data[COL_ROOM_ID],
+        emoji=emoji,
+        delta=1,
+        event_id=event_id
+    )
+    return True
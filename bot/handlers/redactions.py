@@ -1,14 +1,17 @@
 # handlers/redactions.py
 
 from mautrix.types import EventType
+from core.dedup import seen_events
+from core.event_index import event_index
 from handlers.reactions import redact_reaction
 
-def register(client):
-    @client.syncer.on(EventType.ROOM_REDACTION)
+def register(client, dispatcher):
+    @dispatcher.on(EventType.ROOM_REDACTION)
     async def handle_redaction(room, event):
         """
         Handles a redaction event.
-        If the redacted event was a reaction, calls redact_reaction.
+        If the redacted event was a counted reaction, redact_reaction undoes it
+        using the reaction_events ledger (the redacted content is not needed).
         """
         redacted_event_id = event.redacts  # The event being redacted
         sender_mxid = event.sender
@@ -17,11 +20,9 @@ def register(client):
         if sender_mxid == client.mxid:
             return
 
-        # Fetch the redacted event to check its type
-        try:
-            redacted_event = await client.get_event(room.room_id, redacted_event_id)
-        except Exception:
-            return  # Event might not exist anymore
+        # Skip redactions that were already handled (sync retries, restarts)
+        if not await seen_events.claim(event.event_id, getattr(event, "timestamp", None)):
+            return
 
-        if redacted_event and redacted_event.type == EventType.REACTION:
-            await redact_reaction(room, redacted_event)
+        event_index.forget(redacted_event_id)
+        await redact_reaction(redacted_event_id)
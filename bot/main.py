@@ -1,5 +1,6 @@
-# bot.py
+# main.py
 
+import argparse
 import asyncio
 from pathlib import Path
 import importlib.util
@@ -14,29 +15,85 @@ _config = importlib.util.module_from_spec(_spec)
 _spec.loader.exec_module(_config)
 sys.modules["config"] = _config
 
-from core.client_manager import create_client
+from core.client_manager import create_client, upload_sync_filter
 from core.command_registry import load_commands
+from core.dedup import seen_events
 from core.event_router import register_event_handlers
+from core.grading import watch_answer_keys
+from core.answer_ingest import answer_ingest
+from core.outbox import outbox
+from core.question_index import question_index
+from core.question_scheduler import question_scheduler
+from core.reaction_buffer import reaction_buffer
+from core.state_manager import state_manager
+from core.stats_log import stats_logger
 from core.db.constants import DB_MODULES
 
 from config import DB_TYPE
 
-async def main():
+def parse_args():
+    parser = argparse.ArgumentParser(description="UGR Matrix Bot")
+    parser.add_argument(
+        "--full-resync",
+        action="store_true",
+        help="Ignora el token de sincronización guardado y descarga el estado completo de las salas.",
+    )
+    parser.add_argument(
+        "--migrate",
+        action="store_true",
+        help="Aplica las migraciones pendientes del esquema de la base de datos antes de arrancar.",
+    )
+    return parser.parse_args()
+
+
+async def main(args):
     db_conn = DB_MODULES[DB_TYPE]["conn"]
-    await db_conn.connect()
+    try:
+        await db_conn.connect(migrate=args.migrate)
+    except db_conn.SchemaMismatchError as e:
+        print(f"[!] {e}")
+        return
     client = await create_client()
+    if args.full_resync:
+        await client.sync_store.reset()
+    # Solo se pide el estado completo si no hay un token desde el que continuar
+    full_state = not await client.sync_store.get_next_batch()
+    outbox.bind(client)
+    await seen_events.load()
+    await state_manager.restore()
+    await question_index.load()
     load_commands()
-    register_event_handlers(client)
+    dispatcher = register_event_handlers(client)
+    client.sync_store.bind(dispatcher)
+    dispatcher.start()
+    sync_filter = await upload_sync_filter(client, dispatcher.event_types)
+    reaction_buffer.start()
+    seen_events.start()
+    state_manager.start()
+    question_index.start()
+    question_scheduler.start()
+    watch_answer_keys()
+    stats_logger.start()
 
     print("[*] Bot iniciado — escuchando mensajes...")
     try:
-        await client.sync_forever(timeout=30000, full_state=True)
+        await client.sync_forever(timeout=30000, sync_filter=sync_filter, full_state=full_state)
     except KeyboardInterrupt:
         print("[*] Bot detenido por usuario")
     finally:
+        await stats_logger.close()
+        await dispatcher.stop()
+        await answer_ingest.close()
+        await outbox.close()
+        await reaction_buffer.close()
+        await seen_events.close()
+        await state_manager.close()
+        await question_scheduler.close()
+        await question_index.close()
+        await client.sync_store.flush(final=True)
         await client.close()
         await db_conn.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(main(parse_args()))
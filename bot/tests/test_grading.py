@@ -0,0 +1,52 @@
+# tests/test_grading.py
+"""Pruebas de la corrección de respuestas numéricas (core/grading.py)."""
+
+import unittest
+from decimal import Decimal
+
+from core.grading import Grader, number_readings, parse_number
+
+
+class ParseNumberTests(unittest.TestCase):
+    def test_decimal_separators(self):
+        self.assertEqual(parse_number("3,14"), Decimal("3.14"))
+        self.assertEqual(parse_number("3.14"), Decimal("3.14"))
+        self.assertEqual(parse_number("-2e3"), Decimal("-2000"))
+        self.assertEqual(parse_number("1 000.5"), Decimal("1000.5"))
+
+    def test_grouped_thousands(self):
+        self.assertEqual(parse_number("1.000.000"), Decimal("1000000"))
+        self.assertEqual(parse_number("1,000,000.25"), Decimal("1000000.25"))
+        self.assertEqual(parse_number("1.000,5"), Decimal("1000.5"))
+
+    def test_single_group_prefers_decimal_reading(self):
+        self.assertEqual(number_readings("1.500"), (Decimal("1.5"), Decimal("1500")))
+        self.assertEqual(parse_number("3.142"), Decimal("3.142"))
+        self.assertEqual(parse_number("9.810"), Decimal("9.81"))
+        self.assertEqual(number_readings("0.500"), (Decimal("0.5"),))
+
+    def test_malformed_separators_are_not_numbers(self):
+        for text in ("1.2.3", "1,5,6", "1,00.5", "1.000,5,3", "abc", "1e400"):
+            with self.subTest(text=text):
+                self.assertIsNone(parse_number(text))
+
+
+class NumericGraderTests(unittest.TestCase):
+    def test_tolerance_bound_is_inclusive(self):
+        grader = Grader("numeric", "9,8 ± 0,1")
+        self.assertTrue(grader.grade("9,7"))
+        self.assertTrue(grader.grade("9.9"))
+        self.assertFalse(grader.grade("9,91"))
+
+    def test_ambiguous_group_matches_either_reading(self):
+        self.assertTrue(Grader("numeric", "1.5").grade("1.500"))
+        self.assertTrue(Grader("numeric", "1500").grade("1.500"))
+        self.assertTrue(Grader("numeric", "3,142").grade("3.142"))
+        self.assertFalse(Grader("numeric", "123").grade("1.2.3"))
+
+    def test_non_numeric_answer_compared_as_text(self):
+        self.assertTrue(Grader("numeric", "infinito").grade("Infinito"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,6 +10,7 @@ Sincroniza usuarios y asignaturas de Moodle con Matrix y PostgreSQL.
 """
 
 import asyncio
+import importlib.util
 from pathlib import Path
 import aiohttp
 import asyncpg
@@ -27,6 +28,12 @@ from config import (MOODLE_URL, MOODLE_TOKEN,
 # ==============================
 # --- PostgreSQL ---
 PG_DSN = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Migraciones del esquema (se carga el módulo del bot directamente, sin tocar sys.path)
+_migrate_spec = importlib.util.spec_from_file_location(
+    "bot_migrate", Path(__file__).parent / "bot/core/db/postgres/migrate.py"
+)
+migrate = importlib.util.module_from_spec(_migrate_spec)
+_migrate_spec.loader.exec_module(migrate)
 # --- Parámetros generales ---
 INVITE_DELAY = 0.5
 ROOM_VISIBILITY = "private"
@@ -160,15 +167,9 @@ async def main():
 
         conn = None
         if not DRY_RUN:
-            # Conectar y crear esquema en la base de datos
+            # Conectar y aplicar las migraciones pendientes del esquema
             conn = await asyncpg.connect(PG_DSN)
-
-            schema_file = Path(__file__).parent / "bot/core/db/postgres/schema.sql"
-            if not schema_file.exists():
-                raise FileNotFoundError(f"No se encontró {schema_file}")
-        
-            sql = schema_file.read_text()
-            await conn.execute(sql)
+            await migrate.apply_migrations(conn)
 
         for course in courses:
             cid = course["id"]
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+from django.core import checks
+
+
+class DashboardConfig(AppConfig):
+    name = 'dashboard'
+
+    def ready(self):
+        from .schema import check_bot_schema
+
+        checks.register(check_bot_schema, checks.Tags.database)
@@ -0,0 +1,89 @@
+"""Bot database schema version check.
+
+The bot owns the ``bot_db`` schema and evolves it through numbered migration
+files (``NNNN_name.sql``) recorded in the ``schema_migrations`` table. The
+dashboard only reads and writes that schema through unmanaged models, so it
+must refuse to run against a database that is not exactly at the version the
+bot code expects.
+"""
+
+import re
+from pathlib import Path
+from typing import Optional
+
+from django.conf import settings
+from django.core.checks import Error
+from django.core.exceptions import ImproperlyConfigured
+from django.db import ProgrammingError, connections
+
+MIGRATION_FILE_RE = re.compile(r"^(\d{4})_\w+\.sql$")
+MIGRATIONS_TABLE = "schema_migrations"
+# PostgreSQL SQLSTATE for "relation does not exist"
+UNDEFINED_TABLE = "42P01"
+
+
+def migrations_dir() -> Path:
+    """Return the folder holding the bot migrations (``BOT_MIGRATIONS_DIR`` setting)."""
+    default = Path(settings.BASE_DIR).parent / "bot" / "core" / "db" / "postgres" / "migrations"
+    return Path(getattr(settings, "BOT_MIGRATIONS_DIR", default))
+
+
+def expected_schema_version(directory: Optional[Path] = None) -> int:
+    """Return the highest migration number shipped with the bot (0 if none)."""
+    directory = directory or migrations_dir()
+    versions = [
+        int(match.group(1))
+        for match in (MIGRATION_FILE_RE.match(p.name) for p in directory.iterdir())
+        if match
+    ]
+    return max(versions, default=0)
+
+
+def current_schema_version(using: str = "bot_db") -> int:
+    """Return the schema version applied to the bot database (0 if never migrated).
+
+    Only a missing ``schema_migrations`` table counts as version 0; connection
+    and other database errors propagate instead of passing for an empty schema.
+    """
+    try:
+        with connections[using].cursor() as cursor:
+            cursor.execute(f"SELECT COALESCE(MAX(version), 0) FROM {MIGRATIONS_TABLE}")
+            return cursor.fetchone()[0]
+    except ProgrammingError as exc:
+        pgcode = getattr(exc.__cause__, "pgcode", None)
+        if pgcode is not None and pgcode != UNDEFINED_TABLE:
+            raise
+        # Missing table: the database was never migrated
+        return 0
+
+
+def schema_mismatch_message(using: str = "bot_db") -> Optional[str]:
+    """Describe the schema mismatch, or return ``None`` when the versions agree."""
+    current, expected = current_schema_version(using), expected_schema_version()
+    if current == expected:
+        return None
+    return (
+        f"The bot database schema is at version {current} but version {expected} "
+        f"is expected. Run `python bot/main.py --migrate`."
+    )
+
+
+def check_bot_schema(app_configs=None, databases=None, **kwargs):
+    """System check (``dashboard.E001``) reporting a bot schema mismatch.
+
+    Registered with the ``database`` tag, so it only runs when Django is asked
+    to check databases (``check --database bot_db``, ``migrate``).
+    """
+    if databases is not None and "bot_db" not in databases:
+        return []
+    message = schema_mismatch_message()
+    if message is None:
+        return []
+    return [Error(message, id="dashboard.E001")]
+
+
+def verify_bot_schema() -> None:
+    """Raise ``ImproperlyConfigured`` when the bot schema does not match."""
+    message = schema_mismatch_message()
+    if message is not None:
+        raise ImproperlyConfigured(message)
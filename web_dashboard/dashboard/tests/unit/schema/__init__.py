@@ -0,0 +1 @@
+# package for unit schema tests
@@ -0,0 +1,68 @@
+"""Unit tests for the bot schema version check in `dashboard.schema`."""
+
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError, ProgrammingError
+from django.test import SimpleTestCase, override_settings
+
+from dashboard import schema
+
+
+class SchemaVersionTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        for name in ('0001_initial.sql', '0002_add_index.sql', 'README.md', '12_bad.sql'):
+            (self.dir / name).write_text('')
+        override = override_settings(BOT_MIGRATIONS_DIR=self.dir)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def _patch_cursor(self, version=None, error=None):
+        cursor = mock.MagicMock()
+        cursor.__enter__.return_value = cursor
+        if error is not None:
+            cursor.execute.side_effect = error
+        cursor.fetchone.return_value = (version,)
+        conn = mock.MagicMock()
+        conn.cursor.return_value = cursor
+        return mock.patch.object(schema, 'connections', {'bot_db': conn})
+
+    def test_expected_version_ignores_unrelated_files(self):
+        self.assertEqual(schema.expected_schema_version(), 2)
+
+    def test_current_version_missing_table_is_zero(self):
+        with self._patch_cursor(error=ProgrammingError('relation does not exist')):
+            self.assertEqual(schema.current_schema_version(), 0)
+
+    def test_current_version_connection_error_propagates(self):
+        with self._patch_cursor(error=OperationalError('could not connect to server')):
+            with self.assertRaises(OperationalError):
+                schema.current_schema_version()
+
+    def test_current_version_other_programming_error_propagates(self):
+        error = ProgrammingError('permission denied for table schema_migrations')
+        error.__cause__ = mock.Mock(pgcode='42501')
+        with self._patch_cursor(error=error):
+            with self.assertRaises(ProgrammingError):
+                schema.current_schema_version()
+
+    def test_check_passes_at_head(self):
+        with self._patch_cursor(version=2):
+            self.assertEqual(schema.check_bot_schema(databases=['bot_db']), [])
+            schema.verify_bot_schema()
+
+    def test_check_reports_mismatch(self):
+        with self._patch_cursor(version=1):
+            errors = schema.check_bot_schema(databases=['bot_db'])
+            self.assertEqual([e.id for e in errors], ['dashboard.E001'])
+            with self.assertRaises(ImproperlyConfigured):
+                schema.verify_bot_schema()
+
+    def test_check_skipped_for_other_databases(self):
+        with self._patch_cursor(version=1):
+            self.assertEqual(schema.check_bot_schema(databases=['default']), [])
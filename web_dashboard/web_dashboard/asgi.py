@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'web_dashboard.settings')
 
 application = get_asgi_application()
+
+# Refuse to serve requests against a bot database on another schema version
+from dashboard.schema import verify_bot_schema  # noqa: E402
+
+verify_bot_schema()